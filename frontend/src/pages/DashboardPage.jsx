@@ -52,37 +52,22 @@ export default function DashboardPage() {
       return
     }
     
-    // Fetch habits and inventory data
+    // Fetch habits and inventory data in one bootstrap request
     const fetchUserData = async () => {
       try {
-        // Fetch habits
-        const habitsResponse = await fetch("http://127.0.0.1:5000/habits", {
+        const dashboardResponse = await fetch("http://127.0.0.1:5000/dashboard", {
           method: "GET",
           headers: {
             "Authorization": `Bearer ${authToken}`
           }
         })
         
-        if (habitsResponse.ok) {
-          const habitsData = await habitsResponse.json()
-          setHabits(habitsData.habits || [])
+        if (dashboardResponse.ok) {
+          const dashboardData = await dashboardResponse.json()
+          setHabits(dashboardData.habits || [])
+          setCoins(dashboardData.inventory?.coins || 0)
         } else {
-          console.error("Failed to fetch habits")
-        }
-        
-        // Fetch inventory (for coins)
-        const inventoryResponse = await fetch("http://127.0.0.1:5000/inventory", {
-          method: "GET",
-          headers: {
-            "Authorization": `Bearer ${authToken}`
-          }
-        })
-        
-        if (inventoryResponse.ok) {
-          const inventoryData = await inventoryResponse.json()
-          setCoins(inventoryData.coins || 0)
-        } else {
-          console.error("Failed to fetch inventory")
+          console.error("Failed to fetch dashboard")
         }
         
         setIsLoaded(true)
@@ -47,236 +47,13 @@ export default function ShopPage() {
           setOwnedItems(inventoryData.items || [])
         }
         
-        // Set predefined shop items
-        setShopItems([
-          {
-            id: "theme-1",
-            name: "Dark Minimal Theme",
-            description: "Sleek dark theme with minimalist design",
-            price: 120,
-            category: "themes",
-            image: "/themes/dark-minimal.png",
-            rarity: "rare",
-            themeId: "darkMinimal",
-          },
-          {
-            id: "theme-2",
-            name: "Neon Synthwave Theme",
-            description: "Vibrant neon colors with retro synthwave aesthetics",
-            price: 150,
-            category: "themes",
-            image: "/themes/synthwave-theme.png",
-            rarity: "epic",
-            themeId: "neonSynthwave",
-          },
-          {
-            id: "theme-3",
-            name: "Calm Pastel Theme",
-            description: "Soft pastel colors for a calm experience",
-            price: 100,
-            category: "themes",
-            image: "/themes/pastel-theme.png",
-            rarity: "uncommon",
-            themeId: "calmPastel",
-          },
-          {
-            id: "theme-4",
-            name: "Nature Theme",
-            description: "Calming green tones inspired by forests and nature",
-            price: 120,
-            category: "themes",
-            image: "/themes/nature-theme.png",
-            rarity: "rare",
-            themeId: "nature",
-          },
-          {
-            id: "theme-5",
-            name: "Ocean Theme",
-            description: "Serene blue gradients reminiscent of ocean depths",
-            price: 120,
-            category: "themes",
-            image: "/themes/ocean-theme.png",
-            rarity: "rare",
-            themeId: "ocean",
-          },
-          {
-            id: "theme-6",
-            name: "Midnight Galaxy Theme",
-            description: "Deep space-inspired theme with stars and galaxies",
-            price: 180,
-            category: "themes",
-            image: "/themes/galaxy-theme.png",
-            rarity: "epic",
-            themeId: "midnightGalaxy",
-          },
-          {
-            id: "theme-7",
-            name: "Cyberpunk Theme",
-            description: "High-tech, low-life aesthetic with neon and dystopian vibes",
-            price: 200,
-            category: "themes",
-            image: "/themes/cyberpunk-theme.png",
-            rarity: "legendary",
-            themeId: "cyberpunk",
-          },
-          {
-            id: "theme-8",
-            name: "Minimalist Light Theme",
-            description: "Clean, bright interface with subtle accents for a distraction-free experience",
-            price: 120,
-            category: "themes",
-            image: "/themes/minimalist-light.png",
-            rarity: "rare",
-            themeId: "minimalistLight",
-          },
-          {
-            id: "theme-9",
-            name: "Sunset Gradient Theme",
-            description: "Warm sunset colors transitioning from orange to purple",
-            price: 140,
-            category: "themes",
-            image: "/themes/sunset-gradient.png",
-            rarity: "epic",
-            themeId: "sunsetGradient",
-          },
-          {
-            id: "theme-10",
-            name: "Forest Mist Theme",
-            description: "Foggy forest-inspired colors with a serene atmosphere",
-            price: 130,
-            category: "themes",
-            image: "/themes/forest-mist.png",
-            rarity: "rare",
-            themeId: "forestMist",
-          },
-          {
-            id: "theme-11",
-            name: "Desert Sands Theme",
-            description: "Warm and earthy tones inspired by desert landscapes",
-            price: 110,
-            category: "themes",
-            image: "/themes/desert-sands.png",
-            rarity: "uncommon",
-            themeId: "desertSands",
-          },
-          {
-            id: "theme-12",
-            name: "Cherry Blossom Theme",
-            description: "Delicate pink and white colors inspired by Japanese sakura",
-            price: 160,
-            category: "themes",
-            image: "/themes/cherry-blossom.png",
-            rarity: "epic",
-            themeId: "cherryBlossom",
-          },
-          {
-            id: "theme-13",
-            name: "Monochrome Theme",
-            description: "Classic black and white interface with sharp contrast",
-            price: 90,
-            category: "themes",
-            image: "/themes/monochrome.png",
-            rarity: "uncommon",
-            themeId: "monochrome",
-          },
-          {
-            id: "theme-14",
-            name: "Northern Lights Theme",
-            description: "Inspired by the aurora borealis with cyan, green, and violet",
-            price: 190,
-            category: "themes",
-            image: "/themes/northern-lights.png",
-            rarity: "legendary",
-            themeId: "northernLights",
-          },
-          {
-            id: "theme-15",
-            name: "Vintage Paper Theme",
-            description: "Old-school aesthetic with warm papyrus tones and aged details",
-            price: 150,
-            category: "themes",
-            image: "/themes/vintage-paper.png",
-            rarity: "epic",
-            themeId: "vintagePaper",
-          },
-          {
-            id: "powerup-1",
-            name: "Streak Shield",
-            description: "Protects your streak once if you miss a day",
-            price: 150,
-            category: "powerups",
-            image: "/powerups/streak-shield.png",
-            rarity: "epic",
-            usageLimit: 1,
-          },
-          {
-            id: "powerup-2",
-            name: "2x Coin Multiplier",
-            description: "Double your coin earnings for completed habits for 3 days",
-            price: 250,
-            category: "powerups",
-            image: "/powerups/coin-multiplier.png",
-            rarity: "epic",
-            duration: "3 days",
-          },
-          {
-            id: "powerup-3",
-            name: "Flexible Day",
-            description: "Mark a habit as complete without actually doing it",
-            price: 100,
-            category: "powerups",
-            image: "/powerups/flexible-day.png",
-            rarity: "rare",
-            usageLimit: 3,
-          },
-          {
-            id: "powerup-4",
-            name: "All-in-One",
-            description: "Complete all your habits at once with a single click",
-            price: 200,
-            category: "powerups",
-            image: "/powerups/all-in-one.png",
-            rarity: "epic",
-            usageLimit: 1,
-          },
-          {
-            id: "powerup-5",
-            name: "Bonus Coins",
-            description: "Instantly receive 50 bonus coins",
-            price: 100,
-            category: "powerups",
-            image: "/powerups/bonus-coins.png",
-            rarity: "uncommon",
-            usageLimit: 1,
-          },
-          {
-            id: "background-1",
-            name: "Mountain Landscape",
-            description: "A serene mountain landscape for your dashboard background",
-            price: 80,
-            category: "backgrounds",
-            image: "/backgrounds/mountain.png",
-            rarity: "uncommon",
-          },
-          {
-            id: "background-2",
-            name: "Space Background",
-            description: "A stunning space background with stars and nebulae",
-            price: 90,
-            category: "backgrounds",
-            image: "/backgrounds/space.png",
-            rarity: "uncommon",
-          },
-          {
-            id: "background-3",
-            name: "Urban Cityscape",
-            description: "Modern city skyline for an urban aesthetic",
-            price: 85,
-            category: "backgrounds",
-            image: "/backgrounds/cityscape.png",
-            rarity: "uncommon",
-          },
-        ])
+        // Fetch shop items from the server-side catalog
+        const catalogResponse = await fetch("http://127.0.0.1:5000/shop/catalog")
+        
+        if (catalogResponse.ok) {
+          const catalogData = await catalogResponse.json()
+          setShopItems(catalogData.items || [])
+        }
         
         setIsLoaded(true)
       } catch (error) {
@@ -78,6 +78,7 @@ export default function SignupPage() {
           email,
           password,
           name,
+          timezone: Intl.DateTimeFormat().resolvedOptions().timeZone,
         }),
       });
   
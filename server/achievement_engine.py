@@ -0,0 +1,295 @@
+# achievement_engine.py - incremental achievement tracking
+#
+# Instead of re-summing every habit and walking every achievement on each
+# completion, each user_achievements document keeps running counters:
+#
+#   counters: {
+#       totalCompletions: int,          # $inc on every completion
+#       longestStreak:    int,          # $max with the new streak
+#       categories:       {cat: int}    # $inc per habit category
+#       longestPerfectRun: int          # $max, days on which every habit
+#   }                                   # was completed (see below)
+#
+# and a compact map of the achievements the user has earned:
+#
+#   earned: {achievement id: {earnedAt: iso string, claimed: bool}}
+#
+# Names, descriptions, images and thresholds live only in the in-memory
+# catalog (default_achievements.py), which is merged with the user's state
+# when achievements are read; progress is derived from the counters. The
+# catalog is indexed by counter and threshold, so a completion only looks
+# at the thresholds between the old and new counter values and only
+# touches the achievements it actually earns.
+#
+# A catalog entry counts against its category's counter unless it names
+# another `counter`. Perfect Week counts longestPerfectRun, which no single
+# habit knows: with the history collection passed in, record_completions
+# reads the last few days of the user's history buckets (habit_stats) and
+# folds the longest perfect run among them into the same counter update.
+# The task path always passes it; the inline path (TASK_WORKERS=0) does
+# too, at the cost of those two reads in the request.
+#
+# Completions may also be recorded later by a background task (see tasks);
+# such an update carries the task id, and the last APPLIED_TASKS ids are
+# kept in `tasks` so a retried task is counted once.
+#
+# Functions taking collections are repository generators (see repository).
+
+from bisect import bisect_right
+from datetime import datetime, timezone
+
+from pymongo import ReturnDocument
+
+import habit_stats
+import versions
+from default_achievements import DEFAULT_ACHIEVEMENTS
+from errors import ApiError
+
+
+def counter_key(category):
+    if category == 'habits':
+        return 'totalCompletions'
+    if category == 'streaks':
+        return 'longestStreak'
+    # any other category string must match a habit.category
+    return f'categories.{category}'
+
+
+def achievement_counter(ach):
+    return ach.get('counter') or counter_key(ach.get('category'))
+
+
+def safe_category(category):
+    # Categories become field names inside counters.categories
+    return isinstance(category, str) and category and '.' not in category and not category.startswith('$')
+
+
+def build_threshold_index(achievements):
+    index = {}
+    for ach in achievements:
+        index.setdefault(achievement_counter(ach), []).append((ach.get('total', 0), ach['id']))
+    for entries in index.values():
+        entries.sort()
+    return index
+
+
+# Per-user fields in DEFAULT_ACHIEVEMENTS (earned, progress, ...) are not
+# part of the catalog; `counter` is not sent to clients
+CATALOG_FIELDS = ('id', 'name', 'description', 'category', 'image', 'rarity', 'total', 'coinReward', 'counter')
+PERFECT_RUN = 'longestPerfectRun'
+
+
+class AchievementCatalog:
+    def __init__(self, achievements):
+        self.load(achievements)
+
+    def load(self, achievements):
+        entries = [{key: ach[key] for key in CATALOG_FIELDS if key in ach} for ach in achievements]
+        by_id = {ach['id']: ach for ach in entries}
+        # swap in one assignment so readers never see a half-built catalog
+        self._state = (entries, by_id, build_threshold_index(entries))
+
+    def __iter__(self):
+        return iter(self._state[0])
+
+    def get(self, achievement_id):
+        return self._state[1].get(achievement_id)
+
+    @property
+    def thresholds(self):
+        return self._state[2]
+
+
+catalog = AchievementCatalog(DEFAULT_ACHIEVEMENTS)
+
+APPLIED_TASKS = 20
+
+
+class AchievementError(ApiError):
+    pass
+
+
+def counter_value(counters, key):
+    value = counters or {}
+    for part in key.split('.'):
+        value = value.get(part, 0) if isinstance(value, dict) else 0
+    return value or 0
+
+
+def crossed(key, old, new):
+    # Achievement ids whose threshold lies in (old, new]
+    entries = catalog.thresholds.get(key, [])
+    lo = bisect_right(entries, (old, chr(0x10FFFF)))
+    hi = bisect_right(entries, (new, chr(0x10FFFF)))
+    return [ach_id for _, ach_id in entries[lo:hi]]
+
+
+def progress_for(ach, counters):
+    return min(counter_value(counters, achievement_counter(ach)), ach.get('total', 0))
+
+
+def empty_counters():
+    return {'totalCompletions': 0, 'longestStreak': 0, 'categories': {}}
+
+
+def counters_from_habits(habits):
+    counters = empty_counters()
+    for h in habits:
+        done = h.get('totalCompletions', 0)
+        counters['totalCompletions'] += done
+        counters['longestStreak'] = max(counters['longestStreak'], h.get('streak', 0))
+        cat = h.get('category')
+        if safe_category(cat):
+            counters['categories'][cat] = counters['categories'].get(cat, 0) + done
+    return counters
+
+
+def merge(ach, counters, state):
+    # Catalog entry + the user's state, in the shape clients get
+    state = state or {}
+    return dict(
+        {key: value for key, value in ach.items() if key != 'counter'},
+        earned=bool(state),
+        earnedDate=state.get('earnedAt'),
+        progress=progress_for(ach, counters),
+        claimed=state.get('claimed', False)
+    )
+
+
+def reached(counters):
+    # Ids of every achievement the counters have reached
+    return [ach_id for key, entries in catalog.thresholds.items()
+            for total, ach_id in entries if counter_value(counters, key) >= total]
+
+
+def user_achievements(counters, earned):
+    earned = earned or {}
+    return [merge(ach, counters, earned.get(ach['id'])) for ach in catalog]
+
+
+def earned_state(earned_at, claimed=False):
+    return {'earnedAt': earned_at, 'claimed': claimed}
+
+
+def mark_earned(achievements_collection, user_email, achievement_ids, now_iso=None):
+    if not achievement_ids:
+        return
+    now_iso = now_iso or datetime.now(timezone.utc).isoformat()
+
+    # $min keeps the first earnedAt when an achievement is marked twice;
+    # claimed is only ever set by claiming
+    yield achievements_collection.update_one(
+        {'user_email': user_email},
+        versions.stamp({'$min': {f'earned.{ach_id}.earnedAt': now_iso for ach_id in achievement_ids}})
+    )
+
+
+def rebuild_counters(achievements_collection, user_email, habits):
+    # Full recompute: used to backfill documents created before counters
+    # existed (or missing), or to repair them. Not on the completion path.
+    # The perfect run is not derived from habits and is left as it is.
+    counters = counters_from_habits(habits)
+    doc = yield achievements_collection.find_one_and_update(
+        {'user_email': user_email},
+        versions.stamp({
+            '$set': {f'counters.{key}': value for key, value in counters.items()},
+            '$setOnInsert': {'earned': {}}
+        }),
+        projection={'_id': False, 'counters': True},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+    counters = (doc or {}).get('counters', counters)
+    yield from mark_earned(achievements_collection, user_email, reached(counters))
+    return counters
+
+
+def perfect_run_window():
+    # Days of history that decide every perfect-run achievement, plus one
+    # so a task that runs after midnight still sees the run that ended
+    # yesterday
+    totals = [total for total, _ in catalog.thresholds.get(PERFECT_RUN, [])]
+    return max(totals) + 1 if totals else 0
+
+
+def record_completion(achievements_collection, user_email, habit, habits_collection=None, history_collection=None):
+    return (yield from record_completions(
+        achievements_collection, user_email, [habit], habits_collection, history_collection=history_collection
+    ))
+
+
+def record_completions(achievements_collection, user_email, habits, habits_collection=None, task_id=None,
+                       history_collection=None):
+    # One counter update for any number of just-completed habits (each
+    # counted once, with its new streak); `task_id` makes it a no-op when
+    # that task was already applied. With `history_collection` (and
+    # habits_collection) the user's perfect run is brought up to date too.
+    inc = {'counters.totalCompletions': len(habits)}
+    per_category = {}
+    for habit in habits:
+        cat = habit.get('category')
+        if safe_category(cat):
+            per_category[cat] = per_category.get(cat, 0) + 1
+    for cat, count in per_category.items():
+        inc[f'counters.categories.{cat}'] = count
+    streak = max((habit.get('streak', 0) for habit in habits), default=0)
+
+    maximums = {'counters.longestStreak': streak}
+    window = perfect_run_window()
+    perfect_run = 0
+    if window and history_collection is not None and habits_collection is not None:
+        perfect_run = yield from habit_stats.longest_perfect_run(
+            habits_collection, history_collection, user_email, window
+        )
+        maximums[f'counters.{PERFECT_RUN}'] = perfect_run
+
+    query = {'user_email': user_email, 'counters': {'$exists': True}}
+    update = versions.stamp({'$inc': inc, '$max': maximums})
+    if task_id is not None:
+        query['tasks'] = {'$ne': task_id}
+        update['$push'] = {'tasks': {'$each': [task_id], '$slice': -APPLIED_TASKS}}
+
+    before = yield achievements_collection.find_one_and_update(
+        query,
+        update,
+        projection={'_id': False, 'counters': True},
+        return_document=ReturnDocument.BEFORE
+    )
+
+    if before is None and task_id is not None:
+        applied = yield achievements_collection.find_one(
+            {'user_email': user_email, 'tasks': task_id}, {'_id': False, 'counters': True}
+        )
+        if applied:
+            # the task ran before but may have stopped short of marking
+            yield from mark_earned(achievements_collection, user_email, reached(applied.get('counters')))
+            return []
+
+    if before is None:
+        # Document predates counters (or is missing): seed it once from habits
+        if habits_collection is None:
+            return []
+        user_doc = (yield habits_collection.find_one({'user_email': user_email}, {'habits': True})) or {}
+        yield from rebuild_counters(achievements_collection, user_email, user_doc.get('habits', []))
+        return []
+
+    counters = before['counters']
+    earned = []
+
+    old_total = counter_value(counters, 'totalCompletions')
+    earned += crossed('totalCompletions', old_total, old_total + len(habits))
+
+    old_streak = counter_value(counters, 'longestStreak')
+    earned += crossed('longestStreak', old_streak, max(old_streak, streak))
+
+    old_run = counter_value(counters, PERFECT_RUN)
+    earned += crossed(PERFECT_RUN, old_run, max(old_run, perfect_run))
+
+    for cat, count in per_category.items():
+        key = f'categories.{cat}'
+        old_cat = counter_value(counters, key)
+        earned += crossed(key, old_cat, old_cat + count)
+
+    yield from mark_earned(achievements_collection, user_email, earned)
+    return earned
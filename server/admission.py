@@ -0,0 +1,211 @@
+# admission.py - per-client rate limits and a global concurrency limit
+#
+# Every request is admitted (or not) before it reaches a view:
+#
+#   1. Token buckets, one per client: the JWT identity when the request
+#      carries a valid access token, the remote address otherwise. A
+#      bucket holds up to ADMISSION_BURST tokens and refills at
+#      ADMISSION_RATE per second; a request takes its route's cost (bcrypt
+#      routes cost more, see ROUTE_COSTS / ADMISSION_ROUTE_COSTS). An
+#      empty bucket gets 429 with Retry-After set to when it will have
+#      enough again.
+#   2. A process-wide limit of ADMISSION_MAX_IN_FLIGHT concurrent requests.
+#      Beyond it requests fail fast with 503 + Retry-After instead of
+#      queueing until every request is slow.
+#
+# Buckets live in memory, per process, in an LRU of at most
+# ADMISSION_MAX_KEYS clients. Decisions are counted in metrics. Behind a
+# proxy, make remote_addr the client address (e.g. werkzeug's ProxyFix).
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+import metrics
+
+# 'METHOD rule' -> tokens; anything else costs 1
+ROUTE_COSTS = {
+    'POST /login': 10,
+    'POST /register': 10,
+    'GET /user/stats': 2,
+    'GET /dashboard': 2,
+}
+
+# never limited: scrapers (checked by metrics.scrape_allowed) and CORS preflights
+EXEMPT_PATHS = ('/metrics',)
+EXEMPT_METHODS = ('OPTIONS',)
+
+
+class TokenBuckets:
+    def __init__(self, rate, burst, max_keys=100000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        # key -> (tokens, last refill), least recently used first
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, cost):
+        # 0 if admitted, else seconds until the bucket holds `cost` tokens
+        cost = min(cost, self.burst)
+        now = self.clock()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                # a forgotten client starts again with a full bucket
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class ConcurrencyLimit:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            metrics.admission_in_flight.set((), self.in_flight)
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            metrics.admission_in_flight.set((), self.in_flight)
+
+
+def parse_costs(raw):
+    # 'POST /login=10,GET /dashboard=2'
+    costs = {}
+    for entry in (raw or '').split(','):
+        route, _, cost = entry.rpartition('=')
+        if route.strip():
+            costs[' '.join(route.split())] = float(cost)
+    return costs
+
+
+class Admission:
+    def __init__(self, rate=10, burst=20, costs=None, max_in_flight=0, max_keys=100000):
+        self.costs = dict(ROUTE_COSTS, **(costs or {}))
+        self.buckets = TokenBuckets(rate, burst, max_keys) if rate > 0 else None
+        self.concurrency = ConcurrencyLimit(max_in_flight) if max_in_flight > 0 else None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            rate=float(settings.get('ADMISSION_RATE', 10)),
+            burst=float(settings.get('ADMISSION_BURST', 20)),
+            costs=parse_costs(settings.get('ADMISSION_ROUTE_COSTS')),
+            max_in_flight=int(settings.get('ADMISSION_MAX_IN_FLIGHT', 0) or 0),
+            max_keys=int(settings.get('ADMISSION_MAX_KEYS', 100000))
+        )
+
+    def cost(self, method, rule):
+        return self.costs.get(f'{method} {rule}', 1)
+
+    def admit(self, client, method, rule):
+        # (status, retry after seconds) to reject with, or None; an admitted
+        # request holds a concurrency slot until release()
+        endpoint = rule or 'unmatched'
+        if self.buckets is not None:
+            wait = self.buckets.take(client, self.cost(method, rule))
+            if wait:
+                metrics.admission_decisions.inc((endpoint, 'rate_limited'))
+                return 429, max(1, math.ceil(wait))
+        if self.concurrency is not None and not self.concurrency.acquire():
+            metrics.admission_decisions.inc((endpoint, 'shed'))
+            return 503, 1
+        metrics.admission_decisions.inc((endpoint, 'admitted'))
+        return None
+
+    def release(self):
+        if self.concurrency is not None:
+            self.concurrency.release()
+
+
+def client_key(authorization, remote_addr, secret):
+    # 'user:<email>' for a valid access token, else 'ip:<address>'; a
+    # forged or expired token is limited by address like any anonymous call
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme == 'Bearer' and token and secret:
+        try:
+            claims = jwt.decode(token, secret, algorithms=['HS256'])
+            if claims.get('sub'):
+                return f"user:{claims['sub']}"
+        except jwt.InvalidTokenError:
+            pass
+    return f'ip:{remote_addr}'
+
+
+def _exempt(method, path):
+    return method in EXEMPT_METHODS or path in EXEMPT_PATHS
+
+
+def init_app(app):
+    # Flask: call after metrics.init_app, so rejected requests are timed
+    from flask import jsonify, request
+
+    admission = app.extensions['admission'] = Admission.from_settings(app.config)
+
+    @app.before_request
+    def _admit():
+        if _exempt(request.method, request.path):
+            return None
+        rule = request.url_rule.rule if request.url_rule else None
+        client = client_key(request.headers.get('Authorization'), request.remote_addr, app.config['JWT_SECRET_KEY'])
+        rejected = admission.admit(client, request.method, rule)
+        if rejected:
+            return _rejection(jsonify, *rejected)
+        request.environ['momentum.admitted'] = True
+        return None
+
+    @app.teardown_request
+    def _release(exc):
+        if request.environ.pop('momentum.admitted', False):
+            admission.release()
+
+
+def init_quart_app(app):
+    # Same for the ASGI app
+    from quart import g, jsonify, request
+
+    admission = app.extensions['admission'] = Admission.from_settings(app.config)
+
+    @app.before_request
+    async def _admit():
+        if _exempt(request.method, request.path):
+            return None
+        rule = request.url_rule.rule if request.url_rule else None
+        client = client_key(request.headers.get('Authorization'), request.remote_addr, app.config['JWT_SECRET_KEY'])
+        rejected = admission.admit(client, request.method, rule)
+        if rejected:
+            return _rejection(jsonify, *rejected)
+        g.momentum_admitted = True
+        return None
+
+    @app.teardown_request
+    async def _release(exc):
+        if g.pop('momentum_admitted', False):
+            admission.release()
+
+
+def _rejection(jsonify, status, retry_after):
+    message = 'Too many requests, please slow down' if status == 429 else 'Server busy, please retry'
+    response = jsonify({'error': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
@@ -0,0 +1,279 @@
+# asgi.py - the API served over ASGI with an async MongoDB driver
+#
+# The same route table as app.py (see routes), but every view is a
+# coroutine and the handlers run on AsyncRepository, so a request waiting on
+# Mongo costs a suspended task instead of a thread. Tokens are issued and
+# checked by flask_jwt_extended, as in app.py, inside the app context of a
+# bare Flask app that only carries the JWT settings, so they are
+# interchangeable between the two servers.
+#
+# Like app.py, create_app(config) does not connect: each worker process
+# opens its own AsyncMongoClient when it starts serving.
+#
+#   cd server && uvicorn asgi:create_app --factory --port 8000 --workers 4
+
+from functools import wraps
+
+import jwt
+from dotenv import load_dotenv
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token, decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
+from pymongo import AsyncMongoClient
+from quart import Blueprint, Quart, current_app, g, jsonify, request
+from quart.json.provider import DefaultJSONProvider
+from quart_cors import cors
+from werkzeug.local import LocalProxy
+
+import config as app_config
+import admission
+import errors
+import idempotency
+import leaderboard
+import metrics
+import migrations
+import password_pool
+import repository
+import response_cache
+import response_encoding
+import routes
+import shop
+import tasks
+import transfer
+
+load_dotenv()
+
+api = Blueprint('api', __name__)
+
+cache = LocalProxy(lambda: current_app.extensions['response_cache'])
+
+
+def run(work):
+    return current_app.extensions['repo'].run(work)
+
+
+def token_app(settings):
+    app = Flask('tokens')
+    app.config.update(settings)
+    JWTManager(app)
+    return app
+
+
+def access_token(identity, claims):
+    with current_app.extensions['tokens'].app_context():
+        return create_access_token(identity=identity, additional_claims=claims)
+
+
+def jwt_required(fn):
+    # Mirrors flask_jwt_extended's status codes and {'msg': ...} bodies
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        header = request.headers.get('Authorization', '')
+        if not header:
+            return jsonify({'msg': 'Missing Authorization Header'}), 401
+        parts = header.split()
+        if len(parts) != 2 or parts[0] != 'Bearer':
+            return jsonify({'msg': "Bad Authorization header. Expected 'Authorization: Bearer <JWT>'"}), 422
+        try:
+            with current_app.extensions['tokens'].app_context():
+                claims = decode_token(parts[1])
+        except jwt.ExpiredSignatureError:
+            return jsonify({'msg': 'Token has expired'}), 401
+        except (jwt.InvalidTokenError, JWTExtendedException) as e:
+            return jsonify({'msg': str(e)}), 422
+        if claims.get('type') != 'access':
+            return jsonify({'msg': 'Only non-refresh tokens are allowed'}), 422
+        g.jwt = claims
+        return await fn(*args, **kwargs)
+    return wrapper
+
+
+def get_jwt_identity():
+    return g.jwt['sub']
+
+
+def get_jwt():
+    return g.jwt
+
+
+class JSONProvider(DefaultJSONProvider):
+    # See app.JSONProvider
+    def dumps(self, obj, **kwargs):
+        return response_encoding.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return response_encoding.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = response_encoding.response_obj(args, kwargs)
+        return self._app.response_class(response_encoding.dumps(obj), mimetype=self.mimetype)
+
+
+def cached(resource, per_timezone=False):
+    # See app.cached
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(*args, **kwargs):
+            if not cache.enabled:
+                return await view(*args, **kwargs)
+
+            variant = get_jwt().get('tz', 'UTC') if per_timezone else ''
+            variant += '?' + request.query_string.decode('latin-1')
+            key, entry = cache.lookup(get_jwt_identity(), resource, variant)
+            if entry is None:
+                response = await current_app.make_response(await view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                entry = cache.store(key, await response.get_data())
+
+            etag, body = entry
+            response = current_app.response_class(body, mimetype='application/json')
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response = await response.make_conditional(request)
+            if response.status_code == 304:
+                cache.not_modified(resource)
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidates(view):
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await view(*args, **kwargs)
+        finally:
+            cache.invalidate(get_jwt_identity())
+    return wrapper
+
+
+def idempotent(view):
+    # See app.idempotent
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        key = request.headers.get(idempotency.HEADER)
+        if key is None:
+            return await view(*args, **kwargs)
+
+        user_email = get_jwt_identity()
+        request_print = idempotency.fingerprint(request.method, request.path, await request.get_data())
+        stored = await run(idempotency.begin(repository.idempotency, user_email, key, request_print))
+
+        if stored is not None:
+            response = current_app.response_class(stored['body'], status=stored['status'], mimetype=stored['mimetype'])
+            response.headers[idempotency.REPLAY_HEADER] = 'true'
+            return response
+
+        try:
+            response = await current_app.make_response(await view(*args, **kwargs))
+        except errors.ApiError as e:
+            response = errors.response(jsonify, e)
+        except BaseException:
+            await run(idempotency.release(repository.idempotency, user_email, key))
+            raise
+        if response.status_code >= 500:
+            await run(idempotency.release(repository.idempotency, user_email, key))
+        else:
+            await run(idempotency.finish(
+                repository.idempotency, user_email, key,
+                response.status_code, await response.get_data(), response.mimetype
+            ))
+        return response
+    return wrapper
+
+
+def admin_required(view):
+    # See app.admin_required
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        admins = {e.strip() for e in (current_app.config.get('ADMIN_EMAILS') or '').split(',') if e.strip()}
+        if get_jwt_identity() not in admins:
+            return jsonify({'error': 'Admin access required'}), 403
+        return await view(*args, **kwargs)
+    return wrapper
+
+
+def view(route):
+    # See app.view
+    @wraps(route.handler)
+    async def handler(**kwargs):
+        claims = get_jwt() if route.login else {}
+        call = routes.Call(request.args, await request.get_json(silent=True), claims, current_app.extensions)
+        body, status = await run(route.handler(call, **kwargs))
+        return jsonify(body), status
+    return handler
+
+
+routes.add_routes(api, view, jwt_required, admin_required, cached, idempotent, invalidates)
+
+
+# Routes that build their own responses
+@api.route('/shop/catalog', methods=['GET'])
+async def get_shop_catalog():
+    response = current_app.response_class(shop.catalog.body, mimetype='application/json')
+    response.set_etag(shop.catalog.version)
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return await response.make_conditional(request)
+
+
+@api.route('/admin/export', methods=['GET'])
+@jwt_required
+@admin_required
+async def export_data():
+    collections = transfer.check_collections(request.args.getlist('collection'))
+
+    db = current_app.extensions['mongo'][current_app.config['MONGO_DB']]
+
+    async def body():
+        async for chunk in transfer.export_lines_async(db, collections):
+            yield chunk.encode('utf-8')
+
+    response = current_app.response_class(body(), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename="momentum-export.ndjson"'
+    return response
+
+
+def create_app(config=None):
+    settings = app_config.load(config)
+
+    app = Quart(__name__)
+    app.json = JSONProvider(app)
+    app.config.update(settings)
+    app.extensions['passwords'] = password_pool.PasswordPool()
+    app.extensions['response_cache'] = response_cache.ResponseCache.from_settings(settings)
+    app.extensions['leaderboard_cache'] = leaderboard.PageCache.from_settings(settings)
+    app.extensions['tokens'] = token_app(settings)
+    app.extensions['access_token'] = access_token
+
+    @app.before_serving
+    async def connect():
+        # The async client binds to the worker's running event loop
+        client = AsyncMongoClient(
+            settings['MONGO_URI'],
+            event_listeners=[metrics.command_listener],
+            **app_config.mongo_options(settings)
+        )
+        app.extensions['mongo'] = client
+        app.extensions['repo'] = repository.AsyncRepository(client[settings['MONGO_DB']])
+        # migrations run from the CLI or gunicorn's master (see migrations)
+        schema = await client[settings['MONGO_DB']]['schema_migrations'].find_one({'_id': migrations.SCHEMA_ID})
+        migrations.require_latest((schema or {}).get('version', 0))
+        app.extensions['tasks'].start_async(app.extensions['repo'])
+
+    @app.after_serving
+    async def disconnect():
+        await app.extensions['tasks'].stop_async()
+        await app.extensions.pop('mongo').close()
+        app.extensions['passwords'].shutdown()
+
+    app.register_blueprint(api)
+    errors.init_quart_app(app)
+    response_encoding.init_quart_app(app)
+    metrics.init_quart_app(app)
+    admission.init_quart_app(app)
+    tasks.init_quart_app(app)
+    return cors(app, allow_origin='*')
+
+
+app = create_app()
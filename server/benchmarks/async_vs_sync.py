@@ -0,0 +1,190 @@
+# async_vs_sync.py - the WSGI app (app.py) against the ASGI app (asgi.py)
+#
+# Starts both servers on the same MongoDB (MONGO_URI), registers a bench
+# user on each, then holds `--concurrency` connections open against each
+# server for `--duration` seconds per level, every connection issuing
+# requests back to back. Reports requests/sec, latency percentiles and
+# errors per server and concurrency level as JSON.
+#
+#   cd server && python -m benchmarks.async_vs_sync --concurrency 50 500 2000
+#
+# Point --sync-url / --async-url at servers you started yourself to skip
+# the launch (e.g. to compare against a gunicorn deployment). Thousands of
+# connections need a raised open-files limit (ulimit -n).
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import urlsplit
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+
+SERVERS = {
+    # the current deployment style: Flask's threaded server
+    'sync': [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', '{port}', '--with-threads', '--no-reload'],
+    'async': [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', '{port}', '--log-level', 'warning'],
+}
+
+
+class Connection:
+    # Minimal keep-alive HTTP/1.1 client; enough for JSON bodies with a
+    # Content-Length, which both apps always send
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode() if body is not None else b''
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}', f'Content-Length: {len(payload)}']
+        if body is not None:
+            lines.append('Content-Type: application/json')
+        lines += [f'{k}: {v}' for k, v in (headers or {}).items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + payload)
+
+        status = int((await self.reader.readline()).split()[1])
+        length, close = 0, False
+        while True:
+            line = (await self.reader.readline()).strip()
+            if not line:
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name = name.lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection' and value.strip().lower() == 'close':
+                close = True
+        data = await self.reader.readexactly(length)
+        if close:
+            self.close()
+        return status, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def wait_until_up(host, port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = Connection(host, port)
+            await conn.request('GET', '/shop/catalog')
+            conn.close()
+            return
+        except (OSError, asyncio.IncompleteReadError):
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not come up')
+
+
+async def bench_user(host, port):
+    conn = Connection(host, port)
+    email = f'bench-{uuid.uuid4().hex[:12]}@example.com'
+    await conn.request('POST', '/register', {'email': email, 'password': 'bench-password'})
+    _, data = await conn.request('POST', '/login', {'email': email, 'password': 'bench-password'})
+    headers = {'Authorization': 'Bearer ' + json.loads(data)['access_token']}
+    for n in range(5):
+        await conn.request('POST', '/habits', {'title': f'habit {n}', 'frequency': 'daily', 'category': 'health'}, headers)
+    conn.close()
+    return headers
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def load(host, port, path, headers, concurrency, duration):
+    latencies = []
+    errors = 0
+    stop = time.monotonic() + duration
+
+    async def client():
+        nonlocal errors
+        conn = Connection(host, port)
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            try:
+                status, _ = await conn.request('GET', path, headers=headers)
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                errors += 1
+                conn.close()
+                await asyncio.sleep(0.05)
+                continue
+            if status == 200:
+                latencies.append((time.perf_counter() - start) * 1000)
+            else:
+                errors += 1
+        conn.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'requestsPerSecond': round(len(latencies) / elapsed, 1),
+        'p50Ms': round(percentile(latencies, 50), 2),
+        'p99Ms': round(percentile(latencies, 99), 2),
+    }
+
+
+def start_server(kind, port):
+    cmd = [part.format(port=port) for part in SERVERS[kind]]
+    return subprocess.Popen(cmd, cwd=SERVER_DIR, env=os.environ.copy(),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def run(args):
+    targets = {'sync': args.sync_url, 'async': args.async_url}
+    processes = []
+    try:
+        for n, kind in enumerate(('sync', 'async')):
+            if not targets[kind]:
+                port = args.base_port + n
+                processes.append(start_server(kind, port))
+                targets[kind] = f'http://127.0.0.1:{port}'
+
+        results = {'path': args.path, 'duration': args.duration, 'servers': {}}
+        for kind, url in targets.items():
+            parts = urlsplit(url)
+            await wait_until_up(parts.hostname, parts.port)
+            headers = await bench_user(parts.hostname, parts.port)
+            results['servers'][kind] = [
+                await load(parts.hostname, parts.port, args.path, headers, level, args.duration)
+                for level in args.concurrency
+            ]
+        return results
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the WSGI and ASGI apps under concurrent load')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per concurrency level')
+    parser.add_argument('--path', default='/dashboard')
+    parser.add_argument('--sync-url')
+    parser.add_argument('--async-url')
+    parser.add_argument('--base-port', type=int, default=5100)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+# endpoints.py - per-route latency, throughput and Mongo round trips
+#
+# Seeds synthetic users (see seed), then replays weighted request mixes
+# against the Flask app in-process: `--threads` threads share one app and
+# issue `--requests` requests per scenario back to back through the test
+# client, so the numbers are the app's own cost (routing, Mongo, bcrypt,
+# JSON) without an HTTP server in front. Per scenario and route it
+# reports throughput, p50/p95/p99/max latency, status codes and MongoDB
+# commands per request, as JSON.
+#
+#   cd server && python -m benchmarks.endpoints --mongo-uri mongodb://localhost:27017 --output before.json
+#   cd server && python -m benchmarks.endpoints --mongod --output after.json --baseline before.json
+#
+# Scenarios (--scenarios picks some):
+#   login-storm    POST /login
+#   morning-burst  habit completions, single and batched, with habit list reloads
+#   dashboard      dashboard, stats, inventory, achievement and leaderboard reads
+#   mixed          a bit of everything
+#
+# The benchmark database (--db) is dropped and reseeded before every
+# scenario, so scenarios never see each other's writes and the same --seed
+# replays the same requests. App settings come from the environment as
+# usual (see config), e.g. RESPONSE_CACHE=none; rate limiting is off
+# unless ADMISSION_RATE is set. --baseline adds the change against an
+# earlier results file to every route.
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+from pymongo import MongoClient
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-not-for-production')
+# every simulated user shares one address; set ADMISSION_RATE to measure
+# the limiter itself
+os.environ.setdefault('ADMISSION_RATE', '0')
+
+import leaderboard  # noqa: E402
+import metrics  # noqa: E402
+import response_cache  # noqa: E402
+from app import create_app  # noqa: E402
+from benchmarks import seed as seeding  # noqa: E402
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+
+class Workload:
+    # Request builders for one scenario run; picks users and habits with a
+    # seeded RNG and hands out each not-yet-completed habit once
+    def __init__(self, users, rng):
+        self.users = users
+        self.rng = rng
+        self.open_habits = {user['email']: list(user['habits']) for user in users}
+        for habits in self.open_habits.values():
+            rng.shuffle(habits)
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def open_habit_ids(self, user, count):
+        # once every habit is done, repeats exercise the "already completed" path
+        remaining = self.open_habits[user['email']]
+        taken = [remaining.pop() for _ in range(min(count, len(remaining)))]
+        return taken or user['habits'][:count]
+
+    def login(self):
+        user = self.user()
+        return 'POST', '/login', None, {'email': user['email'], 'password': seeding.PASSWORD}
+
+    def complete(self):
+        user = self.user()
+        habit_id = self.open_habit_ids(user, 1)[0]
+        return 'POST', f'/habits/{habit_id}/complete', user, None
+
+    def complete_batch(self):
+        user = self.user()
+        return 'POST', '/habits/complete', user, {'habitIds': self.open_habit_ids(user, 3)}
+
+    def get(self, path):
+        def build():
+            return 'GET', path, self.user(), None
+        return build
+
+
+# route label -> builder name or GET path
+SCENARIOS = {
+    'login-storm': [
+        (1, 'POST /login', 'login'),
+    ],
+    'morning-burst': [
+        (55, 'POST /habits/<habit_id>/complete', 'complete'),
+        (10, 'POST /habits/complete', 'complete_batch'),
+        (25, 'GET /habits', '/habits'),
+        (10, 'GET /dashboard', '/dashboard'),
+    ],
+    'dashboard': [
+        (40, 'GET /dashboard', '/dashboard'),
+        (15, 'GET /user/stats', '/user/stats'),
+        (10, 'GET /user/stats?window=90', '/user/stats?window=90'),
+        (10, 'GET /inventory', '/inventory'),
+        (10, 'GET /achievements', '/achievements'),
+        (10, 'GET /leaderboard/streak', '/leaderboard/streak'),
+        (5, 'GET /leaderboard/streak/me', '/leaderboard/streak/me'),
+    ],
+    'mixed': [
+        (5, 'POST /login', 'login'),
+        (20, 'POST /habits/<habit_id>/complete', 'complete'),
+        (20, 'GET /habits', '/habits'),
+        (20, 'GET /dashboard', '/dashboard'),
+        (10, 'GET /user/stats', '/user/stats'),
+        (10, 'GET /inventory', '/inventory'),
+        (10, 'GET /achievements', '/achievements'),
+        (5, 'GET /leaderboard/completions', '/leaderboard/completions'),
+    ],
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def plan(scenario, workload, count, rng):
+    # The scenario's requests, built up front so that thread scheduling
+    # cannot change them: [(route label, method, path, user, body)]
+    mix = SCENARIOS[scenario]
+    labels = [label for _, label, _ in mix]
+    builders = {
+        label: getattr(workload, target) if not target.startswith('/') else workload.get(target)
+        for _, label, target in mix
+    }
+    weights = [weight for weight, _, _ in mix]
+    return [(label,) + builders[label]() for label in rng.choices(labels, weights, k=count)]
+
+
+def instrument(app):
+    # Mongo commands of the last request on this thread, read from the
+    # request's metrics trace before metrics closes it
+    last = threading.local()
+
+    @app.after_request
+    def _count_commands(response):
+        trace = metrics.current()
+        last.commands = trace.commands if trace else 0
+        return response
+
+    return last
+
+
+def replay(app, last, users, requests, threads):
+    tokens = {}
+    with app.app_context():
+        for user in users:
+            tokens[user['email']] = 'Bearer ' + create_access_token(
+                identity=user['email'], additional_claims={'tz': user['timezone']}
+            )
+
+    samples = {}
+    lock = threading.Lock()
+    position = iter(range(len(requests)))
+
+    def worker():
+        client = app.test_client()
+        local = []
+        while True:
+            with lock:
+                n = next(position, None)
+            if n is None:
+                break
+            label, method, path, user, body = requests[n]
+            headers = {'Authorization': tokens[user['email']]} if user else {}
+
+            last.commands = 0
+            started = time.perf_counter()
+            try:
+                response = client.open(path, method=method, json=body, headers=headers)
+                status = response.status_code
+            except Exception:
+                status = 'exception'
+            elapsed = (time.perf_counter() - started) * 1000
+            local.append((label, elapsed, status, last.commands))
+        with lock:
+            for label, elapsed, status, commands in local:
+                samples.setdefault(label, []).append((elapsed, status, commands))
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples, seconds):
+    routes = {}
+    for label, rows in sorted(samples.items()):
+        latencies = [row[0] for row in rows]
+        statuses = Counter(str(row[1]) for row in rows)
+        routes[label] = {
+            'requests': len(rows),
+            'statuses': dict(sorted(statuses.items())),
+            'errors': sum(1 for row in rows if row[1] == 'exception' or row[1] >= 500),
+            'requestsPerSecond': round(len(rows) / seconds, 1),
+            'p50Ms': round(percentile(latencies, 50), 2),
+            'p95Ms': round(percentile(latencies, 95), 2),
+            'p99Ms': round(percentile(latencies, 99), 2),
+            'maxMs': round(max(latencies), 2),
+            'mongoCommandsPerRequest': round(sum(row[2] for row in rows) / len(rows), 2),
+        }
+    total = sum(route['requests'] for route in routes.values())
+    return {
+        'requests': total,
+        'seconds': round(seconds, 3),
+        'requestsPerSecond': round(total / seconds, 1),
+        'routes': routes,
+    }
+
+
+def compare(results, baseline):
+    # Percent change against an earlier run for each route in both
+    for name, scenario in results['scenarios'].items():
+        old_routes = baseline.get('scenarios', {}).get(name, {}).get('routes', {})
+        for label, route in scenario['routes'].items():
+            old = old_routes.get(label)
+            if not old:
+                continue
+            change = {}
+            for key in ('requestsPerSecond', 'p50Ms', 'p95Ms', 'p99Ms', 'mongoCommandsPerRequest'):
+                if old.get(key):
+                    change[key] = round((route[key] - old[key]) / old[key] * 100, 1)
+            route['changePercent'] = change
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, uri):
+    scale = seeding.scale_from(args)
+    app = create_app({'MONGO_URI': uri, 'MONGO_DB': args.db})
+    last = instrument(app)
+    client = MongoClient(uri)
+    password_hash = app.extensions['passwords'].hash_password(seeding.PASSWORD)
+
+    results = {
+        'meta': {
+            'startedAt': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'mongo': 'mongod' if args.mongod else 'uri',
+            'mongoVersion': client.server_info().get('version'),
+            'seed': args.seed,
+            'scale': scale,
+            'threads': args.threads,
+            'requestsPerScenario': args.requests,
+        },
+        'scenarios': {},
+    }
+
+    for n, scenario in enumerate(args.scenarios):
+        client.drop_database(args.db)
+        # start every scenario with cold caches
+        app.extensions['response_cache'] = response_cache.ResponseCache.from_settings(app.config)
+        app.extensions['leaderboard_cache'] = leaderboard.PageCache.from_settings(app.config)
+        users = seeding.seed(client[args.db], scale, password_hash, args.seed)
+
+        rng = random.Random(args.seed + n)
+        requests = plan(scenario, Workload(users, rng), args.requests, rng)
+        samples, seconds = replay(app, last, users, requests, args.threads)
+        results['scenarios'][scenario] = summarize(samples, seconds)
+
+    client.drop_database(args.db)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay request mixes against the Flask app and report per-route numbers')
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI'))
+    parser.add_argument('--mongod', action='store_true', help='run against a disposable local mongod')
+    parser.add_argument('--db', default='momentum_bench', help='dropped and reseeded per scenario')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=2000, help='requests per scenario')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--baseline', help='earlier results file to compare with')
+    seeding.scale_args(parser)
+    args = parser.parse_args()
+
+    if not args.mongo_uri and not args.mongod:
+        parser.error('--mongo-uri (or MONGO_URI) or --mongod is required')
+
+    if args.mongod:
+        with seeding.LocalMongod() as uri:
+            results = run(args, uri)
+    else:
+        results = run(args, args.mongo_uri)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# password_hashing.py - login storm benchmark for the bcrypt pool
+#
+# Fires `--logins` password checks from `--clients` threads at a
+# PasswordPool and reports logins/sec overall and per pool worker, how many
+# were shed with PoolOverloaded, and the latency of a cheap request-sized
+# task (serializing a habits payload) measured on another thread while the
+# storm runs. Shed checks back off briefly and retry.
+#
+#   cd server && python -m benchmarks.password_hashing --workers 2 --rounds 10
+
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from password_pool import PasswordPool, PoolOverloaded  # noqa: E402
+
+HABITS = [{'id': str(i), 'title': f'habit {i}', 'streak': i, 'totalCompletions': i * 3} for i in range(50)]
+
+
+def probe(stop, samples, interval=0.01):
+    while not stop.is_set():
+        start = time.perf_counter()
+        json.dumps({'habits': HABITS})
+        samples.append((time.perf_counter() - start) * 1000)
+        time.sleep(interval)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bcrypt login storm benchmark')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--queue', type=int, default=None)
+    parser.add_argument('--rounds', type=int, default=12)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=32)
+    args = parser.parse_args()
+
+    pool = PasswordPool(workers=args.workers, queue_depth=args.queue, rounds=args.rounds)
+    pw_hash = pool.hash_password('correct horse')  # also warms up the pool
+
+    ok = shed = 0
+    lock = threading.Lock()
+
+    def login(_):
+        # shed requests back off and retry, like a client honouring Retry-After
+        nonlocal ok, shed
+        while True:
+            try:
+                pool.check_password(pw_hash, 'correct horse')
+                break
+            except PoolOverloaded:
+                with lock:
+                    shed += 1
+                time.sleep(0.005)
+        with lock:
+            ok += 1
+
+    stop = threading.Event()
+    samples = []
+    prober = threading.Thread(target=probe, args=(stop, samples))
+    prober.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as clients:
+        list(clients.map(login, range(args.logins)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    prober.join()
+    pool.shutdown()
+
+    rate = ok / elapsed if elapsed else 0
+    print(json.dumps({
+        'rounds': args.rounds,
+        'workers': args.workers,
+        'clients': args.clients,
+        'logins': ok,
+        'shed': shed,
+        'seconds': round(elapsed, 3),
+        'loginsPerSecond': round(rate, 1),
+        'loginsPerSecondPerCore': round(rate / max(args.workers, 1), 1),
+        'probeP50Ms': round(statistics.median(samples), 3) if samples else None,
+        'probeP99Ms': round(percentile(samples, 99), 3),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+# seed.py - synthetic users for the endpoint benchmarks
+#
+# Bulk-inserts `--users` users in the shapes the app itself writes: habits
+# (part-way through their streaks, not yet completed today), monthly
+# completion history going back `--history-days`, an inventory of shop
+# items, achievement counters and earned state, and leaderboard scores.
+# Every user has the password PASSWORD, hashed once. The same --seed gives
+# the same data.
+#
+#   cd server && python -m benchmarks.seed --mongo-uri mongodb://localhost:27017 --users 1000
+#
+# The target database is migrated first and must be empty (--drop clears
+# it). LocalMongod starts a disposable mongod on a temporary dbpath, under
+# /dev/shm when there is one so the data lives in memory; --mongod uses it.
+
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from bson.timestamp import Timestamp
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import achievement_engine  # noqa: E402
+import habit_updates  # noqa: E402
+import history  # noqa: E402
+import leaderboard  # noqa: E402
+import migrations  # noqa: E402
+import password_pool  # noqa: E402
+import shop  # noqa: E402
+from shop_catalog import SHOP_ITEMS  # noqa: E402
+
+PASSWORD = 'bench-password'
+TIMEZONES = ('UTC', 'America/New_York', 'Europe/Berlin', 'Asia/Tokyo')
+CATEGORIES = ('health', 'fitness', 'learning', 'mindfulness', 'productivity')
+BATCH_USERS = 500
+
+
+class LocalMongod:
+    # A throwaway mongod for one benchmark run; `with LocalMongod() as uri:`
+    def __init__(self, binary='mongod', timeout=30):
+        self.binary = binary
+        self.timeout = timeout
+        self.process = None
+        self.dbpath = None
+
+    def __enter__(self):
+        if shutil.which(self.binary) is None:
+            raise RuntimeError(f'{self.binary} not found; pass --mongo-uri instead')
+        memory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        self.dbpath = tempfile.mkdtemp(prefix='momentum-bench-', dir=memory)
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+
+        self.process = subprocess.Popen(
+            [self.binary, '--dbpath', self.dbpath, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        uri = f'mongodb://127.0.0.1:{port}'
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                MongoClient(uri, serverSelectionTimeoutMS=500).admin.command('ping')
+                return uri
+            except PyMongoError:
+                if time.monotonic() > deadline or self.process.poll() is not None:
+                    self.__exit__(None, None, None)
+                    raise RuntimeError('mongod did not come up')
+                time.sleep(0.2)
+
+    def __exit__(self, *exc):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+        if self.dbpath is not None:
+            shutil.rmtree(self.dbpath, ignore_errors=True)
+            self.dbpath = None
+
+
+def _history(rng, email, habit, today, days, rate):
+    # Monthly buckets with each of the last `days` days completed at `rate`
+    buckets = {}
+    day = today - timedelta(days=days)
+    while day < today:
+        if rng.random() < rate:
+            bucket = buckets.setdefault(history.bucket_for(day), {
+                'user_email': email, 'habit_id': habit['id'], 'bucket': history.bucket_for(day), 'days': 0, 'count': 0
+            })
+            bucket['days'] |= 1 << (day.day - 1)
+            bucket['count'] += 1
+        day += timedelta(days=1)
+    return list(buckets.values())
+
+
+def _habit(rng, now, version, n):
+    habit = habit_updates.new_habit({
+        'title': f'habit {n}',
+        'frequency': 'daily',
+        'category': rng.choice(CATEGORIES),
+        'coinReward': rng.choice((5, 10, 15, 20))
+    })
+    streak = rng.randint(0, 60)
+    habit.update({
+        'id': f'{rng.getrandbits(96):024x}',
+        'streak': streak,
+        'totalCompletions': streak + rng.randint(0, 200),
+        'createdAt': (now - timedelta(days=rng.randint(streak, 400))).replace(tzinfo=None).isoformat(),
+        # before today's local midnight in every timezone, after yesterday's
+        'lastCompletedAt': (now - timedelta(hours=30)).isoformat() if streak else None,
+        'v': version
+    })
+    return habit
+
+
+def user_documents(rng, n, scale, password_hash, now=None):
+    # The documents of synthetic user n, by collection name
+    now = now or datetime.now(timezone.utc)
+    version = Timestamp(int(now.timestamp()), 1)
+    email = f'bench-{n}@example.com'
+    tz_name = rng.choice(TIMEZONES)
+
+    habits = [_habit(rng, now, version, i) for i in range(scale['habits'])]
+    items = [shop.new_inventory_item(item) for item in rng.sample(SHOP_ITEMS, min(scale['items'], len(SHOP_ITEMS)))]
+    for item in items:
+        item['v'] = version
+    coins = rng.randint(0, 5000)
+
+    counters = achievement_engine.counters_from_habits(habits)
+    earned_ids = [ach['id'] for ach in achievement_engine.catalog][:scale['achievements']]
+    earned = {
+        ach_id: achievement_engine.earned_state(now.isoformat(), claimed=rng.random() < 0.5)
+        for ach_id in earned_ids
+    }
+
+    rate = rng.uniform(0.3, 0.95)
+    buckets = [
+        bucket
+        for habit in habits
+        for bucket in _history(rng, email, habit, now.date(), scale['history_days'], rate)
+    ]
+
+    scores = leaderboard.streak_ops(email, habits)
+    scores += leaderboard.score_ops(email, {'completions': counters['totalCompletions'], 'coins': coins})
+
+    return {
+        'users': [{'email': email, 'password': password_hash, 'name': f'Bench User {n}', 'timezone': tz_name}],
+        'user_habits': [{'user_email': email, 'timezone': tz_name, 'habits': habits, 'version': version}],
+        'user_inventory': [{'user_email': email, 'coins': coins, 'items': items, 'version': version}],
+        'user_achievements': [{'user_email': email, 'counters': counters, 'earned': earned, 'version': version}],
+        'habit_history': buckets,
+        'leaderboard_scores': scores
+    }, {'email': email, 'timezone': tz_name, 'habits': [h['id'] for h in habits]}
+
+
+def seed(db, scale, password_hash, seed_value=0):
+    # Migrates `db` and inserts the users; returns [{email, timezone, habits}]
+    migrations.migrate(db)
+    rng = random.Random(seed_value)
+    now = datetime.now(timezone.utc)
+    users = []
+
+    for start in range(0, scale['users'], BATCH_USERS):
+        batch = {}
+        for n in range(start, min(start + BATCH_USERS, scale['users'])):
+            docs, user = user_documents(rng, n, scale, password_hash, now)
+            users.append(user)
+            for name, collection_docs in docs.items():
+                batch.setdefault(name, []).extend(collection_docs)
+
+        for name, collection_docs in batch.items():
+            if not collection_docs:
+                continue
+            if name == 'leaderboard_scores':
+                db[name].bulk_write(collection_docs, ordered=False)
+            else:
+                db[name].insert_many(collection_docs, ordered=False)
+    return users
+
+
+def scale_args(parser):
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--habits', type=int, default=5, help='habits per user')
+    parser.add_argument('--items', type=int, default=8, help='inventory items per user')
+    parser.add_argument('--achievements', type=int, default=3, help='earned achievements per user')
+    parser.add_argument('--history-days', type=int, default=120, help='days of completion history per habit')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def scale_from(args):
+    return {
+        'users': args.users,
+        'habits': args.habits,
+        'items': args.items,
+        'achievements': args.achievements,
+        'history_days': args.history_days
+    }
+
+
+def hash_password(password=PASSWORD):
+    return password_pool.PasswordPool(workers=1).hash_password(password)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed synthetic benchmark users')
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI'))
+    parser.add_argument('--mongod', action='store_true', help='seed a disposable local mongod (for trying it out)')
+    parser.add_argument('--db', default='momentum_bench')
+    parser.add_argument('--drop', action='store_true', help='drop the database first')
+    scale_args(parser)
+    args = parser.parse_args()
+
+    if not args.mongo_uri and not args.mongod:
+        parser.error('--mongo-uri (or MONGO_URI) or --mongod is required')
+
+    def run(uri):
+        client = MongoClient(uri)
+        if args.drop:
+            client.drop_database(args.db)
+        started = time.perf_counter()
+        users = seed(client[args.db], scale_from(args), hash_password(), args.seed)
+        print(json.dumps({'users': len(users), 'seconds': round(time.perf_counter() - started, 2)}))
+
+    if args.mongod:
+        with LocalMongod() as uri:
+            run(uri)
+    else:
+        run(args.mongo_uri)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+# completion.py - habit completion engine
+#
+# Completing a habit used to cost ~7 round trips (read habits, write habits,
+# write coins, read habits + achievements for the recalc, then two more
+# reads for the response). Everything here is done with conditional
+# writes that hand back the data the response needs:
+#   1. habits:       one find_one_and_update (streak branch picked by arrayFilters)
+#   2. inventory:    one find_one_and_update ($inc coins, returns balance)
+#   3. achievements: one find_one_and_update of the running counters, plus a
+#                    targeted update only when a threshold is crossed
+#                    (see achievement_engine)
+#   4. history:      one upserted $bit into the monthly bucket (see history)
+#   5. leaderboards: one unordered bulk write of score updates (see leaderboard)
+#
+# With an outbox collection, 3 and 5 are one upsert of a background task
+# instead (see tasks); the response does not wait for them.
+#
+# complete_habits does the same for a batch of habits at about the same
+# cost: one read to validate them and compute streaks and rewards, then one
+# habits update, one coin $inc, one achievement evaluation and one history
+# bulk write (and one leaderboard bulk write), whatever the batch size.
+#
+# complete_habit and complete_habits are repository generators (see
+# repository).
+
+from datetime import datetime, timezone
+
+from pymongo import ReturnDocument
+
+import achievement_engine
+import history
+import leaderboard
+import tasks
+import versions
+from errors import ApiError
+from timeutil import local_day_bounds
+
+MAX_BATCH = 100
+
+
+class CompletionError(ApiError):
+    pass
+
+
+def streak_bonus(streak):
+    bonus = 0
+    if streak >= 5:
+        bonus += 5
+    if streak >= 10:
+        bonus += 5
+    if streak >= 30:
+        bonus += 10
+    return bonus
+
+
+def _completion_update(habit_id, now_utc, tz_name):
+    # lastCompletedAt is always written as a UTC isoformat string, so a plain
+    # string range selects "completed yesterday". The two streak branches use
+    # mutually exclusive array filters, so exactly one applies to the habit.
+    yesterday_start, today_start = local_day_bounds(tz_name, now_utc)
+    yesterday = {'$gte': yesterday_start, '$lt': today_start}
+
+    update = {
+        '$set': {
+            'habits.$[h].completedToday': True,
+            'habits.$[h].lastCompletedAt': now_utc.isoformat(),
+            'habits.$[fresh].streak': 1
+        },
+        '$inc': {
+            'habits.$[h].totalCompletions': 1,
+            'habits.$[cont].streak': 1
+        }
+    }
+    versions.stamp(update, 'habits.$[h].v')
+    array_filters = [
+        {'h.id': habit_id},
+        {'cont.id': habit_id, 'cont.lastCompletedAt': yesterday},
+        {'fresh.id': habit_id, 'fresh.lastCompletedAt': {'$not': yesterday}}
+    ]
+    return update, array_filters
+
+
+def _explain_miss(habits_collection, user_email, habit_id):
+    # Only runs when the conditional update matched nothing
+    doc = yield habits_collection.find_one(
+        {'user_email': user_email},
+        {'habits': {'$elemMatch': {'id': habit_id}}}
+    )
+    if not doc:
+        return CompletionError('No habits found for user', 404)
+    if not doc.get('habits'):
+        return CompletionError('Habit not found', 404)
+    return CompletionError('Habit already completed today', 400)
+
+
+def complete_habit(habits_collection, inventory_collection, achievements_collection,
+                   user_email, habit_id, tz_name='UTC', now=None, history_collection=None,
+                   leaderboard_collection=None, outbox_collection=None):
+    now_utc = now or datetime.now(timezone.utc)
+    _, today_start = local_day_bounds(tz_name, now_utc)
+
+    update, array_filters = _completion_update(habit_id, now_utc, tz_name)
+    user_doc = yield habits_collection.find_one_and_update(
+        {
+            'user_email': user_email,
+            # a completedToday flag left over from before midnight does not
+            # block completion if the daily rollover has not reached this user
+            'habits': {'$elemMatch': {'id': habit_id, '$or': [
+                {'completedToday': {'$ne': True}},
+                {'lastCompletedAt': {'$lt': today_start}}
+            ]}}
+        },
+        update,
+        projection={'_id': False, 'habits': {'$elemMatch': {'id': habit_id}}},
+        array_filters=array_filters,
+        return_document=ReturnDocument.AFTER
+    )
+    if not user_doc:
+        raise (yield from _explain_miss(habits_collection, user_email, habit_id))
+
+    habit = user_doc['habits'][0]
+
+    reward = habit.get('coinReward', 10) + streak_bonus(habit['streak'])
+
+    # Award coins
+    inventory = yield inventory_collection.find_one_and_update(
+        {'user_email': user_email},
+        versions.stamp({'$inc': {'coins': reward}}),
+        projection={'_id': False, 'coins': True, 'version': True},
+        return_document=ReturnDocument.AFTER
+    )
+
+    if history_collection is not None:
+        yield from history.record(history_collection, user_email, habit_id, now_utc, tz_name)
+
+    if outbox_collection is not None:
+        yield from tasks.enqueue(outbox_collection, user_email, [habit], now_utc)
+    else:
+        yield from achievement_engine.record_completion(
+            achievements_collection, user_email, habit, habits_collection, history_collection
+        )
+        if leaderboard_collection is not None:
+            yield from leaderboard.record_completions(leaderboard_collection, user_email, [habit], inventory)
+
+    return {
+        'habit': habit,
+        'reward': reward,
+        'currentCoins': inventory.get('coins', 0) if inventory else 0
+    }
+
+
+def _completed_today(habit, today_start):
+    # same rule as complete_habit's filter: a flag left over from before
+    # midnight does not count
+    return habit.get('completedToday') is True and (habit.get('lastCompletedAt') or '') >= today_start
+
+
+def _validate_ids(habit_ids):
+    if not isinstance(habit_ids, list) or not habit_ids:
+        raise CompletionError('habitIds must be a non-empty list', 400)
+    if len(habit_ids) > MAX_BATCH:
+        raise CompletionError(f'At most {MAX_BATCH} habits per request', 400)
+    seen = set()
+    for habit_id in habit_ids:
+        if not isinstance(habit_id, str):
+            raise CompletionError('habitIds must be strings', 400)
+        if habit_id in seen:
+            raise CompletionError(f'Habit {habit_id} listed more than once', 400)
+        seen.add(habit_id)
+
+
+def complete_habits(habits_collection, inventory_collection, achievements_collection,
+                    user_email, habit_ids, tz_name='UTC', now=None, history_collection=None,
+                    leaderboard_collection=None, outbox_collection=None):
+    _validate_ids(habit_ids)
+
+    now_utc = now or datetime.now(timezone.utc)
+    now_iso = now_utc.isoformat()
+    yesterday_start, today_start = local_day_bounds(tz_name, now_utc)
+
+    user_doc = yield habits_collection.find_one({'user_email': user_email}, {'_id': False, 'habits': True})
+    if not user_doc:
+        raise CompletionError('No habits found for user', 404)
+    current = {h.get('id'): h for h in user_doc.get('habits', [])}
+
+    errors = {}
+    pending = []
+    update = {'$set': {}, '$inc': {}}
+    array_filters = []
+    for n, habit_id in enumerate(habit_ids):
+        habit = current.get(habit_id)
+        if habit is None:
+            errors[habit_id] = CompletionError('Habit not found', 404)
+            continue
+        if _completed_today(habit, today_start):
+            errors[habit_id] = CompletionError('Habit already completed today', 400)
+            continue
+
+        last = habit.get('lastCompletedAt')
+        continued = last is not None and yesterday_start <= last < today_start
+
+        ident = f'h{n}'
+        update['$set'][f'habits.$[{ident}].completedToday'] = True
+        update['$set'][f'habits.$[{ident}].lastCompletedAt'] = now_iso
+        update['$set'][f'habits.$[{ident}].streak'] = habit.get('streak', 0) + 1 if continued else 1
+        update['$inc'][f'habits.$[{ident}].totalCompletions'] = 1
+        versions.stamp(update, f'habits.$[{ident}].v')
+        # only applies if the habit was not completed since it was read
+        array_filters.append({f'{ident}.id': habit_id, f'{ident}.lastCompletedAt': last})
+        pending.append(habit_id)
+
+    completed = {}
+    if pending:
+        after = yield habits_collection.find_one_and_update(
+            {'user_email': user_email},
+            update,
+            projection={'_id': False, 'habits': True},
+            array_filters=array_filters,
+            return_document=ReturnDocument.AFTER
+        )
+        updated = {h.get('id'): h for h in (after or {}).get('habits', [])}
+        for habit_id in pending:
+            habit = updated.get(habit_id)
+            if habit is None:
+                errors[habit_id] = CompletionError('Habit not found', 404)
+            elif habit.get('lastCompletedAt') != now_iso:
+                # lost a race with another completion
+                errors[habit_id] = CompletionError('Habit already completed today', 400)
+            else:
+                completed[habit_id] = habit
+
+    rewards = {
+        habit_id: habit.get('coinReward', 10) + streak_bonus(habit['streak'])
+        for habit_id, habit in completed.items()
+    }
+    total_reward = sum(rewards.values())
+
+    if completed:
+        inventory = yield inventory_collection.find_one_and_update(
+            {'user_email': user_email},
+            versions.stamp({'$inc': {'coins': total_reward}}),
+            projection={'_id': False, 'coins': True, 'version': True},
+            return_document=ReturnDocument.AFTER
+        )
+        if history_collection is not None:
+            yield from history.record_many(history_collection, user_email, list(completed), now_utc, tz_name)
+        if outbox_collection is not None:
+            yield from tasks.enqueue(outbox_collection, user_email, list(completed.values()), now_utc)
+        else:
+            yield from achievement_engine.record_completions(
+                achievements_collection, user_email, list(completed.values()), habits_collection,
+                history_collection=history_collection
+            )
+            if leaderboard_collection is not None:
+                yield from leaderboard.record_completions(
+                    leaderboard_collection, user_email, list(completed.values()), inventory
+                )
+    else:
+        inventory = yield inventory_collection.find_one(
+            {'user_email': user_email}, {'_id': False, 'coins': True}
+        )
+
+    results = []
+    for habit_id in habit_ids:
+        if habit_id in completed:
+            results.append({
+                'habitId': habit_id,
+                'completed': True,
+                'habit': completed[habit_id],
+                'reward': rewards[habit_id]
+            })
+        else:
+            error = errors[habit_id]
+            results.append({
+                'habitId': habit_id,
+                'completed': False,
+                'error': error.message,
+                'status': error.status
+            })
+
+    return {
+        'results': results,
+        'completed': len(completed),
+        'reward': total_reward,
+        'currentCoins': inventory.get('coins', 0) if inventory else 0
+    }
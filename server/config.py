@@ -0,0 +1,127 @@
+# config.py - settings for create_app, read from the environment
+#
+# Every key can also be passed to create_app(config) directly, which wins
+# over the environment. Mongo connection budget: each worker process owns
+# one client, so a deployment opens at most
+#   workers x MONGO_MAX_POOL_SIZE
+# application connections (plus one monitoring connection per server per
+# worker).
+#
+#   MONGO_URI                          connection string
+#   MONGO_DB                           database name (default momentum_db)
+#   MONGO_MAX_POOL_SIZE                connections per worker (default 20)
+#   MONGO_MIN_POOL_SIZE                kept open when idle (default 0)
+#   MONGO_MAX_IDLE_TIME_MS             close idle connections after (default 60000)
+#   MONGO_CONNECT_TIMEOUT_MS           TCP connect timeout (default 5000)
+#   MONGO_SERVER_SELECTION_TIMEOUT_MS  fail fast when no server is available (default 5000)
+#   MONGO_SOCKET_TIMEOUT_MS            per-operation socket timeout (default 10000)
+#   MONGO_WAIT_QUEUE_TIMEOUT_MS        wait for a free pooled connection (default 2000)
+#   MONGO_READ_CONCERN                 local | majority | ... (default: server default)
+#   MONGO_WRITE_CONCERN                w: 1 | majority | ... (default: server default)
+#   MONGO_WRITE_TIMEOUT_MS             wtimeout for the write concern
+#   MONGO_JOURNAL                      1 to wait for the journal
+#   MONGO_READ_PREFERENCE              primary | primaryPreferred | ... (default primary)
+#   RUN_MIGRATIONS                     1 to migrate before serving (else an older schema refuses to start)
+#   ROLLOVER_SCHEDULER                 1 to run the daily rollover in-process (one worker at a time)
+#   SLOW_REQUEST_MS                    log slower requests with their Mongo trace (0 = off)
+#   METRICS_COMMAND_BYTES              1 to count command / reply bytes (re-encodes each one)
+#   METRICS_TOKEN                      bearer token for /metrics (default: loopback clients only)
+#   RESPONSE_CACHE                     local | none | module:factory (default local; none under
+#                                      gunicorn with several workers, see gunicorn.conf.py)
+#   RESPONSE_CACHE_TTL                 seconds a cached response may be served (default 30)
+#   RESPONSE_CACHE_SIZE                entries in the local LRU (default 10000)
+#   LEADERBOARD_CACHE_TTL              seconds a leaderboard page is cached (default 5, 0 = off)
+#   COMPRESS_MIN_BYTES                 compress larger responses with br / gzip (default 1024, 0 = off)
+#   ADMISSION_RATE                     tokens per second per client (default 10, 0 = no rate limit)
+#   ADMISSION_BURST                    bucket size per client (default 20)
+#   ADMISSION_ROUTE_COSTS              extra costs, 'POST /login=10,GET /dashboard=2' (see admission)
+#   ADMISSION_MAX_IN_FLIGHT            concurrent requests per worker before 503s (default 100, 0 = off)
+#   ADMISSION_MAX_KEYS                 clients tracked per worker (default 100000)
+#   ADMIN_EMAILS                       comma-separated accounts allowed on /admin routes
+#   TASK_WORKERS                       background task workers per process (default 2, 0 = inline)
+#   TASK_BATCH_SIZE                    tasks claimed per batch (default 100)
+#   TASK_DELAY_MS                      wait for more work to coalesce after a wake-up (default 250)
+#   TASK_POLL_MS                       poll for tasks from other processes (default 5000)
+
+import os
+
+DEFAULTS = {
+    'MONGO_URI': None,
+    'MONGO_DB': 'momentum_db',
+    'MONGO_MAX_POOL_SIZE': 20,
+    'MONGO_MIN_POOL_SIZE': 0,
+    'MONGO_MAX_IDLE_TIME_MS': 60000,
+    'MONGO_CONNECT_TIMEOUT_MS': 5000,
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': 5000,
+    'MONGO_SOCKET_TIMEOUT_MS': 10000,
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': 2000,
+    'MONGO_READ_CONCERN': None,
+    'MONGO_WRITE_CONCERN': None,
+    'MONGO_WRITE_TIMEOUT_MS': None,
+    'MONGO_JOURNAL': None,
+    'MONGO_READ_PREFERENCE': 'primary',
+    'RUN_MIGRATIONS': False,
+    'ROLLOVER_SCHEDULER': False,
+    'SLOW_REQUEST_MS': 0,
+    'METRICS_COMMAND_BYTES': False,
+    'METRICS_TOKEN': None,
+    'RESPONSE_CACHE': 'local',
+    'RESPONSE_CACHE_TTL': 30,
+    'RESPONSE_CACHE_SIZE': 10000,
+    'LEADERBOARD_CACHE_TTL': 5,
+    'COMPRESS_MIN_BYTES': 1024,
+    'ADMISSION_RATE': 10.0,
+    'ADMISSION_BURST': 20.0,
+    'ADMISSION_ROUTE_COSTS': None,
+    'ADMISSION_MAX_IN_FLIGHT': 100,
+    'ADMISSION_MAX_KEYS': 100000,
+    'ADMIN_EMAILS': None,
+    'TASK_WORKERS': 2,
+    'TASK_BATCH_SIZE': 100,
+    'TASK_DELAY_MS': 250,
+    'TASK_POLL_MS': 5000,
+}
+
+
+def _parse(default, raw):
+    if isinstance(default, bool):
+        return raw == '1'
+    if isinstance(default, int):
+        return int(raw)
+    if raw.isdigit():
+        # e.g. MONGO_WRITE_CONCERN=1 or MONGO_WRITE_TIMEOUT_MS=500
+        return int(raw)
+    return raw
+
+
+def load(overrides=None):
+    config = {'JWT_SECRET_KEY': os.getenv('JWT_SECRET_KEY')}
+    for key, default in DEFAULTS.items():
+        raw = os.getenv(key)
+        config[key] = default if raw in (None, '') else _parse(default, raw)
+    config.update(overrides or {})
+    return config
+
+
+def mongo_options(config):
+    # Keyword arguments for MongoClient / AsyncMongoClient
+    options = {
+        'maxPoolSize': config['MONGO_MAX_POOL_SIZE'],
+        'minPoolSize': config['MONGO_MIN_POOL_SIZE'],
+        'maxIdleTimeMS': config['MONGO_MAX_IDLE_TIME_MS'],
+        'connectTimeoutMS': config['MONGO_CONNECT_TIMEOUT_MS'],
+        'serverSelectionTimeoutMS': config['MONGO_SERVER_SELECTION_TIMEOUT_MS'],
+        'socketTimeoutMS': config['MONGO_SOCKET_TIMEOUT_MS'],
+        'waitQueueTimeoutMS': config['MONGO_WAIT_QUEUE_TIMEOUT_MS'],
+        'readPreference': config['MONGO_READ_PREFERENCE'],
+        'appname': 'momentum',
+    }
+    if config['MONGO_READ_CONCERN']:
+        options['readConcernLevel'] = config['MONGO_READ_CONCERN']
+    if config['MONGO_WRITE_CONCERN'] is not None:
+        options['w'] = config['MONGO_WRITE_CONCERN']
+    if config['MONGO_WRITE_TIMEOUT_MS'] is not None:
+        options['wTimeoutMS'] = config['MONGO_WRITE_TIMEOUT_MS']
+    if config['MONGO_JOURNAL'] is not None:
+        options['journal'] = config['MONGO_JOURNAL'] in (True, 1, '1', 'true')
+    return options
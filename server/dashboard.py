@@ -0,0 +1,96 @@
+# dashboard.py - one-round-trip dashboard / stats aggregation
+#
+# Starts from the users document and $lookups the three per-user documents
+# (each on its unique user_email index), then computes the stats inside
+# the pipeline so only the projected fields come back to Python.
+# load_dashboard is a repository generator (see repository).
+
+from datetime import datetime, timezone
+
+from timeutil import local_day_bounds
+
+
+def _first(field):
+    return {'$ifNull': [{'$arrayElemAt': [field, 0]}, {}]}
+
+
+def _active(category):
+    return {'$arrayElemAt': [{'$filter': {
+        'input': '$items',
+        'as': 'i',
+        'cond': {'$and': [
+            {'$eq': ['$$i.category', category]},
+            {'$eq': ['$$i.isActive', True]}
+        ]}
+    }}, 0]}
+
+
+def dashboard_pipeline(user_email, today_start, include_lists=True):
+    stats = {
+        'totalHabits': {'$size': '$habits'},
+        # a completedToday flag from before the user's midnight does not count
+        # even if the daily rollover has not reached this user yet
+        'completedToday': {'$size': {'$filter': {
+            'input': '$habits',
+            'as': 'h',
+            'cond': {'$and': [
+                {'$eq': ['$$h.completedToday', True]},
+                {'$gte': ['$$h.lastCompletedAt', today_start]}
+            ]}
+        }}},
+        'longestStreak': {'$ifNull': [{'$max': '$habits.streak'}, 0]},
+        'totalCompletions': {'$sum': '$habits.totalCompletions'},
+        'coins': '$coins',
+        'activeTheme': {'$ifNull': ['$activeTheme.themeId', 'basic']},
+        'activeBackground': {'$ifNull': ['$activeBackground.id', None]}
+    }
+
+    project = {'_id': False, 'stats': stats}
+    if include_lists:
+        project['habits'] = '$habits'
+        project['inventory'] = {'coins': '$coins', 'items': '$items'}
+        project['achievementSummary'] = {
+            'earned': {'$size': '$earned'},
+            'unclaimed': {'$size': {'$filter': {
+                'input': '$earned', 'as': 'a',
+                'cond': {'$ne': [{'$ifNull': ['$$a.v.claimed', False]}, True]}
+            }}}
+        }
+
+    return [
+        {'$match': {'email': user_email}},
+        {'$limit': 1},
+        {'$lookup': {'from': 'user_habits', 'localField': 'email', 'foreignField': 'user_email', 'as': 'habitsDoc'}},
+        {'$lookup': {'from': 'user_inventory', 'localField': 'email', 'foreignField': 'user_email', 'as': 'inventoryDoc'}},
+        {'$lookup': {'from': 'user_achievements', 'localField': 'email', 'foreignField': 'user_email', 'as': 'achievementsDoc'}},
+        {'$project': {
+            'habitsDoc': _first('$habitsDoc'),
+            'inventoryDoc': _first('$inventoryDoc'),
+            'achievementsDoc': _first('$achievementsDoc')
+        }},
+        {'$project': {
+            'habits': {'$ifNull': ['$habitsDoc.habits', []]},
+            'items': {'$ifNull': ['$inventoryDoc.items', []]},
+            'coins': {'$ifNull': ['$inventoryDoc.coins', 0]},
+            # {id: {earnedAt, claimed}} as [{k, v}]
+            'earned': {'$ifNull': [{'$objectToArray': '$achievementsDoc.earned'}, []]}
+        }},
+        {'$addFields': {
+            'activeTheme': _active('themes'),
+            'activeBackground': _active('backgrounds')
+        }},
+        {'$project': project},
+        {'$set': {'stats.completionRate': {'$cond': [
+            {'$gt': ['$stats.totalHabits', 0]},
+            {'$multiply': [{'$divide': ['$stats.completedToday', '$stats.totalHabits']}, 100]},
+            0
+        ]}}}
+    ]
+
+
+def load_dashboard(users_collection, user_email, tz_name='UTC', include_lists=True, now=None):
+    now_utc = now or datetime.now(timezone.utc)
+    _, today_start = local_day_bounds(tz_name, now_utc)
+
+    docs = yield users_collection.aggregate(dashboard_pipeline(user_email, today_start, include_lists))
+    return docs[0] if docs else None
@@ -41,6 +41,8 @@ DEFAULT_ACHIEVEMENTS = [
         "coinReward": 400,
         "claimed": False
     },
+    # Counts days on which every habit was completed, from the history
+    # bitmaps (see achievement_engine), not any single habit's streak
     {
         "id": "achievement-4",
         "name": "Perfect Week",
@@ -53,7 +55,8 @@ DEFAULT_ACHIEVEMENTS = [
         "progress": 0,
         "total": 7,
         "coinReward": 125,
-        "claimed": False
+        "claimed": False,
+        "counter": "longestPerfectRun"
     },
     {
         "id": "achievement-5",
@@ -0,0 +1,38 @@
+# errors.py - the one exception type clients see
+#
+# Engines raise subclasses of ApiError(message, status); both apps register
+# a handler that answers {"error": message} with that status (and any
+# `headers` the error carries), so routes do not catch them one by one.
+
+
+class ApiError(Exception):
+    headers = None
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def response(jsonify, error):
+    result = jsonify({'error': error.message})
+    result.status_code = error.status
+    for name, value in (error.headers or {}).items():
+        result.headers[name] = value
+    return result
+
+
+def init_app(app):
+    from flask import jsonify
+
+    @app.errorhandler(ApiError)
+    def _api_error(error):
+        return response(jsonify, error)
+
+
+def init_quart_app(app):
+    from quart import jsonify
+
+    @app.errorhandler(ApiError)
+    async def _api_error(error):
+        return response(jsonify, error)
@@ -0,0 +1,88 @@
+# gunicorn.conf.py - production launcher
+#
+#   cd server && gunicorn                    # WSGI app (app.py), threaded workers
+#   cd server && APP_SERVER=asgi gunicorn    # ASGI app (asgi.py) on uvicorn workers
+#
+# The app is imported once in the master (preload) and forked, so workers
+# start in milliseconds. create_app does not connect to MongoDB; every
+# worker opens its own client on first use, so the deployment holds at most
+# workers x MONGO_MAX_POOL_SIZE connections (see config.py). Migrations
+# run once in the master, on a short-lived client closed before forking;
+# without RUN_MIGRATIONS the master only checks the schema is current and
+# refuses to start otherwise.
+#
+# With more than one worker the response cache defaults to 'none': the
+# 'local' backend keeps each user's generation token per process, so a
+# write in one worker would leave the others serving stale responses for
+# up to RESPONSE_CACHE_TTL. Set RESPONSE_CACHE to a shared 'module:factory'
+# backend to cache across workers (or to 'local' to accept the staleness).
+#
+#   WEB_CONCURRENCY  worker processes (default: number of CPUs)
+#   WEB_THREADS      threads per WSGI worker (default: MONGO_MAX_POOL_SIZE)
+#   PORT             listen port (default 5000)
+
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+import config as app_config
+
+# before deciding anything from the environment, as the app would
+load_dotenv()
+settings = app_config.load()
+
+if os.getenv('APP_SERVER') == 'asgi':
+    wsgi_app = 'asgi:app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'app:app'
+    worker_class = 'gthread'
+    # more threads than pooled connections would only queue on the pool
+    threads = int(os.getenv('WEB_THREADS', settings['MONGO_MAX_POOL_SIZE']))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+preload_app = True
+
+if workers > 1 and not os.getenv('RESPONSE_CACHE'):
+    # read by config.load when the app is imported, after this file
+    os.environ['RESPONSE_CACHE'] = 'none'
+timeout = 30
+graceful_timeout = 20
+keepalive = 5
+
+
+def on_starting(server):
+    import migrations
+    from mongo import LazyMongo
+
+    mongo = LazyMongo(settings)
+    try:
+        if settings['RUN_MIGRATIONS']:
+            version = migrations.migrate(mongo)
+        else:
+            version = migrations.require_latest(migrations.current_version(mongo))
+        server.log.info('Schema version: %s', version)
+    finally:
+        mongo.close()
+
+
+def when_ready(server):
+    server.log.info(
+        'Mongo connection budget: %s workers x %s pooled connections',
+        server.cfg.workers, settings['MONGO_MAX_POOL_SIZE']
+    )
+    if server.cfg.workers > 1 and os.getenv('RESPONSE_CACHE') == 'local':
+        server.log.warning('RESPONSE_CACHE=local with %s workers: responses may be stale for up to %ss',
+                           server.cfg.workers, settings['RESPONSE_CACHE_TTL'])
+
+
+def post_worker_init(worker):
+    # The scheduler thread must start after the fork; every worker starts
+    # one and the rollover_state lease lets one of them run it
+    if settings['ROLLOVER_SCHEDULER']:
+        import rollover
+        from mongo import LazyMongo
+
+        rollover.RolloverScheduler(LazyMongo(settings)).start()
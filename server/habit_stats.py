@@ -0,0 +1,197 @@
+# habit_stats.py - completion statistics from the history bitmaps
+#
+# The monthly history buckets (see history) already store one bit per
+# habit and day. load_stats reads the buckets of the user's current habits
+# for the window in one indexed query, unpacks them into a habits x days
+# boolean matrix with NumPy and computes everything from that matrix with
+# array operations, never per-day Python objects:
+#
+#   per habit:   current streak, longest streak in the window, completions
+#                and completion rate
+#   all habits:  completion rate per day and over the trailing week, and
+#                runs of "perfect" days on which every habit was completed
+#                (reported by GET /user/stats, and behind Perfect Week, see
+#                longest_perfect_run and achievement_engine)
+#
+# Days before a habit was created do not count against it. Days are in the
+# user's timezone, like the buckets.
+#
+# load_stats and longest_perfect_run are repository generators (see
+# repository).
+
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+
+import history
+from errors import ApiError
+from timeutil import local_today, user_zone
+
+WINDOWS = (30, 90, 365)
+ROLLING_DAYS = 7
+
+# bit d-1 of a bucket is day d of the month
+DAY_BITS = np.arange(31, dtype=np.uint32)
+DAY_OFFSETS = np.arange(31, dtype=np.int64)
+
+
+class StatsError(ApiError):
+    pass
+
+
+def window_arg(raw):
+    # ?window= query argument; None when absent
+    if raw in (None, ''):
+        return None
+    try:
+        window = int(raw)
+    except ValueError:
+        window = None
+    if window not in WINDOWS:
+        raise StatsError(f'window must be one of {", ".join(str(w) for w in WINDOWS)}')
+    return window
+
+
+def _created_day(habit, zone):
+    # createdAt is a naive UTC isoformat string
+    try:
+        created = datetime.fromisoformat(habit.get('createdAt'))
+    except (TypeError, ValueError):
+        return None
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return created.astimezone(zone).date()
+
+
+def completion_matrix(buckets, habit_ids, start, days):
+    # habits x days booleans, column 0 being `start`
+    rows = {habit_id: n for n, habit_id in enumerate(habit_ids)}
+    grid = np.zeros((len(habit_ids), days), dtype=bool)
+    buckets = [b for b in buckets if b.get('habit_id') in rows]
+    if not buckets:
+        return grid
+
+    row = np.array([rows[b['habit_id']] for b in buckets], dtype=np.int64)
+    first = np.array([(date.fromisoformat(b['bucket'] + '-01') - start).days for b in buckets], dtype=np.int64)
+    bits = np.array([b.get('days', 0) for b in buckets], dtype=np.uint32)
+
+    # buckets x 31: completed flag and window column of every day
+    done = ((bits[:, None] >> DAY_BITS) & 1).astype(bool)
+    column = first[:, None] + DAY_OFFSETS
+    hit = done & (column >= 0) & (column < days)
+    grid[np.broadcast_to(row[:, None], hit.shape)[hit], column[hit]] = True
+    return grid
+
+
+def active_matrix(created_offsets, days):
+    # True from the day each habit was created (None: the whole window)
+    offsets = np.array([0 if o is None else o for o in created_offsets], dtype=np.int64)
+    return np.arange(days, dtype=np.int64) >= offsets[:, None]
+
+
+def runs(grid):
+    # Length of the run of True ending at each column, along the last axis
+    counts = np.cumsum(grid, axis=-1)
+    resets = np.maximum.accumulate(np.where(grid, 0, counts), axis=-1)
+    return counts - resets
+
+
+def _current(grid, run):
+    # A streak is still current until the end of the day after its last
+    # completion, so today not being done yet does not break it
+    return np.where(grid[..., -1], run[..., -1], run[..., -2])
+
+
+def _rate(done, possible):
+    # percentages, 0 where nothing was possible
+    done = np.asarray(done, dtype=np.float64)
+    possible = np.asarray(possible, dtype=np.float64)
+    rate = np.divide(done, possible, out=np.zeros_like(done), where=possible > 0)
+    return np.round(rate * 100, 1)
+
+
+def _trailing(values, width):
+    # Sum over the last `width` columns (fewer at the start), per column
+    sums = np.concatenate(([0], np.cumsum(values)))
+    ends = np.arange(1, len(values) + 1)
+    return sums[ends] - sums[np.maximum(ends - width, 0)]
+
+
+def window_stats(habits, buckets, start, end, zone=timezone.utc):
+    days = (end - start).days + 1
+    habit_ids = [h['id'] for h in habits]
+
+    grid = completion_matrix(buckets, habit_ids, start, days)
+    created = [_created_day(h, zone) for h in habits]
+    active = active_matrix([None if c is None else (c - start).days for c in created], days)
+    # a completion always counts, even if createdAt says otherwise
+    active |= grid
+
+    habit_runs = runs(grid)
+    done_per_day = grid.sum(axis=0)
+    active_per_day = active.sum(axis=0)
+
+    # every habit that existed that day was completed
+    perfect = (done_per_day == active_per_day) & (active_per_day > 0)
+    perfect_runs = runs(perfect)
+
+    done_per_habit = grid.sum(axis=1)
+    habit_rates = _rate(done_per_habit, active.sum(axis=1))
+    current = _current(grid, habit_runs)
+    longest = habit_runs.max(axis=1)
+
+    return {
+        'days': days,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'completions': int(done_per_day.sum()),
+        'completionRate': float(_rate(done_per_day.sum(), active_per_day.sum())),
+        'dailyRate': _rate(done_per_day, active_per_day).tolist(),
+        'rollingRate': _rate(
+            _trailing(done_per_day, ROLLING_DAYS), _trailing(active_per_day, ROLLING_DAYS)
+        ).tolist(),
+        'perfectDays': int(perfect.sum()),
+        'currentPerfectRun': int(_current(perfect, perfect_runs)),
+        'longestPerfectRun': int(perfect_runs.max()),
+        'habits': [
+            {
+                'id': habit_id,
+                'currentStreak': int(current[n]),
+                'longestStreak': int(longest[n]),
+                'completions': int(done_per_habit[n]),
+                'completionRate': float(habit_rates[n])
+            }
+            for n, habit_id in enumerate(habit_ids)
+        ]
+    }
+
+
+def load_stats(habits_collection, history_collection, user_email, window, tz_name=None, today=None):
+    # tz_name None: the timezone stored with the user's habits
+    doc = yield habits_collection.find_one(
+        {'user_email': user_email},
+        {'_id': False, 'timezone': True, 'habits.id': True, 'habits.createdAt': True}
+    )
+    tz_name = tz_name or (doc or {}).get('timezone') or 'UTC'
+    end = today or local_today(tz_name)
+    start = end - timedelta(days=window - 1)
+    habits = [h for h in (doc or {}).get('habits', []) if h.get('id')]
+
+    buckets = []
+    if habits:
+        buckets = yield history_collection.find(
+            {
+                'user_email': user_email,
+                'habit_id': {'$in': [h['id'] for h in habits]},
+                'bucket': {'$gte': history.bucket_for(start), '$lte': history.bucket_for(end)}
+            },
+            {'_id': False, 'habit_id': True, 'bucket': True, 'days': True}
+        )
+
+    return window_stats(habits, buckets, start, end, user_zone(tz_name))
+
+
+def longest_perfect_run(habits_collection, history_collection, user_email, window, today=None):
+    # Longest run of perfect days among the last `window` days
+    stats = yield from load_stats(habits_collection, history_collection, user_email, window, today=today)
+    return stats['longestPerfectRun']
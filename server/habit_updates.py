@@ -0,0 +1,192 @@
+# habit_updates.py - validated, single-write habit edits
+#
+# Only user-editable fields can be changed; counters and bookkeeping fields
+# (id, streak, totalCompletions, completedToday, ...) are owned by the
+# server. All fields of one request go out in a single $set addressed
+# with arrayFilters, and the updated habit comes back from the same
+# find_one_and_update. New habits go through the same field checks.
+#
+# Moving a habit to another category moves its current streak with it: the
+# streak:<category> leaderboards of the old and new categories are
+# recomputed. Completions already made stay counted where they were made
+# (counters.categories and completions:<category>), as they would if the
+# habit had been deleted and recreated. update_habit and update_habits are
+# repository generators (see repository).
+
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+import leaderboard
+import versions
+from errors import ApiError
+
+EDITABLE_FIELDS = {
+    'title': str,
+    'description': str,
+    'frequency': str,
+    'category': str,
+    'timeOfDay': str,
+    'color': str,
+    'difficulty': str,
+    'coinReward': int,
+}
+
+TYPE_NAMES = {str: 'a string', int: 'an integer'}
+
+# coins a habit may award per completion, on create and on edit
+MIN_COIN_REWARD, MAX_COIN_REWARD = 1, 100
+
+MAX_BATCH = 100
+
+
+class HabitUpdateError(ApiError):
+    pass
+
+
+def validate_changes(data):
+    if not isinstance(data, dict):
+        raise HabitUpdateError('Request body must be a JSON object', 400)
+
+    if not data:
+        raise HabitUpdateError('No fields to update', 400)
+
+    rejected = sorted(key for key in data if key not in EDITABLE_FIELDS)
+    if rejected:
+        raise HabitUpdateError(f'Fields cannot be updated: {", ".join(rejected)}', 400)
+
+    _check_fields(data)
+    return data
+
+
+def _check_fields(data):
+    for key, value in data.items():
+        expected = EDITABLE_FIELDS[key]
+        # bool is an int subclass, but True is not a coin reward
+        if not isinstance(value, expected) or isinstance(value, bool):
+            raise HabitUpdateError(f'{key} must be {TYPE_NAMES[expected]}', 400)
+        if expected is str and key in ('title', 'frequency', 'category') and not value.strip():
+            raise HabitUpdateError(f'{key} cannot be empty', 400)
+        if key == 'coinReward':
+            _check_coin_reward(value)
+
+
+def _check_coin_reward(value):
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise HabitUpdateError('coinReward must be an integer', 400)
+    if not MIN_COIN_REWARD <= value <= MAX_COIN_REWARD:
+        raise HabitUpdateError(f'coinReward must be between {MIN_COIN_REWARD} and {MAX_COIN_REWARD}', 400)
+
+
+def new_habit(data):
+    if not isinstance(data, dict):
+        raise HabitUpdateError('Request body must be a JSON object', 400)
+
+    required_fields = ['title', 'frequency', 'category']
+    for field in required_fields:
+        if field not in data:
+            raise HabitUpdateError(f'{field} is required', 400)
+    # anything else in the body is ignored, as before
+    _check_fields({key: value for key, value in data.items() if key in EDITABLE_FIELDS})
+
+    return {
+        'id': str(ObjectId()),  # Generate unique habit ID
+        'title': data['title'],
+        'description': data.get('description', ''),
+        'frequency': data['frequency'],
+        'streak': 0,
+        'totalCompletions': 0,
+        'category': data['category'],
+        'createdAt': datetime.utcnow().isoformat(),
+        'lastCompletedAt': None,
+        'completedToday': False,
+        'timeOfDay': data.get('timeOfDay', 'any'),
+        'color': data.get('color', '#00DCFF'),  # Default color
+        'difficulty': data.get('difficulty', 'medium'),
+        'coinReward': data.get('coinReward', 10)  # Default reward
+    }
+
+
+def _set_fields(ident, changes):
+    return {f'habits.$[{ident}].{key}': value for key, value in changes.items()}
+
+
+def _left_categories(habits_collection, user_email, changes_by_id):
+    # Categories the edited habits move out of; only read when an edit
+    # changes a category
+    moving = {habit_id: c['category'] for habit_id, c in changes_by_id.items() if 'category' in c}
+    if not moving:
+        return []
+    doc = yield habits_collection.find_one(
+        {'user_email': user_email},
+        {'_id': False, 'habits.id': True, 'habits.category': True}
+    )
+    return [h.get('category') for h in (doc or {}).get('habits', [])
+            if h.get('id') in moving and h.get('category') != moving[h['id']]]
+
+
+def _move_streaks(leaderboard_collection, user_email, habits, left):
+    if left and leaderboard_collection is not None:
+        yield from leaderboard.record_streaks(leaderboard_collection, user_email, habits, left)
+
+
+def update_habit(habits_collection, user_email, habit_id, data, leaderboard_collection=None):
+    changes = validate_changes(data)
+    left = yield from _left_categories(habits_collection, user_email, {habit_id: changes})
+
+    user_doc = yield habits_collection.find_one_and_update(
+        {'user_email': user_email, 'habits.id': habit_id},
+        versions.stamp({'$set': _set_fields('h', changes)}, 'habits.$[h].v'),
+        # all habits when the streak boards are recomputed
+        projection={'_id': False, 'habits': True if left else {'$elemMatch': {'id': habit_id}}},
+        array_filters=[{'h.id': habit_id}],
+        return_document=ReturnDocument.AFTER
+    )
+    habit = next((h for h in (user_doc or {}).get('habits', []) if h.get('id') == habit_id), None)
+    if habit is None:
+        raise HabitUpdateError('Habit not found', 404)
+    yield from _move_streaks(leaderboard_collection, user_email, user_doc['habits'], left)
+    return habit
+
+
+def update_habits(habits_collection, user_email, edits, leaderboard_collection=None):
+    if not isinstance(edits, list) or not edits:
+        raise HabitUpdateError('habits must be a non-empty list', 400)
+    if len(edits) > MAX_BATCH:
+        raise HabitUpdateError(f'At most {MAX_BATCH} habits per request', 400)
+
+    set_fields = {}
+    stamped = []
+    array_filters = []
+    ids = []
+    changes_by_id = {}
+    for n, edit in enumerate(edits):
+        if not isinstance(edit, dict) or not isinstance(edit.get('id'), str):
+            raise HabitUpdateError('Each habit edit needs an id', 400)
+        habit_id = edit['id']
+        if habit_id in ids:
+            raise HabitUpdateError(f'Habit {habit_id} listed more than once', 400)
+        changes = validate_changes({k: v for k, v in edit.items() if k != 'id'})
+
+        ident = f'h{n}'
+        set_fields.update(_set_fields(ident, changes))
+        stamped.append(f'habits.$[{ident}].v')
+        array_filters.append({f'{ident}.id': habit_id})
+        ids.append(habit_id)
+        changes_by_id[habit_id] = changes
+
+    left = yield from _left_categories(habits_collection, user_email, changes_by_id)
+    user_doc = yield habits_collection.find_one_and_update(
+        {'user_email': user_email},
+        versions.stamp({'$set': set_fields}, *stamped),
+        projection={'_id': False, 'habits': True},
+        array_filters=array_filters,
+        return_document=ReturnDocument.AFTER
+    )
+    if not user_doc:
+        raise HabitUpdateError('No habits found for user', 404)
+    yield from _move_streaks(leaderboard_collection, user_email, user_doc.get('habits', []), left)
+
+    by_id = {h.get('id'): h for h in user_doc.get('habits', [])}
+    return [by_id[i] for i in ids if i in by_id], [i for i in ids if i not in by_id]
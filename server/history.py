@@ -0,0 +1,96 @@
+# history.py - append-only completion history
+#
+# One document per user, habit and month (in the user's timezone):
+#   {user_email, habit_id, bucket: 'YYYY-MM', days: <bitmap>, count: int}
+# Bit d-1 of `days` is set when the habit was completed on day d. A
+# completion is a single upserted $bit/$inc, and a year of history is at
+# most 12 small documents read through the (user_email, habit_id, bucket)
+# index. record and completion_dates are repository generators.
+
+from datetime import date, timedelta
+
+from pymongo import ASCENDING, UpdateOne
+
+from errors import ApiError
+from timeutil import local_today, user_zone
+
+INDEXES = [
+    ([('user_email', ASCENDING), ('habit_id', ASCENDING), ('bucket', ASCENDING)], {'unique': True})
+]
+
+
+class HistoryRangeError(ApiError):
+    pass
+
+
+def date_range(from_arg, to_arg, tz_name='UTC'):
+    # ?from=&to= query arguments; defaults to the last 30 days in the
+    # user's timezone
+    try:
+        end = date.fromisoformat(to_arg) if to_arg else local_today(tz_name)
+        start = date.fromisoformat(from_arg) if from_arg else end - timedelta(days=29)
+    except ValueError:
+        raise HistoryRangeError('from and to must be YYYY-MM-DD dates')
+
+    if start > end:
+        raise HistoryRangeError('from must not be after to')
+    return start, end
+
+
+def ensure_indexes(history_collection):
+    for keys, options in INDEXES:
+        history_collection.create_index(keys, **options)
+
+
+def bucket_for(day):
+    return f'{day.year:04d}-{day.month:02d}'
+
+
+def _record_update(user_email, habit_id, local_day):
+    return (
+        {'user_email': user_email, 'habit_id': habit_id, 'bucket': bucket_for(local_day)},
+        {
+            '$bit': {'days': {'or': 1 << (local_day.day - 1)}},
+            '$inc': {'count': 1}
+        }
+    )
+
+
+def record(history_collection, user_email, habit_id, completed_at, tz_name='UTC'):
+    local_day = completed_at.astimezone(user_zone(tz_name)).date()
+    yield history_collection.update_one(*_record_update(user_email, habit_id, local_day), upsert=True)
+
+
+def record_many(history_collection, user_email, habit_ids, completed_at, tz_name='UTC'):
+    # Same as record for several habits, in one unordered bulk write
+    if not habit_ids:
+        return
+    local_day = completed_at.astimezone(user_zone(tz_name)).date()
+    yield history_collection.bulk_write([
+        UpdateOne(*_record_update(user_email, habit_id, local_day), upsert=True)
+        for habit_id in habit_ids
+    ], ordered=False)
+
+
+def completion_dates(history_collection, user_email, habit_id, start, end):
+    docs = yield history_collection.find(
+        {
+            'user_email': user_email,
+            'habit_id': habit_id,
+            'bucket': {'$gte': bucket_for(start), '$lte': bucket_for(end)}
+        },
+        {'_id': False, 'bucket': True, 'days': True},
+        sort=[('bucket', ASCENDING)]
+    )
+
+    dates = []
+    for doc in docs:
+        year, month = (int(part) for part in doc['bucket'].split('-'))
+        days = doc.get('days', 0)
+        while days:
+            low_bit = days & -days
+            day = date(year, month, low_bit.bit_length())
+            if start <= day <= end:
+                dates.append(day)
+            days ^= low_bit
+    return dates
@@ -0,0 +1,109 @@
+# idempotency.py - Idempotency-Key support for retried POSTs
+#
+# A client may send `Idempotency-Key: <unique string>` with completion,
+# purchase and claim requests. The first request with a key claims it with
+# an insert into idempotency_keys (unique _id per user and key), runs, and
+# stores its response; a retry with the same key gets the stored response
+# back without the handler running again. Keys expire after TTL through a
+# TTL index.
+#
+#   - same key, different method / path / body   -> 422
+#   - same key while the first request still runs -> 409 (Retry-After)
+#   - 5xx responses and exceptions are not stored: the key is released so
+#     the client can retry
+#   - a key left pending by a crashed worker is taken over after
+#     PENDING_TIMEOUT
+#
+# begin / finish / release are repository generators (see repository).
+
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from errors import ApiError
+
+TTL = timedelta(hours=24)
+PENDING_TIMEOUT = timedelta(seconds=60)
+MAX_KEY_LENGTH = 255
+
+HEADER = 'Idempotency-Key'
+REPLAY_HEADER = 'Idempotent-Replayed'
+
+INDEXES = [
+    ([('createdAt', ASCENDING)], {'expireAfterSeconds': int(TTL.total_seconds())}),
+]
+
+
+class IdempotencyError(ApiError):
+    def __init__(self, message, status):
+        super().__init__(message, status)
+        if status == 409:
+            # the first request is still running
+            self.headers = {'Retry-After': '1'}
+
+
+def ensure_indexes(collection):
+    for keys, options in INDEXES:
+        collection.create_index(keys, **options)
+
+
+def fingerprint(method, path, body):
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), body or b''):
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _id(user_email, key):
+    return {'user': user_email, 'key': key}
+
+
+def begin(collection, user_email, key, request_print, now=None):
+    # None if this request should run, or the stored response to replay
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyError(f'{HEADER} must be 1-{MAX_KEY_LENGTH} characters', 400)
+    now = now or datetime.now(timezone.utc)
+    doc_id = _id(user_email, key)
+
+    try:
+        yield collection.insert_one({
+            '_id': doc_id,
+            'fingerprint': request_print,
+            'state': 'pending',
+            'createdAt': now
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+
+    doc = yield collection.find_one({'_id': doc_id})
+    if doc is None:
+        # expired between the insert and the read
+        raise IdempotencyError('Request in progress, please retry', 409)
+    if doc.get('fingerprint') != request_print:
+        raise IdempotencyError(f'{HEADER} was already used for a different request', 422)
+    if doc.get('state') == 'done':
+        return doc
+
+    # pending: take it over only if its owner is presumed dead
+    taken = yield collection.update_one(
+        {'_id': doc_id, 'state': 'pending', 'createdAt': {'$lt': now - PENDING_TIMEOUT}},
+        {'$set': {'createdAt': now}}
+    )
+    if taken.modified_count:
+        return None
+    raise IdempotencyError('A request with this Idempotency-Key is in progress', 409)
+
+
+def finish(collection, user_email, key, status, body, mimetype):
+    yield collection.update_one(
+        {'_id': _id(user_email, key), 'state': 'pending'},
+        {'$set': {'state': 'done', 'status': status, 'body': body, 'mimetype': mimetype}}
+    )
+
+
+def release(collection, user_email, key):
+    yield collection.delete_one({'_id': _id(user_email, key), 'state': 'pending'})
@@ -0,0 +1,122 @@
+# item_usage.py - single-write item usage
+#
+# Themes and backgrounds: one find_one_and_update whose arrayFilters
+# deactivate every other item of the category and activate the target in
+# the same $set. Powerups: one find_one_and_update that consumes a use and
+# applies the powerup's effect from POWERUP_EFFECTS; an exhausted powerup
+# is then removed, leaving a tombstone (see versions). The write count does not depend on
+# the size of the inventory. use_item is a repository generator (see
+# repository).
+
+from pymongo import ReturnDocument
+
+import leaderboard
+import shop
+import versions
+from errors import ApiError
+
+ACTIVATABLE = {
+    'themes': ('Theme', 'activated'),
+    'backgrounds': ('Background', 'applied'),
+}
+
+# Extra update operators applied to the inventory document when a powerup
+# is used. Powerups without an entry are simply consumed.
+POWERUP_EFFECTS = {
+    'powerup-5': {'$inc': {'coins': 50}},  # Bonus Coins
+}
+
+
+class ItemUsageError(ApiError):
+    pass
+
+
+def _owned_item(inventory_collection, user_email, item_id):
+    doc = yield inventory_collection.find_one(
+        {'user_email': user_email},
+        {'_id': False, 'items': {'$elemMatch': {'id': item_id}}}
+    )
+    if not doc:
+        raise ItemUsageError('User inventory not found', 404)
+    if not doc.get('items'):
+        raise ItemUsageError('Item not found in inventory', 404)
+    return doc['items'][0]
+
+
+def _activate(inventory_collection, user_email, item_id, category):
+    doc = yield inventory_collection.find_one_and_update(
+        {'user_email': user_email, 'items': {'$elemMatch': {'id': item_id, 'category': category}}},
+        versions.stamp({'$set': {
+            'items.$[other].isActive': False,
+            'items.$[target].isActive': True
+        }}, 'items.$[other].v', 'items.$[target].v'),
+        projection={'_id': False, 'items': {'$elemMatch': {'id': item_id}}},
+        array_filters=[
+            # only items that are on, so the rest keep their version
+            {'other.category': category, 'other.id': {'$ne': item_id}, 'other.isActive': True},
+            {'target.id': item_id}
+        ],
+        return_document=ReturnDocument.AFTER
+    )
+    if not doc:
+        # owned, but stored under another category
+        yield from _owned_item(inventory_collection, user_email, item_id)
+        raise ItemUsageError('Unknown item category', 400)
+
+    item = doc['items'][0]
+    label, verb = ACTIVATABLE[category]
+    return {'message': f'{label} {item["name"]} {verb}'}
+
+
+def _merge_updates(*updates):
+    merged = {}
+    for update in updates:
+        for op, fields in update.items():
+            merged.setdefault(op, {}).update(fields)
+    return merged
+
+
+def _use_powerup(inventory_collection, user_email, item_id, leaderboard_collection=None):
+    update = _merge_updates(
+        versions.stamp({'$inc': {'items.$.usesLeft': -1}}, 'items.$.v'),
+        POWERUP_EFFECTS.get(item_id, {})
+    )
+    doc = yield inventory_collection.find_one_and_update(
+        {'user_email': user_email, 'items': {'$elemMatch': {'id': item_id, 'usesLeft': {'$gt': 0}}}},
+        update,
+        projection={'_id': False, 'coins': True, 'version': True, 'items': {'$elemMatch': {'id': item_id}}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not doc:
+        yield from _owned_item(inventory_collection, user_email, item_id)
+        raise ItemUsageError('No uses left for this powerup', 400)
+
+    item = doc['items'][0]
+    if leaderboard_collection is not None and 'coins' in POWERUP_EFFECTS.get(item_id, {}).get('$inc', {}):
+        yield from leaderboard.record_coins(leaderboard_collection, user_email, doc)
+    if item.get('usesLeft', 0) <= 0:
+        # Remove the item once no uses are left
+        yield from versions.remove(
+            inventory_collection, user_email, 'items',
+            {'id': item_id, 'usesLeft': {'$lte': 0}}, item_id
+        )
+
+    return {
+        'message': f'Powerup {item["name"]} used successfully',
+        'currentCoins': doc.get('coins', 0)
+    }
+
+
+def use_item(inventory_collection, user_email, item_id, leaderboard_collection=None):
+    # The catalog knows the category, so the common case needs no read
+    catalog_item = shop.catalog.get(item_id)
+    if catalog_item:
+        category = catalog_item['category']
+    else:
+        category = (yield from _owned_item(inventory_collection, user_email, item_id)).get('category')
+
+    if category in ACTIVATABLE:
+        return (yield from _activate(inventory_collection, user_email, item_id, category))
+    if category == 'powerups':
+        return (yield from _use_powerup(inventory_collection, user_email, item_id, leaderboard_collection))
+    raise ItemUsageError('Unknown item category', 400)
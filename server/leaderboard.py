@@ -0,0 +1,276 @@
+# leaderboard.py - precomputed leaderboards
+#
+# One document per board and user in leaderboard_scores:
+#   {_id: '<board>:<email>', board, user, score, v}
+# read through the (board, score, user) index, so a page of the top N and
+# a user's rank never look at user_habits. Boards:
+#   streak, streak:<category>            longest current streak ($max on
+#                                        completion, recomputed by rollover)
+#   completions, completions:<category>  total completions ($inc)
+#   coins                                current balance ($set, guarded by
+#                                        the inventory version so an older
+#                                        balance never overwrites a newer one)
+# Scores are maintained incrementally by the completion engine, the daily
+# rollover and the coin-changing routes; when completions are deferred
+# (see tasks), refresh() recomputes a batch of users' scores instead. Hot
+# pages are cached for LEADERBOARD_CACHE_TTL seconds.
+#
+# A rank is a count of the higher scores on the index, which walks one key
+# per user ahead. The count stops at MAX_EXACT_RANK, so a lookup never
+# walks more than that: ranks past it come back as MAX_EXACT_RANK + 1 with
+# exact: false, meaning "below the top MAX_EXACT_RANK", the same depth
+# pages stop at. A maintained score histogram would give estimates down
+# there, but costs an extra write per score change, and the scores are
+# $inc / $max updates that do not know the score they replace.
+#
+# Functions taking collections are repository generators (see repository).
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import achievement_engine
+from errors import ApiError
+from response_cache import LocalBackend
+
+INDEXES = [
+    ([('board', ASCENDING), ('score', DESCENDING), ('user', ASCENDING)], {}),
+]
+
+GLOBAL_BOARDS = ('streak', 'completions', 'coins')
+CATEGORY_BOARDS = ('streak', 'completions')
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# deep pages are a skip on the index; nobody browses past this
+MAX_OFFSET = 10000
+# ranks below this are reported as a bound, not counted
+MAX_EXACT_RANK = MAX_OFFSET
+
+
+class LeaderboardError(ApiError):
+    pass
+
+
+def ensure_indexes(collection):
+    for keys, options in INDEXES:
+        collection.create_index(keys, **options)
+
+
+def check_board(board):
+    if board in GLOBAL_BOARDS:
+        return board
+    kind, _, category = board.partition(':')
+    if kind in CATEGORY_BOARDS and achievement_engine.safe_category(category):
+        return board
+    raise LeaderboardError('Unknown leaderboard', 404)
+
+
+def page_args(args):
+    # ?page=&limit= query arguments (page is 1-based)
+    try:
+        page = int(args.get('page', 1))
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise LeaderboardError('page and limit must be integers', 400)
+    if page < 1 or not 1 <= limit <= MAX_PAGE_SIZE:
+        raise LeaderboardError(f'page must be >= 1 and limit between 1 and {MAX_PAGE_SIZE}', 400)
+    if (page - 1) * limit >= MAX_OFFSET:
+        raise LeaderboardError(f'Only the top {MAX_OFFSET} entries can be paged', 400)
+    return page, limit
+
+
+def _key(board, user_email):
+    return f'{board}:{user_email}'
+
+
+def _upsert(board, user_email, update):
+    update = dict(update)
+    update['$setOnInsert'] = {'board': board, 'user': user_email}
+    return UpdateOne({'_id': _key(board, user_email)}, update, upsert=True)
+
+
+# Write operations (lists of UpdateOne for one bulk_write)
+
+def completion_ops(user_email, habits):
+    # Just-completed habits, with their new streaks
+    ops = [_upsert('completions', user_email, {'$inc': {'score': len(habits)}})]
+    streak = max((h.get('streak', 0) for h in habits), default=0)
+    ops.append(_upsert('streak', user_email, {'$max': {'score': streak}}))
+
+    per_category = {}
+    for habit in habits:
+        cat = habit.get('category')
+        if achievement_engine.safe_category(cat):
+            count, best = per_category.get(cat, (0, 0))
+            per_category[cat] = (count + 1, max(best, habit.get('streak', 0)))
+    for cat, (count, best) in per_category.items():
+        ops.append(_upsert(f'completions:{cat}', user_email, {'$inc': {'score': count}}))
+        ops.append(_upsert(f'streak:{cat}', user_email, {'$max': {'score': best}}))
+    return ops
+
+
+def streak_ops(user_email, habits, categories=()):
+    # Current streaks recomputed from all of the user's habits, after
+    # streaks were reset or habits deleted; `categories` the user may no
+    # longer have habits in drop to 0
+    best = {f'streak:{cat}': 0 for cat in categories if achievement_engine.safe_category(cat)}
+    best['streak'] = 0
+    for habit in habits:
+        streak = habit.get('streak', 0) or 0
+        best['streak'] = max(best['streak'], streak)
+        cat = habit.get('category')
+        if achievement_engine.safe_category(cat):
+            best[f'streak:{cat}'] = max(best.get(f'streak:{cat}', 0), streak)
+    return score_ops(user_email, best)
+
+
+def score_ops(user_email, boards):
+    # Absolute scores, {board: score}
+    return [_upsert(board, user_email, {'$set': {'score': score}}) for board, score in boards.items()]
+
+
+def completion_boards(counters):
+    # Completion scores from the achievement counters
+    boards = {'completions': achievement_engine.counter_value(counters, 'totalCompletions')}
+    for cat, count in ((counters or {}).get('categories') or {}).items():
+        boards[f'completions:{cat}'] = count
+    return boards
+
+
+def _coins_update(user_email, inventory):
+    # `inventory` is the document returned by the coin update, with its
+    # version; a balance older than the stored one matches nothing, and the
+    # upsert's insert then fails on the _id
+    version = inventory.get('version')
+    query = {'_id': _key('coins', user_email)}
+    update = {'$set': {'score': inventory['coins']}, '$setOnInsert': {'board': 'coins', 'user': user_email}}
+    if version is not None:
+        # {'v': None} also matches scores written without a version
+        query['$or'] = [{'v': {'$lt': version}}, {'v': None}]
+        update['$set']['v'] = version
+    return query, update
+
+
+def _coins_op(user_email, inventory):
+    query, update = _coins_update(user_email, inventory)
+    return UpdateOne(query, update, upsert=True)
+
+
+def _bulk_write(collection, ops):
+    try:
+        yield collection.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # only a newer coin balance already stored is expected
+        if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+            raise
+
+
+def record_completions(collection, user_email, habits, inventory=None):
+    # `inventory`, the document returned by the reward's coin update, puts
+    # the new balance in the same bulk write
+    ops = completion_ops(user_email, habits) if habits else []
+    if inventory and 'coins' in inventory:
+        ops.append(_coins_op(user_email, inventory))
+    if ops:
+        yield from _bulk_write(collection, ops)
+
+
+def record_streaks(collection, user_email, habits, categories=()):
+    yield collection.bulk_write(streak_ops(user_email, habits, categories), ordered=False)
+
+
+def record_coins(collection, user_email, inventory):
+    if not inventory or 'coins' not in inventory:
+        return
+    query, update = _coins_update(user_email, inventory)
+    try:
+        yield collection.update_one(query, update, upsert=True)
+    except DuplicateKeyError:
+        pass
+
+
+def refresh(collection, habits_collection, inventory_collection, achievements_collection, user_emails):
+    # Every board of `user_emails` from their current habits, counters and
+    # coins: three reads and one bulk write for the whole batch
+    emails = list(user_emails)
+    if not emails:
+        return
+    match = {'user_email': {'$in': emails}}
+    habit_docs = yield habits_collection.find(match, {'_id': False, 'user_email': True, 'habits.streak': True, 'habits.category': True})
+    counter_docs = yield achievements_collection.find(match, {'_id': False, 'user_email': True, 'counters': True})
+    inventories = yield inventory_collection.find(match, {'_id': False, 'user_email': True, 'coins': True, 'version': True})
+
+    ops = []
+    for doc in habit_docs:
+        ops += streak_ops(doc['user_email'], doc.get('habits', []))
+    for doc in counter_docs:
+        ops += score_ops(doc['user_email'], completion_boards(doc.get('counters')))
+    for doc in inventories:
+        if 'coins' in doc:
+            ops.append(_coins_op(doc['user_email'], doc))
+    if ops:
+        yield from _bulk_write(collection, ops)
+
+
+# Reads
+
+class PageCache:
+    # Short-lived cache of the hottest pages, shared by all users
+    def __init__(self, ttl=5, max_entries=512):
+        self.ttl = ttl
+        self.backend = LocalBackend(max_entries) if ttl > 0 else None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.get('LEADERBOARD_CACHE_TTL', 5))
+
+    def get(self, key):
+        return self.backend.get(key) if self.backend else None
+
+    def set(self, key, value):
+        if self.backend:
+            self.backend.set(key, value, self.ttl)
+
+
+def top(collection, users_collection, board, page=1, limit=DEFAULT_PAGE_SIZE, cache=None):
+    check_board(board)
+    key = (board, page, limit)
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        return cached
+
+    offset = (page - 1) * limit
+    rows = yield collection.aggregate([
+        {'$match': {'board': board}},
+        {'$sort': {'score': -1, 'user': 1}},
+        {'$skip': offset},
+        {'$limit': limit},
+        # display names only, never emails
+        {'$lookup': {'from': users_collection.name, 'localField': 'user', 'foreignField': 'email', 'as': 'u'}},
+        {'$project': {'_id': False, 'score': True, 'name': {'$arrayElemAt': ['$u.name', 0]}}}
+    ])
+
+    result = {
+        'board': board,
+        'page': page,
+        'limit': limit,
+        'entries': [
+            {'rank': offset + n + 1, 'name': row.get('name') or 'Anonymous', 'score': row.get('score', 0)}
+            for n, row in enumerate(rows)
+        ]
+    }
+    if cache is not None:
+        cache.set(key, result)
+    return result
+
+
+def rank(collection, board, user_email):
+    # Competition rank: users with the same score share it
+    check_board(board)
+    doc = yield collection.find_one({'_id': _key(board, user_email)}, {'_id': False, 'score': True})
+    if doc is None:
+        return {'board': board, 'rank': None, 'score': None, 'exact': True}
+
+    score = doc.get('score', 0)
+    ahead = yield collection.count_documents({'board': board, 'score': {'$gt': score}}, limit=MAX_EXACT_RANK)
+    return {'board': board, 'rank': ahead + 1, 'score': score, 'exact': ahead < MAX_EXACT_RANK}
@@ -0,0 +1,352 @@
+# metrics.py - request, MongoDB and bcrypt instrumentation
+#
+# A pymongo CommandListener attributes every command to the request that
+# issued it (through a context variable, so it works for request threads
+# and for asyncio tasks alike). Per request we count round trips, Mongo
+# time and bcrypt time; per collection/command we record counts, durations
+# and BSON bytes sent and received. Everything is exposed on /metrics in
+# the Prometheus text format.
+#
+# /metrics answers requests with `Authorization: Bearer <METRICS_TOKEN>`,
+# or, without a token configured, only clients on the loopback interface
+# (behind a proxy, make remote_addr the client address, see admission). It
+# is exempt from admission so a busy worker can still be scraped; a
+# refused request costs a comparison.
+#
+# The hot path is a few dict lookups and one short lock per observation.
+# Counting BSON bytes re-encodes each command and reply, so it is off
+# unless METRICS_COMMAND_BYTES=1. With SLOW_REQUEST_MS set, requests
+# slower than that are logged (logger 'slow_requests') with their command
+# trace.
+#
+# Values are per process: with several workers, scrape each one (or run
+# one worker per container).
+
+import contextvars
+import hmac
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+import bson
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+slow_log = logging.getLogger('slow_requests')
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f'{self.name}{_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, label_values, value):
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f'{self.name}{_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # per-bucket counts (+Inf last), sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][slot] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self._series.items())
+        for label_values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                extra = (('le', le),)
+                lines.append(f'{self.name}_bucket{_labels(self.labels, label_values, extra)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, label_values)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labels, label_values)} {cumulative}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_duration = registry.add(Histogram(
+    'momentum_http_request_duration_seconds', 'Request latency by endpoint',
+    ('endpoint', 'method', 'status')))
+request_commands = registry.add(Histogram(
+    'momentum_request_mongo_commands', 'MongoDB round trips per request',
+    ('endpoint', 'method'), COUNT_BUCKETS))
+mongo_commands = registry.add(Counter(
+    'momentum_mongo_commands_total', 'MongoDB commands by collection and command',
+    ('collection', 'command', 'outcome')))
+mongo_duration = registry.add(Histogram(
+    'momentum_mongo_command_duration_seconds', 'MongoDB command latency',
+    ('collection', 'command')))
+mongo_sent_bytes = registry.add(Counter(
+    'momentum_mongo_sent_bytes_total', 'BSON bytes of commands sent',
+    ('collection', 'command')))
+mongo_received_bytes = registry.add(Counter(
+    'momentum_mongo_received_bytes_total', 'BSON bytes of replies received',
+    ('collection', 'command')))
+bcrypt_duration = registry.add(Histogram(
+    'momentum_bcrypt_duration_seconds', 'bcrypt hash / check time',
+    ('operation',)))
+admission_decisions = registry.add(Counter(
+    'momentum_admission_decisions_total', 'Admission decisions (admitted, rate_limited, shed) by endpoint',
+    ('endpoint', 'decision')))
+admission_in_flight = registry.add(Gauge(
+    'momentum_admission_in_flight', 'Requests holding a concurrency slot', ()))
+background_tasks = registry.add(Counter(
+    'momentum_background_tasks_total', 'Background tasks processed by outcome (done, retry, failed)',
+    ('outcome',)))
+
+
+class RequestTrace:
+    __slots__ = ('endpoint', 'method', 'started', 'commands', 'mongo_seconds', 'bcrypt_seconds', 'events')
+
+    def __init__(self, endpoint, method, keep_events):
+        self.endpoint = endpoint
+        self.method = method
+        self.started = time.perf_counter()
+        self.commands = 0
+        self.mongo_seconds = 0.0
+        self.bcrypt_seconds = 0.0
+        # (command, collection, ms) tuples, only kept for the slow log
+        self.events = [] if keep_events else None
+
+
+_current = contextvars.ContextVar('request_trace', default=None)
+
+
+def current():
+    return _current.get()
+
+
+# set from the app config by configure()
+SLOW_REQUEST_MS = 0
+COUNT_BYTES = False
+
+LOOPBACK = ('127.0.0.1', '::1')
+
+
+def configure(settings):
+    global SLOW_REQUEST_MS, COUNT_BYTES
+    SLOW_REQUEST_MS = float(settings.get('SLOW_REQUEST_MS') or 0)
+    COUNT_BYTES = bool(settings.get('METRICS_COMMAND_BYTES', False))
+
+
+def scrape_allowed(authorization, remote_addr, token):
+    if token:
+        return hmac.compare_digest((authorization or '').encode(), f'Bearer {token}'.encode())
+    return remote_addr in LOOPBACK
+
+
+def start_request(endpoint, method):
+    trace = RequestTrace(endpoint or 'unmatched', method, SLOW_REQUEST_MS > 0)
+    _current.set(trace)
+    return trace
+
+
+def finish_request(trace, status):
+    _current.set(None)
+    elapsed = time.perf_counter() - trace.started
+
+    http_duration.observe((trace.endpoint, trace.method, str(status)), elapsed)
+    request_commands.observe((trace.endpoint, trace.method), trace.commands)
+
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        slow_log.warning(json.dumps({
+            'endpoint': trace.endpoint,
+            'method': trace.method,
+            'status': status,
+            'ms': round(elapsed * 1000, 2),
+            'mongoCommands': trace.commands,
+            'mongoMs': round(trace.mongo_seconds * 1000, 2),
+            'bcryptMs': round(trace.bcrypt_seconds * 1000, 2),
+            'trace': trace.events,
+        }))
+
+
+def observe_bcrypt(operation, seconds, trace=None):
+    bcrypt_duration.observe((operation,), seconds)
+    if trace is not None:
+        trace.bcrypt_seconds += seconds
+
+
+def _bson_size(doc):
+    try:
+        return len(bson.encode(doc))
+    except Exception:
+        return 0
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        # started -> finished correlation; pymongo calls the finishing
+        # callback from the same thread / task that started the command
+        self._pending = {}
+
+    def started(self, event):
+        name = event.command_name
+        command = event.command
+        collection = command.get('collection') if name == 'getMore' else command.get(name)
+        if not isinstance(collection, str):
+            collection = '-'
+        key = (event.connection_id, event.request_id)
+        self._pending[key] = (collection, _current.get())
+        if COUNT_BYTES:
+            mongo_sent_bytes.inc((collection, name), _bson_size(command))
+
+    def _finished(self, event, outcome):
+        collection, trace = self._pending.pop((event.connection_id, event.request_id), ('-', None))
+        seconds = event.duration_micros / 1e6
+        labels = (collection, event.command_name)
+
+        mongo_commands.inc(labels + (outcome,))
+        mongo_duration.observe(labels, seconds)
+        if trace is not None:
+            trace.commands += 1
+            trace.mongo_seconds += seconds
+            if trace.events is not None:
+                trace.events.append((event.command_name, collection, round(seconds * 1000, 3)))
+        return labels
+
+    def succeeded(self, event):
+        labels = self._finished(event, 'ok')
+        if COUNT_BYTES:
+            mongo_received_bytes.inc(labels, _bson_size(event.reply))
+
+    def failed(self, event):
+        self._finished(event, 'error')
+
+
+command_listener = CommandMetrics()
+
+
+def init_app(app):
+    # Flask: time every request and serve /metrics
+    from flask import request
+
+    configure(app.config)
+
+    @app.before_request
+    def _start():
+        rule = request.url_rule.rule if request.url_rule else None
+        request.environ['momentum.trace'] = start_request(rule, request.method)
+
+    @app.after_request
+    def _finish(response):
+        trace = request.environ.pop('momentum.trace', None)
+        if trace:
+            finish_request(trace, response.status_code)
+        return response
+
+    @app.route('/metrics')
+    def _metrics():
+        if not scrape_allowed(request.headers.get('Authorization'), request.remote_addr, app.config.get('METRICS_TOKEN')):
+            return app.response_class('forbidden\n', status=403, mimetype='text/plain')
+        return app.response_class(registry.render(), mimetype=CONTENT_TYPE)
+
+
+def init_quart_app(app):
+    # Same for the ASGI app
+    from quart import g, request
+
+    configure(app.config)
+
+    @app.before_request
+    async def _start():
+        rule = request.url_rule.rule if request.url_rule else None
+        g.momentum_trace = start_request(rule, request.method)
+
+    @app.after_request
+    async def _finish(response):
+        trace = g.pop('momentum_trace', None)
+        if trace:
+            finish_request(trace, response.status_code)
+        return response
+
+    @app.route('/metrics')
+    async def _metrics():
+        if not scrape_allowed(request.headers.get('Authorization'), request.remote_addr, app.config.get('METRICS_TOKEN')):
+            return app.response_class('forbidden\n', status=403, mimetype='text/plain')
+        return app.response_class(registry.render(), mimetype=CONTENT_TYPE)
@@ -0,0 +1,247 @@
+# migrations.py - versioned index bootstrap / schema migrations
+#
+# Each migration is (version, description, function(db)). The highest
+# applied version is stored in the schema_migrations collection, so running
+# this again only applies what is new. All steps are idempotent, so several
+# workers starting at once is harmless. A step that cannot apply (e.g. the
+# unique email index over duplicated accounts) raises MigrationError naming
+# what to fix, and leaves the version at the last step that did.
+#
+# The code only reads the latest schema (e.g. achievements in `earned`
+# since v5; a v4 document would have every claim paid again), so without
+# RUN_MIGRATIONS the app refuses to start on an older one (require_latest).
+#
+# CLI:
+#   python migrations.py            # apply pending migrations
+#   python migrations.py --status   # print current and latest version
+
+import argparse
+import logging
+import os
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, UpdateOne
+
+import achievement_engine
+import history
+import idempotency
+import leaderboard
+import tasks
+import versions
+
+log = logging.getLogger('migrations')
+
+SCHEMA_ID = 'schema'
+# how many conflicting values a MigrationError lists
+MAX_REPORTED = 20
+
+
+class MigrationError(Exception):
+    pass
+
+
+def duplicates(collection, field):
+    # {value: count} for values of `field` held by more than one document
+    return {
+        doc['_id']: doc['count']
+        for doc in collection.aggregate([
+            {'$group': {'_id': f'${field}', 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}},
+            {'$sort': {'_id': 1}}
+        ])
+    }
+
+
+def _ensure_unique(collection, field):
+    # A unique index cannot be built over duplicates; rather than the bare
+    # DuplicateKeyError, name them so they can be merged or removed by hand
+    found = duplicates(collection, field)
+    if found:
+        listed = ', '.join(f'{value!r} x{count}' for value, count in list(found.items())[:MAX_REPORTED])
+        more = f' and {len(found) - MAX_REPORTED} more' if len(found) > MAX_REPORTED else ''
+        raise MigrationError(
+            f'{collection.name}.{field} has {len(found)} duplicated values, '
+            f'resolve them before migrating: {listed}{more}'
+        )
+    collection.create_index([(field, ASCENDING)], unique=True)
+
+
+def _v1_core_indexes(db):
+    # Every handler looks users up by email / user_email; the unique indexes
+    # also make duplicate registrations fail at insert time
+    _ensure_unique(db['users'], 'email')
+    for name in ('user_habits', 'user_inventory', 'user_achievements'):
+        _ensure_unique(db[name], 'user_email')
+
+    # Multikey indexes for the positional / arrayFilters queries on embedded ids
+    db['user_habits'].create_index([('user_email', ASCENDING), ('habits.id', ASCENDING)])
+    db['user_inventory'].create_index([('user_email', ASCENDING), ('items.id', ASCENDING)])
+    db['user_achievements'].create_index([('user_email', ASCENDING), ('achievements.id', ASCENDING)])  # dropped in v5
+
+
+def _v2_history_indexes(db):
+    history.ensure_indexes(db['habit_history'])
+
+
+def _v3_rollover_indexes(db):
+    # rollover walks each timezone bucket in _id order
+    db['user_habits'].create_index([('timezone', ASCENDING), ('_id', ASCENDING)])
+
+
+def _v4_element_versions(db):
+    # Habits / items written before versions existed have no `v` and are
+    # sent in every delta until stamped
+    for name, array in (('user_habits', 'habits'), ('user_inventory', 'items')):
+        db[name].update_many(
+            {array: {'$elemMatch': {'v': {'$exists': False}}}},
+            versions.stamp({}, f'{array}.$[legacy].v'),
+            array_filters=[{'legacy.v': {'$exists': False}}]
+        )
+    db['user_achievements'].update_many(
+        {'version': {'$exists': False}},
+        versions.stamp({})
+    )
+
+
+def _v5_compact_achievements(db, batch_size=1000):
+    # The full catalog copy per user becomes counters + {id: {earnedAt,
+    # claimed}}; the catalog is served from memory
+    collection = db['user_achievements']
+    now_iso = datetime.now(timezone.utc).isoformat()
+
+    def flush(ops):
+        if ops:
+            collection.bulk_write(ops, ordered=False)
+        return []
+
+    ops = []
+    for doc in collection.find({'achievements': {'$exists': True}},
+                               {'user_email': True, 'achievements': True, 'counters': True}):
+        earned = {
+            ach['id']: achievement_engine.earned_state(ach.get('earnedDate') or now_iso, bool(ach.get('claimed')))
+            for ach in doc.get('achievements') or []
+            if ach.get('earned') and achievement_engine.catalog.get(ach.get('id'))
+        }
+        update = {'$set': {'earned': earned}, '$unset': {'achievements': ''}}
+        if doc.get('counters') is None:
+            habits_doc = db['user_habits'].find_one({'user_email': doc.get('user_email')}, {'habits': True}) or {}
+            update['$set']['counters'] = achievement_engine.counters_from_habits(habits_doc.get('habits', []))
+        ops.append(UpdateOne({'_id': doc['_id']}, versions.stamp(update)))
+        if len(ops) >= batch_size:
+            ops = flush(ops)
+    flush(ops)
+
+    if 'user_email_1_achievements.id_1' in collection.index_information():
+        collection.drop_index('user_email_1_achievements.id_1')
+
+
+def _v6_leaderboards(db):
+    leaderboard.ensure_indexes(db['leaderboard_scores'])
+    rebuild_leaderboards(db)
+
+
+def rebuild_leaderboards(db, batch_size=1000):
+    # Scores for existing users: streaks from habits, completions from the
+    # achievement counters, coins from inventories (also after an import)
+    scores = db['leaderboard_scores']
+
+    def flush(ops, force=False):
+        if ops and (force or len(ops) >= batch_size):
+            scores.bulk_write(ops, ordered=False)
+            return []
+        return ops
+
+    ops = []
+    for doc in db['user_habits'].find({}, {'user_email': True, 'habits.streak': True, 'habits.category': True}):
+        ops = flush(ops + leaderboard.streak_ops(doc['user_email'], doc.get('habits', [])))
+    for doc in db['user_achievements'].find({}, {'user_email': True, 'counters': True}):
+        ops = flush(ops + leaderboard.score_ops(doc['user_email'], leaderboard.completion_boards(doc.get('counters'))))
+    for doc in db['user_inventory'].find({}, {'user_email': True, 'coins': True}):
+        ops = flush(ops + leaderboard.score_ops(doc['user_email'], {'coins': doc.get('coins', 0)}))
+    flush(ops, force=True)
+
+
+def _v7_idempotency_keys(db):
+    idempotency.ensure_indexes(db['idempotency_keys'])
+
+
+def _v8_task_outbox(db):
+    tasks.ensure_indexes(db['task_outbox'])
+
+
+MIGRATIONS = [
+    (1, 'unique user lookups and embedded id indexes', _v1_core_indexes),
+    (2, 'habit_history bucket index', _v2_history_indexes),
+    (3, 'rollover timezone bucket index', _v3_rollover_indexes),
+    (4, 'versions on existing habits, items and achievements', _v4_element_versions),
+    (5, 'achievement catalog out of user documents', _v5_compact_achievements),
+    (6, 'leaderboard score index and backfill', _v6_leaderboards),
+    (7, 'idempotency key expiry index', _v7_idempotency_keys),
+    (8, 'background task outbox indexes', _v8_task_outbox),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(db):
+    doc = db['schema_migrations'].find_one({'_id': SCHEMA_ID}) or {}
+    return doc.get('version', 0)
+
+
+def require_latest(version):
+    if version < LATEST_VERSION:
+        raise MigrationError(
+            f'database schema is at version {version}, this code needs {LATEST_VERSION}: '
+            f'run `python migrations.py` or set RUN_MIGRATIONS=1'
+        )
+    return version
+
+
+def migrate(db, target=LATEST_VERSION):
+    version = current_version(db)
+    for number, description, apply in MIGRATIONS:
+        if number <= version or number > target:
+            continue
+        log.info('applying migration %d: %s', number, description)
+        apply(db)
+        db['schema_migrations'].update_one(
+            {'_id': SCHEMA_ID},
+            {
+                '$max': {'version': number},
+                '$push': {'history': {
+                    'version': number,
+                    'description': description,
+                    'appliedAt': datetime.now(timezone.utc)
+                }}
+            },
+            upsert=True
+        )
+        version = number
+    return version
+
+
+def main():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description='Apply database migrations')
+    parser.add_argument('--status', action='store_true', help='only print the schema version')
+    parser.add_argument('--target', type=int, default=LATEST_VERSION)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    load_dotenv()
+    db = MongoClient(os.getenv('MONGO_URI'))['momentum_db']
+
+    if args.status:
+        print(f'schema version {current_version(db)} (latest {LATEST_VERSION})')
+        return
+
+    try:
+        print(f'schema version {migrate(db, args.target)}')
+    except MigrationError as e:
+        raise SystemExit(f'migration failed at schema version {current_version(db)}: {e}')
+
+
+if __name__ == '__main__':
+    main()
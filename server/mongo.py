@@ -0,0 +1,51 @@
+# mongo.py - one lazily created MongoClient per worker process
+#
+# Nothing connects at import or create_app time, so the app can be
+# preloaded in a gunicorn master and forked: each worker builds its own
+# client (and pool) on its first query. A client inherited across a fork
+# is never reused; the pid check replaces it in the child.
+
+import os
+import threading
+
+from pymongo import MongoClient
+
+import config as app_config
+
+
+class LazyMongo:
+    def __init__(self, config, client_class=MongoClient, listeners=()):
+        self.config = config
+        self.client_class = client_class
+        self.listeners = list(listeners)
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    self._client = self.client_class(
+                        self.config['MONGO_URI'],
+                        event_listeners=self.listeners,
+                        **app_config.mongo_options(self.config)
+                    )
+                    self._pid = os.getpid()
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.config['MONGO_DB']]
+
+    def __getitem__(self, name):
+        # lets a repository use this in place of a database
+        return self.db[name]
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._pid = None
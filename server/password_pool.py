@@ -0,0 +1,137 @@
+# password_pool.py - bcrypt hashing off the request threads
+#
+# bcrypt is deliberately slow, so a burst of logins can eat every core the
+# web worker has. Hashes and checks run on a small dedicated pool instead,
+# and at most `workers + queue_depth` of them may be in flight; anything
+# beyond that fails fast with PoolOverloaded (503) rather than queueing
+# behind the storm.
+#
+# The pool uses threads: bcrypt releases the GIL while hashing, so each
+# pool thread gets a core of its own, while request threads keep running.
+# A process pool would have to re-import app.py (and its startup side
+# effects) in every child under spawn/forkserver. The pool is created
+# lazily, so it is safe to import before a forking server starts workers.
+#
+# Settings (environment):
+#   BCRYPT_LOG_ROUNDS     cost factor for new hashes (default 12)
+#   PASSWORD_POOL_WORKERS pool threads (default: half the CPUs; 0 = inline)
+#   PASSWORD_POOL_QUEUE   extra requests allowed to wait (default 4 x workers)
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import bcrypt
+
+import metrics
+
+DEFAULT_ROUNDS = 12
+
+
+class PoolOverloaded(Exception):
+    pass
+
+
+def _password_bytes(password):
+    # bcrypt only looks at the first 72 bytes
+    return password.encode('utf-8')[:72]
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(_password_bytes(password), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(pw_hash, password):
+    try:
+        return bcrypt.checkpw(_password_bytes(password), pw_hash.encode('utf-8'))
+    except ValueError:
+        # malformed stored hash
+        return False
+
+
+def _timed(fn, trace):
+    # bcrypt time per operation, and on the calling request's trace
+    operation = fn.__name__.lstrip('_')
+
+    def timed(*args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            metrics.observe_bcrypt(operation, time.perf_counter() - start, trace)
+    return timed
+
+
+def hash_rounds(pw_hash):
+    # '$2b$12$...' -> 12
+    try:
+        return int(pw_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordPool:
+    def __init__(self, workers=None, queue_depth=None, rounds=None):
+        if workers is None:
+            workers = int(os.getenv('PASSWORD_POOL_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+        if queue_depth is None:
+            queue_depth = int(os.getenv('PASSWORD_POOL_QUEUE', 4 * max(workers, 1)))
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.rounds = rounds or int(os.getenv('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS))
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_depth)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix='bcrypt'
+                    )
+        return self._executor
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PoolOverloaded()
+        fn = _timed(fn, metrics.current())
+        if self.workers == 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as exc:
+                future.set_exception(exc)
+        else:
+            try:
+                future = self._get_executor().submit(fn, *args)
+            except BaseException:
+                self._slots.release()
+                raise
+        # the slot is held until the hash is done, even if nobody waits
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def hash_password(self, password):
+        return self._submit(_hash, password, self.rounds).result()
+
+    def check_password(self, pw_hash, password):
+        return self._submit(_check, pw_hash, password).result()
+
+    # Event-loop friendly variants for the ASGI app
+    async def hash_password_async(self, password):
+        return await asyncio.wrap_future(self._submit(_hash, password, self.rounds))
+
+    async def check_password_async(self, pw_hash, password):
+        return await asyncio.wrap_future(self._submit(_check, pw_hash, password))
+
+    def needs_rehash(self, pw_hash):
+        return hash_rounds(pw_hash) != self.rounds
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
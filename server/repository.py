@@ -0,0 +1,348 @@
+# repository.py - data access shared by the WSGI and ASGI apps
+#
+# Route logic and the engines (completion, shop, dashboard, ...) never call
+# pymongo directly. They are generators that yield an Op describing one
+# collection call and get its result sent back:
+#
+#     doc = yield repository.inventory.find_one({'user_email': email})
+#
+# and call each other with `yield from`. SyncRepository runs them against a
+# blocking MongoClient database (app.py); AsyncRepository runs the very same
+# generators against an AsyncMongoClient database (asgi.py), awaiting each
+# call, so queries and business rules are written once for both servers.
+#
+# Cursor results (find, aggregate) come back as lists. A driver exception is
+# thrown into the generator at its yield, so engines can still catch e.g.
+# DuplicateKeyError. Work outside MongoDB that is blocking in one server and
+# awaitable in the other (hashing a password) is yielded as an Offload.
+
+from datetime import datetime, timezone
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import achievement_engine
+import leaderboard
+import versions
+
+CURSOR_METHODS = ('find', 'aggregate')
+
+
+class Op:
+    __slots__ = ('collection', 'method', 'args', 'kwargs')
+
+    def __init__(self, collection, method, args, kwargs):
+        self.collection = collection
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return f'Op({self.collection}.{self.method})'
+
+
+class Offload:
+    # `call(*args)` on SyncRepository, `await call_async(*args)` on
+    # AsyncRepository
+    __slots__ = ('call', 'call_async', 'args')
+
+    def __init__(self, call, call_async, *args):
+        self.call = call
+        self.call_async = call_async
+        self.args = args
+
+    def __repr__(self):
+        return f'Offload({self.call.__name__})'
+
+
+class Collection:
+    # Stands in for a pymongo collection inside engines: every method call
+    # returns an Op for the repository to run
+    METHODS = (
+        'find', 'find_one', 'find_one_and_update', 'aggregate', 'count_documents',
+        'insert_one', 'insert_many', 'update_one', 'update_many', 'delete_one',
+        'delete_many', 'bulk_write',
+    )
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, method):
+        if method not in self.METHODS:
+            raise AttributeError(method)
+        return lambda *args, **kwargs: Op(self.name, method, args, kwargs)
+
+
+users = Collection('users')
+habits = Collection('user_habits')
+inventory = Collection('user_inventory')
+achievements = Collection('user_achievements')
+history = Collection('habit_history')
+scores = Collection('leaderboard_scores')
+idempotency = Collection('idempotency_keys')
+outbox = Collection('task_outbox')
+
+
+def _start(work):
+    # A bare Op is run as a one-step generator
+    if isinstance(work, (Op, Offload)):
+        def single():
+            return (yield work)
+        return single()
+    return work
+
+
+class SyncRepository:
+    def __init__(self, db):
+        self.db = db
+
+    def execute(self, op):
+        if isinstance(op, Offload):
+            return op.call(*op.args)
+        result = getattr(self.db[op.collection], op.method)(*op.args, **op.kwargs)
+        if op.method in CURSOR_METHODS:
+            return list(result)
+        return result
+
+    def run(self, work):
+        gen = _start(work)
+        try:
+            op = next(gen)
+            while True:
+                try:
+                    result = self.execute(op)
+                except Exception as exc:
+                    op = gen.throw(exc)
+                else:
+                    op = gen.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+
+class AsyncRepository:
+    def __init__(self, db):
+        self.db = db
+
+    async def execute(self, op):
+        if isinstance(op, Offload):
+            return await op.call_async(*op.args)
+        collection = self.db[op.collection]
+        if op.method == 'find':
+            return await collection.find(*op.args, **op.kwargs).to_list(None)
+        result = await getattr(collection, op.method)(*op.args, **op.kwargs)
+        if op.method == 'aggregate':
+            return await result.to_list(None)
+        return result
+
+    async def run(self, work):
+        gen = _start(work)
+        try:
+            op = next(gen)
+            while True:
+                try:
+                    result = await self.execute(op)
+                except Exception as exc:
+                    op = gen.throw(exc)
+                else:
+                    op = gen.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+
+# Route-level queries used by both apps
+
+def create_user(email, password_hash, name, tz_name):
+    # The unique email index rejects concurrent duplicates
+    try:
+        yield users.insert_one({
+            'email': email,
+            'password': password_hash,
+            'name': name,
+            'timezone': tz_name
+        })
+    except DuplicateKeyError:
+        return False
+
+    # Initialize empty habits list for new user
+    yield habits.insert_one({
+        'user_email': email,
+        'timezone': tz_name,
+        'habits': []
+    })
+
+    # Initialize inventory with starting coins
+    yield inventory.insert_one({
+        'user_email': email,
+        'coins': 100,  # Starting coins for new users
+        'items': []
+    })
+    yield from leaderboard.record_coins(scores, email, {'coins': 100})
+
+    # Initialize achievements for new user (the catalog itself is shared)
+    yield achievements.insert_one({
+        'user_email': email,
+        'counters': achievement_engine.empty_counters(),
+        'earned': {}
+    })
+    return True
+
+
+def find_user(email):
+    return (yield users.find_one({'email': email}))
+
+
+def update_password(user, password_hash):
+    # Only if nobody changed the password in the meantime
+    yield users.update_one(
+        {'_id': user['_id'], 'password': user['password']},
+        {'$set': {'password': password_hash}}
+    )
+
+
+def get_profile(email):
+    return (yield users.find_one(
+        {'email': email},
+        {'_id': False, 'email': True, 'name': True}
+    ))
+
+
+def get_habits(user_email, since=None, fields=None):
+    # All habits, or with `since` only what changed after it (see versions);
+    # `fields` limits what each habit carries
+    user_habits = yield from versions.load(habits, user_email, 'habits', since, element_fields=fields)
+
+    if user_habits is None:
+        # Initialize habits if not exist
+        yield habits.update_one(
+            {'user_email': user_email},
+            {'$setOnInsert': {'habits': []}},
+            upsert=True
+        )
+        return _empty('habits', since)
+
+    return user_habits
+
+
+def _empty(array, since):
+    result = {array: [], 'version': versions.ZERO}
+    if since is not None:
+        result.update({'deleted': [], 'full': True})
+    return result
+
+
+def add_habit(user_email, new_habit):
+    result = yield habits.update_one(
+        {'user_email': user_email},
+        versions.stamp({'$push': {'habits': new_habit}}),
+        upsert=True
+    )
+    if not (result.modified_count > 0 or result.upserted_id is not None):
+        return False
+    yield from versions.stamp_new(habits, user_email, 'habits', [new_habit['id']])
+    return True
+
+
+def delete_habit(user_email, habit_id):
+    # leaves a tombstone for delta sync
+    removed = yield from versions.remove(habits, user_email, 'habits', {'id': habit_id}, habit_id)
+    if removed is None:
+        return False
+
+    # the deleted habit may have held the user's best streak
+    doc = yield habits.find_one({'user_email': user_email}, {'_id': False, 'habits.streak': True, 'habits.category': True})
+    yield from leaderboard.record_streaks(scores, user_email, (doc or {}).get('habits', []), [removed.get('category')])
+    return True
+
+
+def get_inventory(user_email, since=None, fields=None):
+    user_inventory = yield from versions.load(
+        inventory, user_email, 'items', since, fields=('coins',), element_fields=fields
+    )
+
+    if user_inventory is None:
+        # Initialize inventory if not exists
+        yield inventory.update_one(
+            {'user_email': user_email},
+            {'$setOnInsert': {'coins': 100, 'items': []}},
+            upsert=True
+        )
+        return dict(_empty('items', since), coins=100)
+
+    user_inventory['coins'] = user_inventory.get('coins') or 0
+    return user_inventory
+
+
+def get_achievements(user_email, since=None):
+    # With `since`, the list is only sent if the document changed after it.
+    # Read-only: achievements the counters reached but nobody marked yet (a
+    # task that stopped between its two writes, see tasks) are shown as
+    # earned, without a date, and claim_achievement accepts them
+    doc = yield achievements.find_one(
+        {'user_email': user_email},
+        {'_id': False, 'counters': True, 'earned': True, 'version': True}
+    )
+
+    if not doc:
+        return {'achievements': achievement_engine.user_achievements(None, {}), 'version': versions.ZERO}
+
+    version = doc.get('version', versions.ZERO)
+    if since is not None and version <= since:
+        return {'achievements': [], 'version': version, 'changed': False}
+
+    counters = doc.get('counters')
+    earned = dict(doc.get('earned') or {})
+    for ach_id in achievement_engine.reached(counters):
+        earned.setdefault(ach_id, achievement_engine.earned_state(None))
+
+    result = {'achievements': achievement_engine.user_achievements(counters, earned), 'version': version}
+    if since is not None:
+        result['changed'] = True
+    return result
+
+
+def claim_achievement(user_email, achievement_id):
+    ach = achievement_engine.catalog.get(achievement_id)
+    if not ach:
+        raise achievement_engine.AchievementError('Achievement not found', 404)
+
+    # Only matches an earned (marked, or reached by the counters), unclaimed
+    # achievement, so it pays out once; an unmarked one is marked as well
+    counter = f'counters.{achievement_engine.achievement_counter(ach)}'
+    now_iso = datetime.now(timezone.utc).isoformat()
+    user_doc = yield achievements.find_one_and_update(
+        {
+            'user_email': user_email,
+            '$or': [
+                {f'earned.{achievement_id}.earnedAt': {'$exists': True}},
+                {counter: {'$gte': ach.get('total', 0)}}
+            ],
+            f'earned.{achievement_id}.claimed': {'$ne': True}
+        },
+        versions.stamp({
+            '$set': {f'earned.{achievement_id}.claimed': True},
+            '$min': {f'earned.{achievement_id}.earnedAt': now_iso}
+        }),
+        projection={'_id': False, 'counters': True, f'earned.{achievement_id}': True},
+        return_document=ReturnDocument.AFTER
+    )
+    if not user_doc:
+        user_doc = yield achievements.find_one(
+            {'user_email': user_email}, {'_id': False, f'earned.{achievement_id}': True}
+        )
+        if not user_doc:
+            raise achievement_engine.AchievementError('No achievements found', 404)
+        if not (user_doc.get('earned') or {}).get(achievement_id, {}).get('claimed'):
+            raise achievement_engine.AchievementError('Achievement not yet earned', 400)
+        raise achievement_engine.AchievementError('Achievement already claimed', 400)
+
+    inv = yield inventory.find_one_and_update(
+        {'user_email': user_email},
+        versions.stamp({'$inc': {'coins': ach.get('coinReward', 0)}}),
+        projection={'_id': False, 'coins': True, 'version': True},
+        return_document=ReturnDocument.AFTER
+    )
+    yield from leaderboard.record_coins(scores, user_email, inv)
+
+    claimed = achievement_engine.merge(ach, user_doc.get('counters'), user_doc['earned'][achievement_id])
+    return claimed, (inv or {}).get('coins', 0)
+
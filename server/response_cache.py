@@ -0,0 +1,120 @@
+# response_cache.py - per-user cache of read-only JSON responses
+#
+# GET /habits, /inventory, /achievements, /user/stats, /user/profile and
+# /dashboard are cached as serialized bodies under (user, resource,
+# variant), with the body hash as ETag, so a repeat request is served - or
+# answered 304 Not Modified - without touching MongoDB.
+#
+# Invalidation is per user: every key embeds the user's current
+# generation token, and any mutating request replaces the token, which
+# makes all of that user's entries unreachable at once (they then age out
+# of the LRU). Entries also expire after RESPONSE_CACHE_TTL seconds,
+# which bounds staleness from writes the app does not see (the daily
+# rollover, or another worker when the backend is process-local).
+#
+# Backends: 'local' (in-process LRU/TTL, the default), 'none', or
+# 'module:factory' for a shared store; the factory gets the settings and
+# returns an object with get(key) / set(key, value, ttl). Generation tokens
+# live in the backend too, so only a shared one invalidates across
+# processes; gunicorn.conf.py turns the cache off for several workers
+# unless RESPONSE_CACHE is set.
+
+import hashlib
+import importlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import metrics
+
+cache_requests = metrics.registry.add(metrics.Counter(
+    'momentum_response_cache_requests_total', 'Cached resource lookups by result',
+    ('resource', 'result')))
+cache_invalidations = metrics.registry.add(metrics.Counter(
+    'momentum_response_cache_invalidations_total', 'Per-user cache invalidations', ()))
+
+
+class LocalBackend:
+    # Bounded LRU with per-entry expiry
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def load_backend(settings):
+    spec = settings.get('RESPONSE_CACHE') or 'none'
+    if spec == 'none':
+        return None
+    if spec == 'local':
+        return LocalBackend(settings.get('RESPONSE_CACHE_SIZE', 10000))
+    module_name, _, factory = spec.partition(':')
+    return getattr(importlib.import_module(module_name), factory)(settings)
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=30):
+        self.backend = backend
+        self.ttl = ttl
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(load_backend(settings), settings.get('RESPONSE_CACHE_TTL', 30))
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def _generation(self, user):
+        gen_key = f'gen\0{user}'
+        generation = self.backend.get(gen_key)
+        if generation is None:
+            # never reuse a token, so entries from before an eviction
+            # cannot come back
+            generation = uuid.uuid4().hex
+            self.backend.set(gen_key, generation, self.ttl)
+        return generation
+
+    def lookup(self, user, resource, variant=''):
+        # (key, (etag, body) or None)
+        key = f'{user}\0{self._generation(user)}\0{resource}\0{variant}'
+        entry = self.backend.get(key)
+        cache_requests.inc((resource, 'miss' if entry is None else 'hit'))
+        return key, entry
+
+    def store(self, key, body):
+        entry = (hashlib.sha1(body).hexdigest()[:16], body)
+        self.backend.set(key, entry, self.ttl)
+        return entry
+
+    def invalidate(self, user):
+        if not self.enabled:
+            return
+        self.backend.set(f'gen\0{user}', uuid.uuid4().hex, self.ttl)
+        cache_invalidations.inc(())
+
+    def not_modified(self, resource):
+        cache_requests.inc((resource, 'not_modified'))
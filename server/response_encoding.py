@@ -0,0 +1,164 @@
+# response_encoding.py - JSON encoding, compression and field selection
+#
+# Responses are encoded with orjson when it is installed (the stdlib
+# encoder otherwise): it writes bytes directly and handles datetime
+# natively; ObjectIds and the BSON timestamps used as versions (see
+# versions) go through default().
+#
+# Bodies of COMPRESS_MIN_BYTES or more are compressed with brotli (when
+# installed) or gzip, whichever the client prefers in Accept-Encoding;
+# COMPRESS_MIN_BYTES=0 turns this off. A compressed body keeps its ETag as
+# a weak one, so conditional requests still get 304s.
+#
+# ?fields=title,streak on list endpoints limits each element to those
+# fields; `id` and `v` are always included.
+
+import gzip
+import json
+import re
+from datetime import date
+
+from bson import ObjectId
+
+import versions
+from errors import ApiError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('application/json', 'text/plain')
+# brotli first: smaller at a similar cost for dynamic responses
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+BROTLI_QUALITY = 4
+GZIP_LEVEL = 6
+
+ALWAYS_FIELDS = ('id', 'v')
+MAX_FIELDS = 30
+FIELD_NAME = re.compile(r'[A-Za-z][A-Za-z0-9_]*')
+
+
+class FieldsError(ApiError):
+    pass
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+json_default = versions.json_default(_default)
+
+
+def _stdlib_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return json_default(value)
+
+
+def response_obj(args, kwargs):
+    # What jsonify(*args, **kwargs) serializes: keyword arguments as an
+    # object, one argument as itself, several as a list
+    if args and kwargs:
+        raise TypeError('jsonify() takes either positional or keyword arguments, not both')
+    if not args:
+        return kwargs
+    return args[0] if len(args) == 1 else list(args)
+
+
+def dumps(obj):
+    # bytes
+    if orjson is not None:
+        return orjson.dumps(obj, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_stdlib_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def fields_arg(raw):
+    # ?fields= query argument; None when absent
+    if raw in (None, ''):
+        return None
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    if not fields or len(fields) > MAX_FIELDS or not all(FIELD_NAME.fullmatch(f) for f in fields):
+        raise FieldsError(f'fields must be up to {MAX_FIELDS} comma-separated field names')
+    return tuple(dict.fromkeys(ALWAYS_FIELDS + tuple(fields)))
+
+
+def select(elements, fields):
+    if not fields:
+        return elements
+    return [{key: element[key] for key in fields if key in element} for element in elements]
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def _encoding_for(response, buffered, accept_encodings, min_bytes):
+    # The encoding to compress `response` with, or None; adds Vary when the
+    # body could have been compressed for another client
+    if min_bytes <= 0 or not buffered:
+        return None
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return None
+    if response.mimetype not in COMPRESSIBLE or 'Content-Encoding' in response.headers:
+        return None
+    response.vary.add('Accept-Encoding')
+    if (response.content_length or 0) < min_bytes:
+        return None
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def _mark_encoded(response, encoding):
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def init_app(app):
+    # Flask: call before the other init_app()s, so that compression runs
+    # after their after_request hooks
+    from flask import request
+
+    min_bytes = int(app.config.get('COMPRESS_MIN_BYTES', 0) or 0)
+
+    @app.after_request
+    def _compress(response):
+        buffered = not (response.direct_passthrough or response.is_streamed)
+        encoding = _encoding_for(response, buffered, request.accept_encodings, min_bytes)
+        if encoding:
+            response.set_data(compress(response.get_data(), encoding))
+            _mark_encoded(response, encoding)
+        return response
+
+
+def init_quart_app(app):
+    # Same for the ASGI app
+    from quart import request
+    from quart.wrappers.response import DataBody
+
+    min_bytes = int(app.config.get('COMPRESS_MIN_BYTES', 0) or 0)
+
+    @app.after_request
+    async def _compress(response):
+        buffered = isinstance(response.response, DataBody)
+        encoding = _encoding_for(response, buffered, request.accept_encodings, min_bytes)
+        if encoding:
+            response.set_data(compress(await response.get_data(), encoding))
+            _mark_encoded(response, encoding)
+        return response
@@ -0,0 +1,253 @@
+# rollover.py - daily reset of completedToday and expired streaks
+#
+# Runs once per timezone bucket after local midnight. Users are processed in
+# _id order in batches; each batch is one unordered bulk_write whose updates
+# use arrayFilters, so only the habits that need it are touched:
+#   - completedToday is cleared for habits last completed before today
+#   - streak drops to 0 for habits not completed since before yesterday
+# The streak leaderboards of each batch's users are then recomputed from
+# their habits in one more bulk write. Progress is checkpointed in the
+# rollover_state collection after every batch, so an interrupted run
+# resumes where it stopped and a finished run is a no-op.
+#
+# RolloverScheduler runs the same thing in-process. Every gunicorn worker
+# starts one, but only the holder of the lease document {_id: 'scheduler'}
+# in rollover_state ticks; the others keep trying, and take over once the
+# holder has stopped renewing it for a few intervals. The holder renews the
+# lease after every batch and stops as soon as a renewal fails, so two
+# workers never write the same bucket at once (unless one batch outlasts
+# the whole lease).
+#
+# CLI:
+#   python rollover.py                   # all timezones whose day has turned
+#   python rollover.py --tz Europe/Paris --batch-size 500 --pause 0.05
+
+import argparse
+import logging
+import os
+import socket
+import threading
+import time as time_module
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+import leaderboard
+import versions
+from timeutil import local_day_bounds, local_today
+
+log = logging.getLogger('rollover')
+
+DEFAULT_BATCH_SIZE = 1000
+SCHEDULER_LEASE_ID = 'scheduler'
+
+
+def _bucket_filter(tz_name):
+    # documents without a timezone belong to the UTC bucket
+    if tz_name == 'UTC':
+        return {'timezone': {'$in': ['UTC', None]}}
+    return {'timezone': tz_name}
+
+
+def timezones(habits_collection):
+    zones = {z for z in habits_collection.distinct('timezone') if z}
+    zones.add('UTC')
+    return sorted(zones)
+
+
+def rollover_update(yesterday_start, today_start):
+    # A habit can match both filters, so its version is stamped through a
+    # third filter that matches either; two paths to the same field would
+    # conflict
+    done = {'completedToday': True, 'lastCompletedAt': {'$lt': today_start}}
+    lapsed = {'streak': {'$gt': 0}, 'lastCompletedAt': {'$lt': yesterday_start}}
+
+    update = versions.stamp({'$set': {
+        'habits.$[done].completedToday': False,
+        'habits.$[lapsed].streak': 0
+    }}, 'habits.$[changed].v')
+    array_filters = [
+        {f'done.{k}': v for k, v in done.items()},
+        {f'lapsed.{k}': v for k, v in lapsed.items()},
+        {'$or': [{f'changed.{k}': v for k, v in done.items()},
+                 {f'changed.{k}': v for k, v in lapsed.items()}]}
+    ]
+    return update, array_filters
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def run_rollover(db, tz_name, now=None, batch_size=DEFAULT_BATCH_SIZE, pause=0.0, renew=None):
+    # `renew()` is called after every checkpoint; when it returns False the
+    # run stops with LeaseLost, and whoever took over resumes from there
+    habits_collection = db['user_habits']
+    state_collection = db['rollover_state']
+    scores_collection = db['leaderboard_scores']
+
+    now_utc = now or datetime.now(timezone.utc)
+    local_date = local_today(tz_name, now_utc).isoformat()
+    yesterday_start, today_start = local_day_bounds(tz_name, now_utc)
+    checkpoint_id = f'{tz_name}:{local_date}'
+
+    state = state_collection.find_one({'_id': checkpoint_id}) or {}
+    if state.get('done'):
+        return state
+
+    update, array_filters = rollover_update(yesterday_start, today_start)
+    query = dict(_bucket_filter(tz_name))
+    query['habits'] = {'$elemMatch': {'$or': [
+        {'completedToday': True, 'lastCompletedAt': {'$lt': today_start}},
+        {'streak': {'$gt': 0}, 'lastCompletedAt': {'$lt': yesterday_start}}
+    ]}}
+
+    last_id = state.get('lastId')
+    processed = state.get('processed', 0)
+    started = time_module.monotonic()
+    run_docs = 0
+
+    while True:
+        batch_query = dict(query)
+        if last_id is not None:
+            batch_query['_id'] = {'$gt': last_id}
+        ids = [d['_id'] for d in habits_collection.find(batch_query, {'_id': True})
+               .sort('_id', 1).limit(batch_size)]
+        if not ids:
+            break
+
+        habits_collection.bulk_write(
+            [UpdateOne({'_id': _id}, update, array_filters=array_filters) for _id in ids],
+            ordered=False
+        )
+
+        score_ops = []
+        for doc in habits_collection.find({'_id': {'$in': ids}},
+                                          {'user_email': True, 'habits.streak': True, 'habits.category': True}):
+            score_ops.extend(leaderboard.streak_ops(doc['user_email'], doc.get('habits', [])))
+        if score_ops:
+            scores_collection.bulk_write(score_ops, ordered=False)
+
+        last_id = ids[-1]
+        processed += len(ids)
+        run_docs += len(ids)
+        state_collection.update_one(
+            {'_id': checkpoint_id},
+            {'$set': {'lastId': last_id, 'processed': processed, 'updatedAt': datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+        elapsed = time_module.monotonic() - started
+        log.info('%s: %d users rolled over (%.0f users/s)', checkpoint_id, processed,
+                 run_docs / elapsed if elapsed else 0)
+        if renew is not None and not renew():
+            raise LeaseLost(checkpoint_id)
+        if pause:
+            # yield to request traffic between batches
+            time_module.sleep(pause)
+
+    elapsed = time_module.monotonic() - started
+    state = {
+        'lastId': last_id,
+        'processed': processed,
+        'done': True,
+        'seconds': round(elapsed, 3),
+        'usersPerSecond': round(run_docs / elapsed, 1) if elapsed else None,
+        'updatedAt': datetime.now(timezone.utc)
+    }
+    state_collection.update_one({'_id': checkpoint_id}, {'$set': state}, upsert=True)
+    log.info('%s: done, %d users in %.2fs', checkpoint_id, processed, elapsed)
+    return state
+
+
+def run_all(db, now=None, batch_size=DEFAULT_BATCH_SIZE, pause=0.0, renew=None):
+    # Every bucket whose local day has started gets a checkpoint for that
+    # day; buckets already done today are skipped by run_rollover.
+    return {tz_name: run_rollover(db, tz_name, now, batch_size, pause, renew)
+            for tz_name in timezones(db['user_habits'])}
+
+
+def acquire_lease(state_collection, holder, duration, now=None):
+    # True if `holder` holds (or has just taken) the scheduler lease. While
+    # another holder's lease is live the filter does not match, and the
+    # upsert's insert fails on the _id.
+    now = now or datetime.now(timezone.utc)
+    try:
+        state_collection.update_one(
+            {'_id': SCHEDULER_LEASE_ID, '$or': [{'holder': holder}, {'expiresAt': {'$lte': now}}]},
+            {'$set': {'holder': holder, 'expiresAt': now + duration}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+def release_lease(state_collection, holder):
+    state_collection.delete_one({'_id': SCHEDULER_LEASE_ID, 'holder': holder})
+
+
+class RolloverScheduler(threading.Thread):
+    # In-process alternative to running the CLI from cron. Ticks every
+    # `interval` seconds while it holds the scheduler lease, which lasts
+    # `lease_intervals` ticks and is renewed before, during (after every
+    # batch) and after each run.
+
+    def __init__(self, db, interval=60, batch_size=DEFAULT_BATCH_SIZE, pause=0.05, lease_intervals=5):
+        super().__init__(name='rollover-scheduler', daemon=True)
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.lease = timedelta(seconds=interval * lease_intervals)
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._stop_event = threading.Event()
+
+    def renew(self):
+        return acquire_lease(self.db['rollover_state'], self.holder, self.lease)
+
+    def run(self):
+        state_collection = self.db['rollover_state']
+        while not self._stop_event.is_set():
+            try:
+                if self.renew():
+                    run_all(self.db, batch_size=self.batch_size, pause=self.pause, renew=self.renew)
+                    self.renew()
+            except LeaseLost as e:
+                log.warning('rollover lease lost during %s; another worker resumes it', e)
+            except Exception:
+                log.exception('rollover tick failed')
+            self._stop_event.wait(self.interval)
+        try:
+            release_lease(state_collection, self.holder)
+        except Exception:
+            log.exception('releasing the rollover lease failed')
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def main():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description='Reset completedToday and expired streaks')
+    parser.add_argument('--tz', help='only roll over this timezone bucket')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=0.0, help='seconds to sleep between batches')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    load_dotenv()
+    db = MongoClient(os.getenv('MONGO_URI'))['momentum_db']
+
+    if args.tz:
+        run_rollover(db, args.tz, batch_size=args.batch_size, pause=args.pause)
+    else:
+        run_all(db, batch_size=args.batch_size, pause=args.pause)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+# routes.py - the API routes, written once for app.py and asgi.py
+#
+# Every handler is a repository generator (see repository) that takes a Call,
+# the parts of the request it reads, and returns (body, status). app.py runs
+# them on SyncRepository inside Flask views and asgi.py on AsyncRepository
+# inside Quart views; each app builds those views with add_routes(), wrapping
+# them in its own login, admin, response cache, idempotency and cache
+# invalidation decorators as the table asks. Password hashing is yielded as
+# a repository.Offload, so it goes to the pool's blocking or awaitable side.
+#
+# Routes that are mostly response plumbing (the pre-serialized shop catalog,
+# the streamed admin export) stay in each app.
+
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import completion
+import dashboard
+import habit_stats
+import habit_updates
+import history
+import item_usage
+import leaderboard
+import password_pool
+import repository
+import response_encoding
+import shop
+import versions
+from errors import ApiError
+
+
+class Call:
+    # `args` is the query string (a MultiDict), `json` the body or None,
+    # `claims` the access token's claims on login routes, `services` the
+    # app's extensions (passwords, tasks, leaderboard_cache, access_token)
+    __slots__ = ('args', 'json', 'claims', 'services')
+
+    def __init__(self, args, json, claims, services):
+        self.args = args
+        self.json = json
+        self.claims = claims
+        self.services = services
+
+    @property
+    def user(self):
+        return self.claims['sub']
+
+    @property
+    def tz(self):
+        return self.claims.get('tz', 'UTC')
+
+
+class Route:
+    __slots__ = ('rule', 'method', 'handler', 'login', 'admin', 'cached', 'per_timezone', 'idempotent', 'invalidates')
+
+    def __init__(self, rule, method, handler, login=True, admin=False, cached=None, per_timezone=False,
+                 idempotent=False, invalidates=False):
+        self.rule = rule
+        self.method = method
+        self.handler = handler
+        self.login = login
+        self.admin = admin
+        self.cached = cached
+        self.per_timezone = per_timezone
+        self.idempotent = idempotent
+        self.invalidates = invalidates
+
+
+ROUTES = []
+
+
+def route(rule, method, **options):
+    def decorator(handler):
+        ROUTES.append(Route(rule, method, handler, **options))
+        return handler
+    return decorator
+
+
+def add_routes(blueprint, view, login, admin_required, cached, idempotent, invalidates):
+    # `view(route)` turns a handler into the app's view; the decorators are
+    # the app's own, applied in the same order on both
+    for entry in ROUTES:
+        wrapped = view(entry)
+        if entry.invalidates:
+            wrapped = invalidates(wrapped)
+        if entry.idempotent:
+            wrapped = idempotent(wrapped)
+        if entry.cached:
+            wrapped = cached(entry.cached, per_timezone=entry.per_timezone)(wrapped)
+        if entry.admin:
+            wrapped = admin_required(wrapped)
+        if entry.login:
+            wrapped = login(wrapped)
+        blueprint.add_url_rule(entry.rule, entry.handler.__name__, wrapped, methods=[entry.method])
+
+
+class ServerBusy(ApiError):
+    headers = {'Retry-After': '1'}
+
+
+def _passwords(call, method, *args):
+    passwords = call.services['passwords']
+    try:
+        return (yield repository.Offload(
+            getattr(passwords, method), getattr(passwords, f'{method}_async'), *args
+        ))
+    except password_pool.PoolOverloaded:
+        raise ServerBusy('Server busy, please retry', 503)
+
+
+def _completion_options(call):
+    return {
+        'tz_name': call.tz,
+        'history_collection': repository.history,
+        'leaderboard_collection': repository.scores,
+        'outbox_collection': call.services['tasks'].outbox
+    }
+
+
+# Authentication endpoints
+@route('/register', 'POST', login=False)
+def register(call):
+    data = call.json or {}
+    if not data.get('email') or not isinstance(data.get('password'), str) or not data['password']:
+        return {'error': 'Email and password are required'}, 400
+
+    if (yield from repository.find_user(data['email'])):
+        return {'error': 'User already exists'}, 400
+
+    # Day boundaries (daily rollover, streaks) follow the user's timezone
+    user_tz = data.get('timezone') or 'UTC'
+    try:
+        ZoneInfo(user_tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        return {'error': 'Unknown timezone'}, 400
+
+    hashed_password = yield from _passwords(call, 'hash_password', data['password'])
+
+    # Create user with empty habits, starting coins and achievements
+    if not (yield from repository.create_user(data['email'], hashed_password, data.get('name', ''), user_tz)):
+        return {'error': 'User already exists'}, 400
+
+    return {'message': 'User registered successfully'}, 201
+
+
+@route('/login', 'POST', login=False)
+def login(call):
+    data = call.json or {}
+    password = data.get('password')
+    if not isinstance(password, str):
+        return {'error': 'Invalid email or password'}, 401
+
+    user = yield from repository.find_user(data.get('email'))
+    if not user or not (yield from _passwords(call, 'check_password', user['password'], password)):
+        return {'error': 'Invalid email or password'}, 401
+
+    # Move the stored hash to the configured cost factor on the next login
+    if call.services['passwords'].needs_rehash(user['password']):
+        yield from repository.update_password(user, (yield from _passwords(call, 'hash_password', password)))
+
+    # issued by the app (see access_token in app.py and asgi.py)
+    access_token = call.services['access_token'](user['email'], {'tz': user.get('timezone', 'UTC')})
+    return {
+        'access_token': access_token,
+        'user': {
+            'email': user['email'],
+            'name': user.get('name', '')
+        }
+    }, 200
+
+
+# Habits endpoints
+@route('/habits', 'GET', cached='habits')
+def get_habits(call):
+    since = versions.since_arg(call.args.get('since'))
+    fields = response_encoding.fields_arg(call.args.get('fields'))
+    return (yield from repository.get_habits(call.user, since, fields)), 200
+
+
+@route('/habits', 'POST', invalidates=True)
+def create_habit(call):
+    new_habit = habit_updates.new_habit(call.json)
+
+    if (yield from repository.add_habit(call.user, new_habit)):
+        return {'message': 'Habit created successfully', 'habit': new_habit}, 201
+    return {'error': 'Failed to create habit'}, 500
+
+
+@route('/habits/<habit_id>', 'PUT', invalidates=True)
+def update_habit(call, habit_id):
+    updated_habit = yield from habit_updates.update_habit(
+        repository.habits, call.user, habit_id, call.json, leaderboard_collection=repository.scores
+    )
+
+    return {'message': 'Habit updated successfully', 'habit': updated_habit}, 200
+
+
+@route('/habits', 'PATCH', invalidates=True)
+def update_habits(call):
+    data = call.json or {}
+
+    # Body: {"habits": [{"id": ..., "title": ...}, ...]}, applied in one write
+    updated, not_found = yield from habit_updates.update_habits(
+        repository.habits, call.user, data.get('habits'), leaderboard_collection=repository.scores
+    )
+
+    return {'message': 'Habits updated successfully', 'habits': updated, 'notFound': not_found}, 200
+
+
+@route('/achievements', 'GET', cached='achievements')
+def get_achievements(call):
+    since = versions.since_arg(call.args.get('since'))
+    fields = response_encoding.fields_arg(call.args.get('fields'))
+    result = yield from repository.get_achievements(call.user, since)
+    result['achievements'] = response_encoding.select(result['achievements'], fields)
+    return result, 200
+
+
+@route('/achievements/<achievement_id>/claim', 'POST', idempotent=True, invalidates=True)
+def claim_achievement(call, achievement_id):
+    achievement, coins = yield from repository.claim_achievement(call.user, achievement_id)
+
+    return {'achievement': achievement, 'currentCoins': coins}, 200
+
+
+@route('/habits/<habit_id>/complete', 'POST', idempotent=True, invalidates=True)
+def complete_habit(call, habit_id):
+    result = yield from completion.complete_habit(
+        repository.habits, repository.inventory, repository.achievements,
+        call.user, habit_id, **_completion_options(call)
+    )
+    call.services['tasks'].wake()
+
+    return {
+        'message':      'Habit completed successfully',
+        'habit':        result['habit'],
+        'reward':       result['reward'],
+        'currentCoins': result['currentCoins']
+    }, 200
+
+
+@route('/habits/complete', 'POST', idempotent=True, invalidates=True)
+def complete_habits(call):
+    data = call.json or {}
+
+    # Body: {"habitIds": [...]}; results are reported per habit
+    result = yield from completion.complete_habits(
+        repository.habits, repository.inventory, repository.achievements,
+        call.user, data.get('habitIds'), **_completion_options(call)
+    )
+    call.services['tasks'].wake()
+
+    return {'message': 'Habits completed', **result}, 200
+
+
+@route('/habits/<habit_id>/history', 'GET')
+def get_habit_history(call, habit_id):
+    start, end = history.date_range(call.args.get('from'), call.args.get('to'), call.tz)
+
+    dates = yield from history.completion_dates(repository.history, call.user, habit_id, start, end)
+
+    return {
+        'habitId': habit_id,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'dates': [d.isoformat() for d in dates],
+        'count': len(dates)
+    }, 200
+
+
+@route('/habits/<habit_id>', 'DELETE', invalidates=True)
+def delete_habit(call, habit_id):
+    if (yield from repository.delete_habit(call.user, habit_id)):
+        return {'message': 'Habit deleted successfully'}, 200
+    return {'error': 'Habit not found'}, 404
+
+
+# Inventory endpoints
+@route('/inventory', 'GET', cached='inventory')
+def get_inventory(call):
+    since = versions.since_arg(call.args.get('since'))
+    fields = response_encoding.fields_arg(call.args.get('fields'))
+    return (yield from repository.get_inventory(call.user, since, fields)), 200
+
+
+@route('/inventory/purchase', 'POST', idempotent=True, invalidates=True)
+def purchase_item(call):
+    data = call.json or {}
+
+    if not data.get('id'):
+        return {'error': 'id is required'}, 400
+
+    # Price and item details come from the server-side catalog
+    new_item, current_coins = yield from shop.purchase(
+        repository.inventory, call.user, data['id'], leaderboard_collection=repository.scores
+    )
+
+    return {
+        'message': 'Item purchased successfully',
+        'item': new_item,
+        'currentCoins': current_coins
+    }, 200
+
+
+@route('/inventory/use', 'POST', invalidates=True)
+def use_item(call):
+    data = call.json or {}
+
+    if not data.get('itemId'):
+        return {'error': 'Item ID is required'}, 400
+
+    result = yield from item_usage.use_item(
+        repository.inventory, call.user, data['itemId'], leaderboard_collection=repository.scores
+    )
+
+    return result, 200
+
+
+@route('/user/stats', 'GET', cached='stats', per_timezone=True)
+def get_user_stats(call):
+    window = habit_stats.window_arg(call.args.get('window'))
+
+    result = yield from dashboard.load_dashboard(repository.users, call.user, call.tz, include_lists=False)
+    if not result:
+        return {'error': 'User not found'}, 404
+
+    stats = result['stats']
+    if window:
+        # streaks and rates over the last `window` days of history
+        stats['window'] = yield from habit_stats.load_stats(
+            repository.habits, repository.history, call.user, window, call.tz
+        )
+    return stats, 200
+
+
+@route('/dashboard', 'GET', cached='dashboard', per_timezone=True)
+def get_dashboard(call):
+    # Stats, habits, inventory and achievement summary in one aggregation
+    result = yield from dashboard.load_dashboard(repository.users, call.user, call.tz)
+    if not result:
+        return {'error': 'User not found'}, 404
+
+    return result, 200
+
+
+@route('/user/profile', 'GET', cached='profile')
+def get_profile(call):
+    user = yield from repository.get_profile(call.user)
+
+    if not user:
+        return {'error': 'User not found'}, 404
+
+    return user, 200
+
+
+# Leaderboard endpoints
+@route('/leaderboard/<board>', 'GET')
+def get_leaderboard(call, board):
+    page, limit = leaderboard.page_args(call.args)
+    result = yield from leaderboard.top(
+        repository.scores, repository.users, board, page, limit, cache=call.services['leaderboard_cache']
+    )
+
+    return result, 200
+
+
+@route('/leaderboard/<board>/me', 'GET')
+def get_leaderboard_rank(call, board):
+    return (yield from leaderboard.rank(repository.scores, board, call.user)), 200
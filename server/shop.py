@@ -0,0 +1,133 @@
+# shop.py - server-side shop catalog and purchase engine
+#
+# Prices come from the catalog, never from the client. The catalog is
+# loaded once into memory and versioned by a content hash, which doubles as
+# the ETag for GET /shop/catalog. A purchase is one conditional
+# find_one_and_update: it only matches when the user can afford the item
+# and does not own it yet, so concurrent purchases cannot overdraw coins or
+# buy the same item twice.
+#
+# The new item is written field by field at the end of the array instead
+# of $push, so the same update can $currentDate its `v` (a $push and a
+# path inside the array would conflict). That needs the array's length,
+# which the read before the write provides and the write's filter checks
+# ($size); an item added in between makes the write miss, and it is
+# retried with a fresh read. purchase is a repository generator (see
+# repository).
+
+import hashlib
+import json
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+import leaderboard
+import versions
+from errors import ApiError
+from shop_catalog import SHOP_ITEMS
+
+
+class PurchaseError(ApiError):
+    pass
+
+
+class ShopCatalog:
+    def __init__(self, items):
+        self.load(items)
+
+    def load(self, items):
+        body = json.dumps({'items': items}, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        version = hashlib.sha1(body).hexdigest()[:16]
+        by_id = {item['id']: item for item in items}
+        # swap in one assignment so readers never see a half-built catalog
+        self._state = (version, body, by_id)
+
+    @property
+    def version(self):
+        return self._state[0]
+
+    @property
+    def body(self):
+        return self._state[1]
+
+    def get(self, item_id):
+        return self._state[2].get(item_id)
+
+
+catalog = ShopCatalog(SHOP_ITEMS)
+
+
+def new_inventory_item(item):
+    new_item = {
+        'id': item['id'],
+        'name': item['name'],
+        'category': item['category'],
+        'purchasedAt': datetime.utcnow().isoformat(),
+    }
+
+    # Add category-specific properties
+    if item['category'] == 'themes':
+        new_item['themeId'] = item.get('themeId', '')
+        new_item['isActive'] = False
+    elif item['category'] == 'powerups':
+        new_item['usageLimit'] = item.get('usageLimit', 1)
+        new_item['usesLeft'] = item.get('usageLimit', 1)
+    elif item['category'] == 'backgrounds':
+        new_item['isActive'] = False
+    return new_item
+
+
+# attempts when other writes keep changing the inventory's length
+MAX_ATTEMPTS = 5
+
+
+def _refusal(inventory, item_id, price):
+    if not inventory:
+        return PurchaseError('User inventory not found', 404)
+    if any(owned.get('id') == item_id for owned in inventory.get('items') or []):
+        return PurchaseError('Item already owned', 400)
+    if inventory.get('coins', 0) < price:
+        return PurchaseError('Not enough coins', 400)
+    return None
+
+
+def purchase(inventory_collection, user_email, item_id, shop=catalog, leaderboard_collection=None):
+    item = shop.get(item_id)
+    if item is None:
+        raise PurchaseError('Item not found in shop', 404)
+
+    price = item['price']
+    new_item = new_inventory_item(item)
+
+    for _ in range(MAX_ATTEMPTS):
+        current = yield inventory_collection.find_one(
+            {'user_email': user_email},
+            {'_id': False, 'coins': True, 'items.id': True}
+        )
+        refusal = _refusal(current, item_id, price)
+        if refusal is not None:
+            raise refusal
+
+        index = len(current.get('items') or [])
+        inventory = yield inventory_collection.find_one_and_update(
+            {
+                'user_email': user_email,
+                'coins': {'$gte': price},
+                'items': {'$size': index},
+                'items.id': {'$ne': item_id}
+            },
+            versions.stamp({
+                '$set': {f'items.{index}.{key}': value for key, value in new_item.items()},
+                '$inc': {'coins': -price}
+            }, f'items.{index}.v'),
+            projection={'_id': False, 'coins': True, 'version': True},
+            return_document=ReturnDocument.AFTER
+        )
+        if inventory:
+            break
+    else:
+        raise PurchaseError('Inventory is busy, try again', 409)
+
+    if leaderboard_collection is not None:
+        yield from leaderboard.record_coins(leaderboard_collection, user_email, inventory)
+    return new_item, inventory.get('coins', 0)
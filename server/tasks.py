@@ -0,0 +1,356 @@
+# tasks.py - deferred side effects of completions, through a Mongo outbox
+#
+# A completion has to update the habit, the coins and the history before
+# it answers; the achievement counters and the leaderboards can follow a
+# moment later. With TASK_WORKERS > 0 the completion engine only records
+# them as a task in task_outbox, one open document per user:
+#
+#   {_id, user, state: 'pending', completions: [{id, category, streak}],
+#    runAfter, attempts}
+#
+# Later completions by the same user are pushed into that document (a
+# unique index on the user's pending task makes the upsert coalesce), so a
+# burst of completions costs one counter update and one leaderboard
+# refresh. The task is written before the response, so a crash loses
+# nothing: claiming a task moves its runAfter to the end of a lease, and a
+# task whose worker died is claimed again once the lease is over.
+#
+# Workers claim up to TASK_BATCH_SIZE due tasks at a time and process them
+# together:
+#   - each task's completions go through achievement_engine in one counter
+#     update that carries the task id, so a retried task is counted once,
+#     along with the user's perfect run from the history buckets
+#   - the scores of every user in the batch are recomputed in one
+#     leaderboard bulk write (see leaderboard.refresh)
+# A failed task is retried with backoff, up to MAX_ATTEMPTS times, then left
+# in state 'failed' with its completions: it is logged as an error and
+# counted in momentum_background_tasks_total{outcome="failed"} (alert on
+# it), and `python tasks.py --requeue-failed` gives those tasks a fresh
+# set of attempts once the cause is fixed. A task applied only in part is
+# safe to run again (the counter update carries its id). Achievements the
+# counters reached but a task did not get to mark are shown as earned and
+# can be claimed anyway (see repository).
+#
+# Each process runs TASK_WORKERS worker threads (app.py, started by its
+# first request) or asyncio tasks (asgi.py). They wake when a request
+# queues work, wait TASK_DELAY_MS for more of it to coalesce, and otherwise
+# poll every TASK_POLL_MS for tasks left by other processes.
+#
+# CLI, to drain the outbox without a server:
+#   python tasks.py                    # until no task is due
+#   python tasks.py --follow           # keep polling
+#   python tasks.py --requeue-failed   # retry the failed tasks, then drain
+
+import argparse
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import suppress
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+import achievement_engine
+import leaderboard
+import metrics
+import repository
+
+log = logging.getLogger('tasks')
+
+LEASE = timedelta(seconds=60)
+MAX_ATTEMPTS = 5
+# retry n waits RETRY_BACKOFF * 2 ** (n - 1)
+RETRY_BACKOFF = timedelta(seconds=5)
+# a running task is due again when its lease is over
+DUE_STATES = ('pending', 'retry', 'running')
+
+INDEXES = [
+    # the user's one open task, which later completions are pushed into
+    ([('user', ASCENDING)], {'name': 'pending_user', 'unique': True, 'partialFilterExpression': {'state': 'pending'}}),
+    ([('state', ASCENDING), ('runAfter', ASCENDING)], {}),
+]
+
+
+def ensure_indexes(collection):
+    for keys, options in INDEXES:
+        collection.create_index(keys, **options)
+
+
+def completion_entries(habits):
+    # What the achievement counters need of each completed habit
+    return [{'id': h.get('id'), 'category': h.get('category'), 'streak': h.get('streak', 0)} for h in habits]
+
+
+def enqueue(outbox, user_email, habits, now=None):
+    now = now or datetime.now(timezone.utc)
+    query = {'user': user_email, 'state': 'pending'}
+    update = {
+        '$push': {'completions': {'$each': completion_entries(habits)}},
+        '$setOnInsert': {'createdAt': now, 'runAfter': now, 'attempts': 0}
+    }
+    try:
+        yield outbox.update_one(query, update, upsert=True)
+    except DuplicateKeyError:
+        # a concurrent completion opened the task first: join it
+        yield outbox.update_one(query, update, upsert=True)
+
+
+def claim(outbox, limit, now=None):
+    # Up to `limit` due tasks, leased to the caller under one claim token
+    now = now or datetime.now(timezone.utc)
+    due = {'state': {'$in': DUE_STATES}, 'runAfter': {'$lte': now}}
+    docs = yield outbox.find(due, {'_id': True}, sort=[('runAfter', ASCENDING)], limit=limit)
+    if not docs:
+        return []
+
+    ids = [doc['_id'] for doc in docs]
+    token = uuid.uuid4().hex
+    # tasks another worker claimed in between no longer match `due`
+    yield outbox.update_many(
+        dict(due, _id={'$in': ids}),
+        {'$set': {'state': 'running', 'claim': token, 'runAfter': now + LEASE}, '$inc': {'attempts': 1}}
+    )
+    return (yield outbox.find({'_id': {'$in': ids}, 'claim': token}))
+
+
+def process(outbox, tasks, now=None):
+    # Applies claimed tasks; returns the emails of the users whose data
+    # changed
+    now = now or datetime.now(timezone.utc)
+    done, failed = [], []
+    for task in tasks:
+        try:
+            yield from achievement_engine.record_completions(
+                repository.achievements, task['user'], task.get('completions', []),
+                repository.habits, task_id=task['_id'], history_collection=repository.history
+            )
+        except Exception as e:
+            log.exception('task %s for %s failed', task['_id'], task['user'])
+            failed.append((task, e))
+        else:
+            done.append(task)
+
+    users = {task['user'] for task in done}
+    try:
+        yield from leaderboard.refresh(
+            repository.scores, repository.habits, repository.inventory, repository.achievements, users
+        )
+    except Exception as e:
+        # the counter updates are not repeated when these are retried
+        log.exception('leaderboard refresh of %d users failed', len(users))
+        failed += [(task, e) for task in done]
+        done, users = [], set()
+
+    if done:
+        yield outbox.delete_many({
+            '_id': {'$in': [task['_id'] for task in done]},
+            'claim': {'$in': list({task['claim'] for task in done})}
+        })
+        metrics.background_tasks.inc(('done',), len(done))
+    for task, error in failed:
+        attempts = task.get('attempts', 1)
+        state = 'failed' if attempts >= MAX_ATTEMPTS else 'retry'
+        yield outbox.update_one(
+            {'_id': task['_id'], 'claim': task['claim']},
+            {'$set': {'state': state, 'runAfter': now + RETRY_BACKOFF * 2 ** (attempts - 1), 'error': repr(error)}}
+        )
+        metrics.background_tasks.inc((state,))
+        if state == 'failed':
+            log.error('task %s for %s failed %d times, left for --requeue-failed', task['_id'], task['user'], attempts)
+    return users
+
+
+def requeue_failed(outbox, now=None):
+    # Failed tasks become due again with a fresh set of attempts; returns
+    # how many
+    now = now or datetime.now(timezone.utc)
+    result = yield outbox.update_many(
+        {'state': 'failed'},
+        {'$set': {'state': 'retry', 'runAfter': now, 'attempts': 0}, '$unset': {'claim': ''}}
+    )
+    return result.modified_count
+
+
+def run_batch(limit, now=None):
+    # One round: (tasks claimed, users changed)
+    tasks = yield from claim(repository.outbox, limit, now)
+    users = yield from process(repository.outbox, tasks, now)
+    return len(tasks), users
+
+
+class TaskQueue:
+    # The per-process side: wakes the workers and runs them as threads or
+    # asyncio tasks
+    def __init__(self, workers=2, batch_size=100, delay=0.25, poll=5.0, on_done=None):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.delay = delay
+        self.poll = poll
+        # called with the emails of users whose data a batch changed
+        self.on_done = on_done
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pid = None
+        self._async_wake = None
+        self._async_workers = None
+
+    @classmethod
+    def from_settings(cls, settings, on_done=None):
+        return cls(
+            workers=int(settings.get('TASK_WORKERS', 2) or 0),
+            batch_size=int(settings.get('TASK_BATCH_SIZE', 100)),
+            delay=int(settings.get('TASK_DELAY_MS', 250)) / 1000,
+            poll=int(settings.get('TASK_POLL_MS', 5000)) / 1000,
+            on_done=on_done
+        )
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    @property
+    def outbox(self):
+        # where the completion engine records tasks; None has it do the
+        # work inline
+        return repository.outbox if self.enabled else None
+
+    def wake(self):
+        if not self.enabled:
+            return
+        self._wake.set()
+        if self._async_wake is not None:
+            self._async_wake.set()
+
+    def _finished(self, users):
+        if users and self.on_done is not None:
+            self.on_done(users)
+
+    # Threads (app.py)
+
+    def start(self, repo):
+        # Once per process; a forked child starts its own
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            for n in range(self.workers):
+                threading.Thread(target=self._run, args=(repo,), name=f'tasks-{n}', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._pid = None
+
+    def _run(self, repo):
+        while not self._stop.is_set():
+            if self._wake.wait(self.poll):
+                self._wake.clear()
+                self._stop.wait(self.delay)
+            try:
+                while not self._stop.is_set():
+                    claimed, users = repo.run(run_batch(self.batch_size))
+                    self._finished(users)
+                    if claimed < self.batch_size:
+                        break
+            except Exception:
+                log.exception('task batch failed')
+
+    # asyncio tasks (asgi.py)
+
+    def start_async(self, repo):
+        # Call from the serving event loop
+        if not self.enabled or self._async_workers is not None:
+            return
+        self._async_wake = asyncio.Event()
+        self._async_workers = [asyncio.create_task(self._run_async(repo)) for _ in range(self.workers)]
+
+    async def stop_async(self):
+        workers, self._async_workers = self._async_workers or [], None
+        for worker in workers:
+            worker.cancel()
+        for worker in workers:
+            with suppress(asyncio.CancelledError):
+                await worker
+        self._async_wake = None
+
+    async def _run_async(self, repo):
+        while True:
+            try:
+                await asyncio.wait_for(self._async_wake.wait(), self.poll)
+                self._async_wake.clear()
+                await asyncio.sleep(self.delay)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                while True:
+                    claimed, users = await repo.run(run_batch(self.batch_size))
+                    self._finished(users)
+                    if claimed < self.batch_size:
+                        break
+            except Exception:
+                log.exception('task batch failed')
+
+
+def _invalidator(app):
+    # Cached responses of the users a batch changed are dropped
+    def invalidate(users):
+        cache = app.extensions['response_cache']
+        for user_email in users:
+            cache.invalidate(user_email)
+    return invalidate
+
+
+def init_app(app):
+    # Flask: worker threads start with the first request of each process
+    app.extensions['tasks'] = TaskQueue.from_settings(app.config, on_done=_invalidator(app))
+
+    @app.before_request
+    def _start_workers():
+        app.extensions['tasks'].start(app.extensions['repo'])
+
+
+def init_quart_app(app):
+    # Same for the ASGI app; start_async / stop_async are called when the
+    # worker's Mongo client is opened and before it is closed
+    app.extensions['tasks'] = TaskQueue.from_settings(app.config, on_done=_invalidator(app))
+
+
+def main():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description='Process queued background tasks')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--follow', action='store_true', help='keep polling for new tasks')
+    parser.add_argument('--poll', type=float, default=5.0, help='seconds between polls with --follow')
+    parser.add_argument('--requeue-failed', action='store_true', help='retry tasks that ran out of attempts')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    load_dotenv()
+    repo = repository.SyncRepository(MongoClient(os.getenv('MONGO_URI'))['momentum_db'])
+
+    if args.requeue_failed:
+        print(f'{repo.run(requeue_failed(repository.outbox))} failed tasks requeued')
+
+    processed = 0
+    while True:
+        claimed, _ = repo.run(run_batch(args.batch_size))
+        processed += claimed
+        if claimed < args.batch_size:
+            if not args.follow:
+                break
+            time.sleep(args.poll)
+    print(f'{processed} tasks processed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# conftest.py - shared fixtures for the server tests
+#
+#   pip install pytest mongomock
+#   cd server && python -m pytest -q
+#
+# `db` is a fresh, migrated database per test: on MONGO_TEST_URI if set,
+# else on a disposable mongod from PATH (see benchmarks.seed.LocalMongod),
+# else on mongomock with the few missing server features filled in (see
+# mongomock_ext). `client` is a Flask test client of create_app() on that
+# database, and `login(client, email)` registers a user and returns the
+# Authorization header.
+
+import os
+import shutil
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import migrations  # noqa: E402
+import repository  # noqa: E402
+
+TEST_SETTINGS = {
+    'JWT_SECRET_KEY': 'test-secret',
+    'RESPONSE_CACHE': 'local',
+    'ADMISSION_RATE': 0,
+    'ADMISSION_MAX_IN_FLIGHT': 0,
+    # completions apply their side effects inline unless a test asks
+    'TASK_WORKERS': 0,
+}
+PASSWORD = 'test-password'
+
+
+@pytest.fixture(scope='session')
+def mongo_client():
+    from pymongo import MongoClient
+
+    uri = os.getenv('MONGO_TEST_URI')
+    if uri:
+        client = MongoClient(uri)
+        yield client
+        client.close()
+        return
+    if shutil.which('mongod') is not None:
+        from benchmarks.seed import LocalMongod
+
+        with LocalMongod() as uri:
+            client = MongoClient(uri)
+            yield client
+            client.close()
+        return
+
+    mongomock = pytest.importorskip('mongomock')
+    import mongomock_ext
+
+    mongomock_ext.install()
+    yield mongomock.MongoClient()
+
+
+@pytest.fixture
+def db(mongo_client):
+    name = f'momentum_test_{uuid.uuid4().hex[:8]}'
+    database = mongo_client[name]
+    migrations.migrate(database)
+    yield database
+    mongo_client.drop_database(name)
+
+
+@pytest.fixture
+def repo(db):
+    return repository.SyncRepository(db)
+
+
+@pytest.fixture
+def settings():
+    # tests may change these before asking for `app`
+    return dict(TEST_SETTINGS)
+
+
+@pytest.fixture
+def app(db, settings, monkeypatch):
+    import app as app_module
+
+    # the cheapest cost bcrypt accepts
+    monkeypatch.setenv('BCRYPT_LOG_ROUNDS', '4')
+    flask_app = app_module.create_app(settings)
+    flask_app.extensions['mongo'] = db
+    flask_app.extensions['repo'] = repository.SyncRepository(db)
+    flask_app.testing = True
+    yield flask_app
+    flask_app.extensions['tasks'].stop()
+    flask_app.extensions['passwords'].shutdown()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login():
+    def login(client, email='a@example.com', timezone='UTC'):
+        client.post('/register', json={'email': email, 'password': PASSWORD, 'name': 'A', 'timezone': timezone})
+        response = client.post('/login', json={'email': email, 'password': PASSWORD})
+        assert response.status_code == 200, response.get_json()
+        return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+    return login
@@ -0,0 +1,218 @@
+# mongomock_ext.py - the few server features mongomock lacks, for the tests
+#
+# Used only when no real mongod is available (see conftest). mongomock
+# 4.x does not implement:
+#   - arrayFilters: updates naming `$[ident]` are rewritten to the
+#     concrete array indexes the filters select in the matched document,
+#     then applied by mongomock
+#   - $bit: applied as a $set of the computed value
+#   - ordering of BSON timestamps (the versions of versions.py)
+#   - appending by index: a path `array.<len>.field` starts a new element
+# and find_one_and_update / bulk_write are reimplemented on top of the
+# single-document updates, around two mongomock bugs (see below).
+# Everything else is mongomock's own behaviour.
+
+import copy
+import re
+
+from bson.timestamp import Timestamp
+from mongomock import filtering
+from mongomock.collection import Collection
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import BulkWriteResult, UpdateResult
+
+IDENT = re.compile(r'\$\[(\w+)\]')
+# after dates, as in the server's type ordering
+TIMESTAMP_TYPE = 47
+
+
+def _element_filters(array_filters):
+    # {ident: filter on one element}, from [{'h.id': 1, 'h.v': ...}, {'$or': [...]}]
+    filters = {}
+    for array_filter in array_filters or ():
+        idents = {key.split('.')[0] for clause in array_filter.get('$or', [array_filter]) for key in clause}
+        ident = idents.pop()
+
+        def strip(clause):
+            return {key[len(ident) + 1:]: value for key, value in clause.items()}
+        if '$or' in array_filter:
+            filters[ident] = {'$or': [strip(clause) for clause in array_filter['$or']]}
+        else:
+            filters[ident] = strip(array_filter)
+    return filters
+
+
+def _paths(node, parts, filters, prefix=()):
+    # Concrete dotted paths for `parts` within `node`
+    if not parts:
+        yield '.'.join(prefix)
+        return
+    head, rest = parts[0], parts[1:]
+    match = IDENT.fullmatch(head)
+    if match is None:
+        child = node.get(head) if isinstance(node, dict) else None
+        yield from _paths(child, rest, filters, prefix + (head,))
+        return
+    for index, element in enumerate(node if isinstance(node, list) else ()):
+        if filtering.filter_applies(filters[match.group(1)], element if isinstance(element, dict) else {}):
+            yield from _paths(element, rest, filters, prefix + (str(index),))
+
+
+def _value(doc, path):
+    for part in path.split('.'):
+        if isinstance(doc, list):
+            doc = doc[int(part)] if int(part) < len(doc) else None
+        else:
+            doc = (doc or {}).get(part)
+    return doc
+
+
+def _concrete(doc, update, array_filters):
+    filters = _element_filters(array_filters)
+    concrete = {}
+    for op, fields in update.items():
+        for path, value in fields.items():
+            for target in _paths(doc, path.split('.'), filters):
+                if op == '$bit':
+                    current = _value(doc, target) or 0
+                    for kind, operand in value.items():
+                        current = {'and': current & operand, 'or': current | operand, 'xor': current ^ operand}[kind]
+                    concrete.setdefault('$set', {})[target] = current
+                else:
+                    concrete.setdefault(op, {})[target] = value
+    return concrete
+
+
+def _without_insert_fields(update):
+    return {op: fields for op, fields in update.items() if op != '$setOnInsert'}
+
+
+def _appended(doc, update):
+    # Arrays that an update extends by naming the index one past their end
+    arrays = set()
+    for fields in update.values():
+        for path in fields:
+            node, parts = doc, path.split('.')
+            for n, part in enumerate(parts):
+                if isinstance(node, list) and part.isdigit():
+                    if int(part) == len(node):
+                        arrays.add('.'.join(parts[:n]))
+                        break
+                    node = node[int(part)] if int(part) < len(node) else None
+                elif isinstance(node, dict):
+                    node = node.get(part)
+                else:
+                    break
+    return arrays
+
+
+def _needs_help(update, array_filters):
+    return bool(array_filters) or (isinstance(update, dict) and '$bit' in update)
+
+
+_update_one = Collection.update_one
+_update_many = Collection.update_many
+_find_one_and_update = Collection.find_one_and_update
+
+
+def _apply(collection, query, doc, update, array_filters):
+    concrete = _concrete(doc, update, array_filters)
+    if concrete:
+        _update_one(collection, dict(query, _id=doc['_id']), concrete)
+
+
+def update_one(self, filter, update, upsert=False, array_filters=None, **kwargs):
+    if not _needs_help(update, array_filters):
+        return _update_one(self, filter, update, upsert=upsert, **kwargs)
+    doc = self.find_one(filter)
+    if doc is None:
+        if not upsert:
+            return UpdateResult({'n': 0, 'nModified': 0}, True)
+        # inserted from the equality fields of the filter, then updated
+        seed = {key: value for key, value in filter.items() if not key.startswith('$') and not isinstance(value, dict)}
+        seed.update(update.get('$setOnInsert', {}))
+        upserted = self.insert_one(seed).inserted_id
+        _apply(self, filter, self.find_one({'_id': upserted}), _without_insert_fields(update), array_filters)
+        return UpdateResult({'n': 1, 'nModified': 0, 'upserted': upserted}, True)
+    _apply(self, filter, doc, update, array_filters)
+    return UpdateResult({'n': 1, 'nModified': 1}, True)
+
+
+def update_many(self, filter, update, upsert=False, array_filters=None, **kwargs):
+    if not _needs_help(update, array_filters):
+        return _update_many(self, filter, update, upsert=upsert, **kwargs)
+    docs = list(self.find(filter))
+    for doc in docs:
+        _apply(self, filter, doc, update, array_filters)
+    return UpdateResult({'n': len(docs), 'nModified': len(docs)}, True)
+
+
+def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                        return_document=ReturnDocument.BEFORE, array_filters=None, **kwargs):
+    # mongomock reads the updated document back with `filter`, which misses
+    # once the update changed a field the filter tested
+    doc = self.find_one(filter, sort=sort)
+    if doc is None:
+        if not upsert:
+            return None
+        return _find_one_and_update(self, filter, update, projection=projection, sort=sort, upsert=upsert,
+                                    return_document=return_document, **kwargs)
+    before = self.find_one({'_id': doc['_id']}, projection)
+    for array in _appended(doc, update):
+        _update_one(self, {'_id': doc['_id']}, {'$push': {array: {}}})
+    if _needs_help(update, array_filters):
+        _apply(self, filter, doc, update, array_filters)
+    else:
+        _update_one(self, {'_id': doc['_id']}, update)
+    if return_document == ReturnDocument.AFTER:
+        return self.find_one({'_id': doc['_id']}, projection)
+    return before
+
+
+def bulk_write(self, requests, ordered=True, **kwargs):
+    # One request at a time (mongomock's own bulk API predates the current
+    # pymongo operation classes), counted like the server would
+    counts = {'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []}
+    errors = []
+    for index, request in enumerate(requests):
+        try:
+            if isinstance(request, InsertOne):
+                self.insert_one(copy.deepcopy(request._doc))
+                counts['nInserted'] += 1
+            elif isinstance(request, (DeleteOne, DeleteMany)):
+                method = self.delete_one if isinstance(request, DeleteOne) else self.delete_many
+                counts['nRemoved'] += method(request._filter).deleted_count
+            else:
+                if isinstance(request, ReplaceOne):
+                    result = self.replace_one(request._filter, copy.deepcopy(request._doc), upsert=request._upsert)
+                else:
+                    method = update_one if isinstance(request, UpdateOne) else update_many
+                    result = method(self, request._filter, copy.deepcopy(request._doc),
+                                    upsert=request._upsert, array_filters=request._array_filters)
+                counts['nMatched'] += result.matched_count
+                counts['nModified'] += result.modified_count
+                if result.upserted_id is not None:
+                    counts['nUpserted'] += 1
+                    counts['upserted'].append({'index': index, '_id': result.upserted_id})
+        except DuplicateKeyError as e:
+            errors.append({'index': index, 'code': 11000, 'errmsg': str(e)})
+            if ordered:
+                break
+    if errors:
+        raise BulkWriteError(dict(counts, writeErrors=errors, writeConcernErrors=[]))
+    return BulkWriteResult(counts, True)
+
+
+def _compare_type(value, _original=filtering._get_compare_type):
+    if isinstance(value, Timestamp):
+        return TIMESTAMP_TYPE
+    return _original(value)
+
+
+def install():
+    Collection.update_one = update_one
+    Collection.update_many = update_many
+    Collection.find_one_and_update = find_one_and_update
+    Collection.bulk_write = bulk_write
+    filtering._get_compare_type = _compare_type
@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import achievement_engine
+import history
+import repository
+
+CATALOG = [
+    {'id': 'first', 'category': 'habits', 'total': 1},
+    {'id': 'fifty', 'category': 'habits', 'total': 50},
+    {'id': 'fifty-b', 'category': 'habits', 'total': 50},
+    {'id': 'week', 'category': 'streaks', 'total': 7},
+    {'id': 'fit', 'category': 'fitness', 'total': 10},
+]
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    monkeypatch.setattr(achievement_engine, 'catalog', achievement_engine.AchievementCatalog(CATALOG))
+
+
+def test_counter_key():
+    assert achievement_engine.counter_key('habits') == 'totalCompletions'
+    assert achievement_engine.counter_key('streaks') == 'longestStreak'
+    assert achievement_engine.counter_key('fitness') == 'categories.fitness'
+
+
+def test_safe_category():
+    assert achievement_engine.safe_category('fitness')
+    for category in ('', None, 'a.b', '$set', 3):
+        assert not achievement_engine.safe_category(category)
+
+
+def test_crossed(catalog):
+    assert achievement_engine.crossed('totalCompletions', 0, 1) == ['first']
+    # the upper bound is inclusive, the lower one is not
+    assert achievement_engine.crossed('totalCompletions', 1, 50) == ['fifty', 'fifty-b']
+    assert achievement_engine.crossed('totalCompletions', 50, 80) == []
+    assert achievement_engine.crossed('totalCompletions', 0, 100) == ['first', 'fifty', 'fifty-b']
+    assert achievement_engine.crossed('longestStreak', 6, 6) == []
+    assert achievement_engine.crossed('categories.fitness', 9, 10) == ['fit']
+    assert achievement_engine.crossed('categories.reading', 0, 100) == []
+
+
+def test_counter_value():
+    counters = {'totalCompletions': 4, 'categories': {'fitness': 2}}
+    assert achievement_engine.counter_value(counters, 'totalCompletions') == 4
+    assert achievement_engine.counter_value(counters, 'categories.fitness') == 2
+    assert achievement_engine.counter_value(counters, 'categories.reading') == 0
+    assert achievement_engine.counter_value(counters, 'longestStreak') == 0
+    assert achievement_engine.counter_value(None, 'totalCompletions') == 0
+
+
+def test_counters_from_habits():
+    habits = [
+        {'totalCompletions': 3, 'streak': 2, 'category': 'fitness'},
+        {'totalCompletions': 5, 'streak': 7, 'category': 'fitness'},
+        {'totalCompletions': 1, 'streak': 1, 'category': 'bad.name'},
+        {},
+    ]
+    assert achievement_engine.counters_from_habits(habits) == {
+        'totalCompletions': 9, 'longestStreak': 7, 'categories': {'fitness': 8}
+    }
+
+
+def test_reached_and_progress(catalog):
+    counters = {'totalCompletions': 50, 'longestStreak': 3, 'categories': {'fitness': 12}}
+    assert sorted(achievement_engine.reached(counters)) == ['fifty', 'fifty-b', 'first', 'fit']
+    week = achievement_engine.catalog.get('week')
+    assert achievement_engine.progress_for(week, counters) == 3
+    # progress never exceeds the total
+    assert achievement_engine.progress_for(achievement_engine.catalog.get('fit'), counters) == 10
+
+
+def test_record_completions(db, catalog):
+    repo = repository.SyncRepository(db)
+    db.user_achievements.insert_one({
+        'user_email': 'a@b', 'earned': {},
+        'counters': {'totalCompletions': 49, 'longestStreak': 6, 'categories': {'fitness': 9}}
+    })
+    habits = [{'id': 'h1', 'category': 'fitness', 'streak': 7}, {'id': 'h2', 'category': 'reading', 'streak': 1}]
+
+    earned = repo.run(achievement_engine.record_completions(repository.achievements, 'a@b', habits, task_id='t1'))
+    assert sorted(earned) == ['fifty', 'fifty-b', 'fit', 'week']
+
+    doc = db.user_achievements.find_one({'user_email': 'a@b'})
+    assert doc['counters'] == {
+        'totalCompletions': 51, 'longestStreak': 7, 'categories': {'fitness': 10, 'reading': 1}
+    }
+    assert set(doc['earned']) == {'fifty', 'fifty-b', 'fit', 'week'}
+
+    # the same task again changes nothing
+    assert repo.run(achievement_engine.record_completions(repository.achievements, 'a@b', habits, task_id='t1')) == []
+    assert db.user_achievements.find_one({'user_email': 'a@b'})['counters']['totalCompletions'] == 51
+
+
+PERFECT_CATALOG = CATALOG + [{'id': 'perfect', 'category': 'streaks', 'total': 7, 'counter': 'longestPerfectRun'}]
+
+
+@pytest.fixture
+def perfect_catalog(monkeypatch):
+    monkeypatch.setattr(achievement_engine, 'catalog', achievement_engine.AchievementCatalog(PERFECT_CATALOG))
+
+
+def test_counter_override(perfect_catalog):
+    perfect = achievement_engine.catalog.get('perfect')
+    assert achievement_engine.achievement_counter(perfect) == 'longestPerfectRun'
+    assert achievement_engine.crossed('longestPerfectRun', 6, 7) == ['perfect']
+    assert achievement_engine.crossed('longestStreak', 6, 7) == ['week']
+    assert achievement_engine.perfect_run_window() == 8
+    # internal only
+    assert 'counter' not in achievement_engine.user_achievements({}, {})[-1]
+
+
+def seed_history(db, repo, days_done):
+    # habits created two weeks ago, completed `days_done[habit id]` days ago
+    now = datetime.now(timezone.utc)
+    created = (now - timedelta(days=14)).replace(tzinfo=None).isoformat()
+    db.user_habits.insert_one({'user_email': 'a@b', 'timezone': 'UTC', 'habits': [
+        {'id': habit_id, 'createdAt': created} for habit_id in days_done
+    ]})
+    db.user_achievements.insert_one({
+        'user_email': 'a@b', 'earned': {},
+        'counters': {'totalCompletions': 0, 'longestStreak': 0, 'categories': {}}
+    })
+    for habit_id, days_ago in days_done.items():
+        for n in days_ago:
+            repo.run(history.record(repository.history, 'a@b', habit_id, now - timedelta(days=n), 'UTC'))
+
+
+def record(repo, streak):
+    return repo.run(achievement_engine.record_completions(
+        repository.achievements, 'a@b', [{'id': 'h1', 'category': 'fitness', 'streak': streak}],
+        repository.habits, task_id='t1', history_collection=repository.history
+    ))
+
+
+def test_perfect_week_from_history(db, repo, perfect_catalog):
+    seed_history(db, repo, {'h1': range(1, 9), 'h2': range(1, 8)})
+    # a run of 7 days on which both habits were done, ending yesterday
+    assert sorted(record(repo, 7)) == ['first', 'perfect', 'week']
+    assert db.user_achievements.find_one()['counters']['longestPerfectRun'] == 7
+
+
+def test_perfect_week_needs_every_habit(db, repo, perfect_catalog):
+    # h1 alone has a 7-day streak, but h2 was skipped three days ago
+    seed_history(db, repo, {'h1': range(7), 'h2': [0, 1, 2, 4, 5, 6]})
+    assert sorted(record(repo, 7)) == ['first', 'week']
+    assert db.user_achievements.find_one()['counters']['longestPerfectRun'] == 3
+
+
+def test_rebuild_counters_keeps_the_perfect_run(db, repo):
+    db.user_achievements.insert_one({'user_email': 'a@b', 'earned': {}, 'counters': {'longestPerfectRun': 4}})
+    counters = repo.run(achievement_engine.rebuild_counters(
+        repository.achievements, 'a@b', [{'totalCompletions': 2, 'streak': 2, 'category': 'fitness'}]
+    ))
+    assert counters == {'totalCompletions': 2, 'longestStreak': 2, 'categories': {'fitness': 2}, 'longestPerfectRun': 4}
@@ -0,0 +1,63 @@
+import pytest
+
+import admission
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_burst_then_wait(clock):
+    buckets = admission.TokenBuckets(rate=2, burst=3, clock=clock)
+    assert [buckets.take('a', 1) for _ in range(3)] == [0, 0, 0]
+    # empty: one token comes back every half second
+    assert buckets.take('a', 1) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert buckets.take('a', 1) == 0
+
+
+def test_refill_is_capped_at_burst(clock):
+    buckets = admission.TokenBuckets(rate=10, burst=2, clock=clock)
+    buckets.take('a', 2)
+    clock.now += 60
+    assert buckets.take('a', 2) == 0
+    assert buckets.take('a', 1) == pytest.approx(0.1)
+
+
+def test_cost_above_burst_is_capped(clock):
+    buckets = admission.TokenBuckets(rate=1, burst=5, clock=clock)
+    assert buckets.take('a', 50) == 0
+    assert buckets.take('a', 50) == pytest.approx(5)
+
+
+def test_clients_are_separate(clock):
+    buckets = admission.TokenBuckets(rate=1, burst=1, clock=clock)
+    assert buckets.take('a', 1) == 0
+    assert buckets.take('b', 1) == 0
+    assert buckets.take('a', 1) > 0
+
+
+def test_least_recently_used_client_is_forgotten(clock):
+    buckets = admission.TokenBuckets(rate=1, burst=1, max_keys=2, clock=clock)
+    buckets.take('a', 1)
+    buckets.take('b', 1)
+    buckets.take('c', 1)
+    # 'a' was evicted and starts again with a full bucket; 'c' was not
+    assert buckets.take('a', 1) == 0
+    assert buckets.take('c', 1) > 0
+
+
+def test_parse_costs():
+    assert admission.parse_costs('POST  /login=10, GET /dashboard=2.5') == {
+        'POST /login': 10.0, 'GET /dashboard': 2.5
+    }
+    assert admission.parse_costs(None) == {}
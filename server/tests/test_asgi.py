@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+import repository
+from conftest import PASSWORD
+
+pytest.importorskip('quart')
+
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    async def to_list(self, length):
+        return list(self.cursor)
+
+
+class AsyncCollection:
+    # the few AsyncMongoClient calls AsyncRepository makes, over a blocking
+    # collection
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    async def aggregate(self, *args, **kwargs):
+        return AsyncCursor(self.collection.aggregate(*args, **kwargs))
+
+    def __getattr__(self, method):
+        blocking = getattr(self.collection, method)
+
+        async def call(*args, **kwargs):
+            return blocking(*args, **kwargs)
+        return call
+
+
+class AsyncDatabase:
+    def __init__(self, db):
+        self.db = db
+
+    def __getitem__(self, name):
+        return AsyncCollection(self.db[name])
+
+
+@pytest.fixture
+def quart_app(db, settings, monkeypatch):
+    import asgi
+
+    monkeypatch.setenv('BCRYPT_LOG_ROUNDS', '4')
+    quart_app = asgi.create_app(settings)
+    quart_app.extensions['repo'] = repository.AsyncRepository(AsyncDatabase(db))
+    yield quart_app
+    quart_app.extensions['passwords'].shutdown()
+
+
+def request(quart_app, method, path, **kwargs):
+    async def send():
+        response = await quart_app.test_client().open(path, method=method, **kwargs)
+        return response.status_code, await response.get_json(), response.headers
+    return asyncio.run(send())
+
+
+def quart_login(quart_app, email='a@example.com'):
+    request(quart_app, 'POST', '/register', json={'email': email, 'password': PASSWORD, 'timezone': 'UTC'})
+    status, body, _ = request(quart_app, 'POST', '/login', json={'email': email, 'password': PASSWORD})
+    assert status == 200, body
+    return {'Authorization': f"Bearer {body['access_token']}"}
+
+
+def test_routes_match_the_flask_app(app, quart_app):
+    flask_rules = {(r.rule, m) for r in app.url_map.iter_rules() for m in r.methods - {'HEAD', 'OPTIONS'}}
+    quart_rules = {(r.rule, m) for r in quart_app.url_map.iter_rules() for m in r.methods - {'HEAD', 'OPTIONS'}}
+    assert flask_rules == quart_rules
+
+
+def test_complete_habit(quart_app):
+    auth = quart_login(quart_app)
+    status, body, _ = request(quart_app, 'POST', '/habits', headers=auth,
+                              json={'title': 'Run', 'frequency': 'daily', 'category': 'fitness'})
+    assert status == 201, body
+
+    status, body, _ = request(quart_app, 'POST', f"/habits/{body['habit']['id']}/complete", headers=auth)
+    assert status == 200, body
+    assert body['habit']['streak'] == 1
+    assert body['currentCoins'] == 100 + body['reward']
+
+    status, body, _ = request(quart_app, 'GET', '/habits', headers=auth)
+    assert [h['totalCompletions'] for h in body['habits']] == [1]
+
+
+def test_tokens_are_interchangeable(client, login, quart_app):
+    flask_auth = login(client)
+    status, body, _ = request(quart_app, 'GET', '/inventory', headers=flask_auth)
+    assert status == 200, body
+    assert body['coins'] == 100
+
+    quart_auth = quart_login(quart_app, 'b@example.com')
+    response = client.get('/user/profile', headers=quart_auth)
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['email'] == 'b@example.com'
+
+
+@pytest.mark.parametrize('header, status', [
+    (None, 401), ('Token abc', 422), ('Bearer not-a-token', 422)
+])
+def test_requires_login(quart_app, header, status):
+    headers = {'Authorization': header} if header else {}
+    assert request(quart_app, 'GET', '/habits', headers=headers)[0] == status
+
+
+def test_api_errors(quart_app):
+    auth = quart_login(quart_app)
+    status, body, _ = request(quart_app, 'POST', '/inventory/purchase', headers=auth, json={'id': 'no-such-item'})
+    assert status == 404
+    assert 'error' in body
@@ -0,0 +1,121 @@
+from datetime import datetime, timezone
+
+import pytest
+from bson.timestamp import Timestamp
+
+import completion
+import repository
+
+NOW = datetime(2024, 3, 10, 15, 0, tzinfo=timezone.utc)
+YESTERDAY = '2024-03-09T18:00:00+00:00'
+LAST_WEEK = '2024-03-03T18:00:00+00:00'
+
+
+def habit(habit_id, last=None, streak=0, **fields):
+    return dict({'id': habit_id, 'streak': streak, 'totalCompletions': streak, 'lastCompletedAt': last,
+                 'completedToday': False, 'coinReward': 10, 'category': 'fitness'}, **fields)
+
+
+def test_streak_bonus():
+    assert [completion.streak_bonus(s) for s in (1, 4, 5, 10, 29, 30)] == [0, 0, 5, 10, 10, 20]
+
+
+def test_completion_update():
+    update, array_filters = completion._completion_update('h1', NOW, 'UTC')
+    assert update['$set']['habits.$[h].lastCompletedAt'] == NOW.isoformat()
+    assert update['$set']['habits.$[fresh].streak'] == 1
+    assert update['$inc'] == {'habits.$[h].totalCompletions': 1, 'habits.$[cont].streak': 1}
+    assert 'habits.$[h].v' in update['$currentDate']
+
+    yesterday = {'$gte': '2024-03-09T00:00:00+00:00', '$lt': '2024-03-10T00:00:00+00:00'}
+    assert array_filters == [
+        {'h.id': 'h1'},
+        {'cont.id': 'h1', 'cont.lastCompletedAt': yesterday},
+        {'fresh.id': 'h1', 'fresh.lastCompletedAt': {'$not': yesterday}},
+    ]
+
+
+def test_completion_update_uses_the_users_day():
+    # 15:00 UTC is already the 11th in Tokyo
+    _, array_filters = completion._completion_update('h1', NOW, 'Asia/Tokyo')
+    assert array_filters[1]['cont.lastCompletedAt'] == {
+        '$gte': '2024-03-09T15:00:00+00:00', '$lt': '2024-03-10T15:00:00+00:00'
+    }
+
+
+@pytest.mark.parametrize('habit_ids, message', [
+    ([], 'habitIds must be a non-empty list'),
+    ('h1', 'habitIds must be a non-empty list'),
+    (['h1', 2], 'habitIds must be strings'),
+    (['h1', 'h1'], 'Habit h1 listed more than once'),
+    ([f'h{n}' for n in range(completion.MAX_BATCH + 1)], f'At most {completion.MAX_BATCH} habits per request'),
+])
+def test_validate_ids_rejects(habit_ids, message):
+    with pytest.raises(completion.CompletionError) as info:
+        completion._validate_ids(habit_ids)
+    assert info.value.message == message
+    assert info.value.status == 400
+
+
+def test_validate_ids():
+    completion._validate_ids(['h1', 'h2'])
+
+
+# arrayFilters, against mongod
+
+def seed(db, habits):
+    db.user_habits.insert_one({'user_email': 'a@b', 'habits': habits})
+    db.user_inventory.insert_one({'user_email': 'a@b', 'coins': 0})
+
+
+def test_completion_update_streak_branches(db):
+    seed(db, [habit('cont', YESTERDAY, 4), habit('fresh', LAST_WEEK, 4), habit('new'), habit('other', YESTERDAY, 2)])
+    for habit_id in ('cont', 'fresh', 'new'):
+        update, array_filters = completion._completion_update(habit_id, NOW, 'UTC')
+        db.user_habits.update_one({'user_email': 'a@b'}, update, array_filters=array_filters)
+
+    habits = {h['id']: h for h in db.user_habits.find_one({'user_email': 'a@b'})['habits']}
+    assert [habits[h]['streak'] for h in ('cont', 'fresh', 'new', 'other')] == [5, 1, 1, 2]
+    assert [habits[h]['totalCompletions'] for h in ('cont', 'fresh', 'new', 'other')] == [5, 5, 1, 2]
+    for habit_id in ('cont', 'fresh', 'new'):
+        assert habits[habit_id]['completedToday'] is True
+        assert habits[habit_id]['lastCompletedAt'] == NOW.isoformat()
+        assert isinstance(habits[habit_id]['v'], Timestamp)
+    assert 'v' not in habits['other']
+
+
+def test_complete_habit(db):
+    seed(db, [habit('h1', YESTERDAY, 4)])
+    repo = repository.SyncRepository(db)
+    result = repo.run(completion.complete_habit(
+        repository.habits, repository.inventory, repository.achievements, 'a@b', 'h1', now=NOW
+    ))
+    assert result['habit']['streak'] == 5
+    assert result['reward'] == 15
+    assert result['currentCoins'] == 15
+
+    with pytest.raises(completion.CompletionError) as info:
+        repo.run(completion.complete_habit(
+            repository.habits, repository.inventory, repository.achievements, 'a@b', 'h1', now=NOW
+        ))
+    assert (info.value.message, info.value.status) == ('Habit already completed today', 400)
+
+
+def test_complete_habits(db):
+    done_today = habit('done', NOW.replace(hour=1).isoformat(), 3, completedToday=True)
+    seed(db, [habit('cont', YESTERDAY, 9), habit('fresh', LAST_WEEK, 4), done_today])
+    repo = repository.SyncRepository(db)
+    result = repo.run(completion.complete_habits(
+        repository.habits, repository.inventory, repository.achievements, 'a@b',
+        ['cont', 'fresh', 'done', 'missing'], now=NOW
+    ))
+
+    assert result['completed'] == 2
+    assert [(r['habitId'], r['completed'], r.get('status')) for r in result['results']] == [
+        ('cont', True, None), ('fresh', True, None), ('done', False, 400), ('missing', False, 404)
+    ]
+    # 10 + 10 for the ten-day streak, 10 for the fresh one
+    assert (result['reward'], result['currentCoins']) == (30, 30)
+
+    habits = {h['id']: h for h in db.user_habits.find_one({'user_email': 'a@b'})['habits']}
+    assert (habits['cont']['streak'], habits['fresh']['streak'], habits['done']['streak']) == (10, 1, 3)
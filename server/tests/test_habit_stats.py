@@ -0,0 +1,97 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+import habit_stats
+import history
+
+
+def bucket(habit_id, *days):
+    # one monthly bucket with the given dates completed
+    month = history.bucket_for(days[0])
+    bits = 0
+    for day in days:
+        assert history.bucket_for(day) == month
+        bits |= 1 << (day.day - 1)
+    return {'habit_id': habit_id, 'bucket': month, 'days': bits}
+
+
+def test_window_arg():
+    assert habit_stats.window_arg(None) is None
+    assert habit_stats.window_arg('') is None
+    assert habit_stats.window_arg('90') == 90
+    for raw in ('7', 'abc', '-30'):
+        with pytest.raises(habit_stats.StatsError):
+            habit_stats.window_arg(raw)
+
+
+def test_runs():
+    grid = np.array([[1, 1, 0, 1, 1, 1], [0, 0, 0, 0, 0, 1]], dtype=bool)
+    assert habit_stats.runs(grid).tolist() == [[1, 2, 0, 1, 2, 3], [0, 0, 0, 0, 0, 1]]
+
+
+def test_completion_matrix_spans_months():
+    start = date(2024, 1, 30)
+    buckets = [
+        bucket('a', date(2024, 1, 29), date(2024, 1, 31)),
+        bucket('a', date(2024, 2, 2)),
+        bucket('b', date(2024, 2, 1)),
+        bucket('unknown', date(2024, 2, 1)),
+    ]
+    grid = habit_stats.completion_matrix(buckets, ['a', 'b'], start, 4)
+    # Jan 29 is before the window
+    assert grid.tolist() == [[False, True, False, True], [False, False, True, False]]
+
+
+def test_active_matrix():
+    active = habit_stats.active_matrix([None, 2], 4)
+    assert active.tolist() == [[True] * 4, [False, False, True, True]]
+
+
+def test_window_stats():
+    end = date(2024, 3, 10)
+    start = end - timedelta(days=4)
+    days = [start + timedelta(days=n) for n in range(5)]
+    habits = [
+        {'id': 'a', 'createdAt': '2024-01-01T00:00:00'},
+        # created on the window's third day
+        {'id': 'b', 'createdAt': '2024-03-08T09:00:00'},
+    ]
+    buckets = [
+        bucket('a', days[0], days[1], days[2], days[3]),
+        bucket('b', days[2], days[3]),
+    ]
+    stats = habit_stats.window_stats(habits, buckets, start, end)
+
+    assert stats['days'] == 5
+    assert stats['completions'] == 6
+    assert stats['dailyRate'] == [100.0, 100.0, 100.0, 100.0, 0.0]
+    assert stats['perfectDays'] == 4
+    # today is not done yet, which does not break a run
+    assert stats['currentPerfectRun'] == 4
+    assert stats['longestPerfectRun'] == 4
+
+    a, b = stats['habits']
+    assert (a['currentStreak'], a['longestStreak'], a['completions']) == (4, 4, 4)
+    assert a['completionRate'] == 80.0
+    assert (b['currentStreak'], b['completions'], b['completionRate']) == (2, 2, 66.7)
+
+
+def test_window_stats_breaks_current_streak():
+    end = date(2024, 3, 10)
+    start = end - timedelta(days=4)
+    habits = [{'id': 'a', 'createdAt': '2024-01-01T00:00:00'}]
+    buckets = [bucket('a', start, start + timedelta(days=1))]
+    stats = habit_stats.window_stats(habits, buckets, start, end)
+    assert stats['habits'][0]['currentStreak'] == 0
+    assert stats['habits'][0]['longestStreak'] == 2
+    assert stats['currentPerfectRun'] == 0
+
+
+def test_window_stats_without_habits():
+    end = date(2024, 3, 10)
+    stats = habit_stats.window_stats([], [], end - timedelta(days=29), end)
+    assert stats['completions'] == 0
+    assert stats['completionRate'] == 0.0
+    assert stats['habits'] == []
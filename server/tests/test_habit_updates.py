@@ -0,0 +1,65 @@
+import pytest
+
+import habit_updates
+import leaderboard
+import repository
+
+VALID = {'title': 'Run', 'frequency': 'daily', 'category': 'fitness'}
+
+
+@pytest.mark.parametrize('data, message', [
+    ({'title': 'Run', 'frequency': 'daily'}, 'category is required'),
+    (dict(VALID, title=''), 'title cannot be empty'),
+    (dict(VALID, category='  '), 'category cannot be empty'),
+    (dict(VALID, title=42), 'title must be a string'),
+    (dict(VALID, color=['red']), 'color must be a string'),
+    (dict(VALID, coinReward=True), 'coinReward must be an integer'),
+    (dict(VALID, coinReward=1000), 'coinReward must be between 1 and 100'),
+])
+def test_new_habit_rejects(data, message):
+    with pytest.raises(habit_updates.HabitUpdateError) as info:
+        habit_updates.new_habit(data)
+    assert info.value.message == message
+    assert info.value.status == 400
+
+
+def test_new_habit():
+    habit = habit_updates.new_habit(dict(VALID, coinReward=20, streak=99))
+    assert habit['coinReward'] == 20
+    assert habit['streak'] == 0
+    assert habit['difficulty'] == 'medium'
+
+
+def scores(db, user):
+    return {doc['board']: doc['score'] for doc in db['leaderboard_scores'].find({'user': user})}
+
+
+def test_category_change_moves_the_streak(db, repo):
+    habits = [dict(habit_updates.new_habit(VALID), id=f'h{n}', streak=streak) for n, streak in enumerate((5, 2))]
+    db['user_habits'].insert_one({'user_email': 'a@example.com', 'habits': habits})
+    repo.run(leaderboard.record_streaks(repository.scores, 'a@example.com', habits))
+    assert scores(db, 'a@example.com')['streak:fitness'] == 5
+
+    habit = repo.run(habit_updates.update_habit(
+        repository.habits, 'a@example.com', 'h0', {'category': 'reading'},
+        leaderboard_collection=repository.scores
+    ))
+    assert habit['id'] == 'h0' and habit['category'] == 'reading'
+    boards = scores(db, 'a@example.com')
+    assert boards['streak:fitness'] == 2
+    assert boards['streak:reading'] == 5
+    assert boards['streak'] == 5
+
+
+def test_batch_category_change_moves_the_streaks(db, repo):
+    habits = [dict(habit_updates.new_habit(VALID), id='h0', streak=5)]
+    db['user_habits'].insert_one({'user_email': 'a@example.com', 'habits': habits})
+
+    updated, not_found = repo.run(habit_updates.update_habits(
+        repository.habits, 'a@example.com', [{'id': 'h0', 'category': 'reading'}, {'id': 'gone', 'title': 'x'}],
+        leaderboard_collection=repository.scores
+    ))
+    assert [h['category'] for h in updated] == ['reading'] and not_found == ['gone']
+    boards = scores(db, 'a@example.com')
+    assert boards['streak:fitness'] == 0
+    assert boards['streak:reading'] == 5
@@ -0,0 +1,47 @@
+import pytest
+from bson.timestamp import Timestamp
+
+import leaderboard
+import repository
+
+
+def test_completion_ops():
+    ops = leaderboard.completion_ops('a@b', [{'streak': 3, 'category': 'fitness'}, {'streak': 5, 'category': 'fitness'}])
+    updates = {op._filter['_id']: op._doc for op in ops}
+    assert updates['completions:a@b']['$inc'] == {'score': 2}
+    assert updates['streak:fitness:a@b']['$max'] == {'score': 5}
+
+
+@pytest.mark.parametrize('board, ok', [
+    ('coins', True), ('streak:fitness', True), ('coins:fitness', False), ('streak:a.b', False), ('nope', False),
+])
+def test_check_board(board, ok):
+    if ok:
+        assert leaderboard.check_board(board) == board
+    else:
+        with pytest.raises(leaderboard.LeaderboardError):
+            leaderboard.check_board(board)
+
+
+def scores(db):
+    return {doc['_id']: doc['score'] for doc in db['leaderboard_scores'].find()}
+
+
+def test_record_completions_writes_coins_in_the_same_bulk_write(db, repo):
+    ops = []
+    gen = leaderboard.record_completions(repository.scores, 'a@b', [{'streak': 1, 'category': 'fitness'}],
+                                         {'coins': 110, 'version': Timestamp(10, 1)})
+    for op in gen:
+        ops.append(op)
+        repo.execute(op)
+    assert [op.method for op in ops] == ['bulk_write']
+    assert scores(db)['coins:a@b'] == 110
+    assert scores(db)['completions:a@b'] == 1
+
+
+def test_record_completions_keeps_a_newer_balance(db, repo):
+    repo.run(leaderboard.record_coins(repository.scores, 'a@b', {'coins': 120, 'version': Timestamp(20, 1)}))
+    repo.run(leaderboard.record_completions(repository.scores, 'a@b', [{'streak': 1, 'category': 'fitness'}],
+                                            {'coins': 110, 'version': Timestamp(10, 1)}))
+    assert scores(db)['coins:a@b'] == 120
+    assert scores(db)['completions:a@b'] == 1
@@ -0,0 +1,32 @@
+import config
+import metrics
+
+
+def test_command_bytes_are_off_by_default():
+    assert config.DEFAULTS['METRICS_COMMAND_BYTES'] is False
+    metrics.configure({})
+    assert metrics.COUNT_BYTES is False
+
+
+def test_scrape_allowed():
+    assert metrics.scrape_allowed(None, '127.0.0.1', None)
+    assert metrics.scrape_allowed(None, '::1', None)
+    assert not metrics.scrape_allowed(None, '203.0.113.7', None)
+
+    assert metrics.scrape_allowed('Bearer s3cret', '203.0.113.7', 's3cret')
+    assert not metrics.scrape_allowed('Bearer wrong', '127.0.0.1', 's3cret')
+    assert not metrics.scrape_allowed(None, '127.0.0.1', 's3cret')
+
+
+def test_metrics_route(client):
+    assert client.get('/metrics').status_code == 200
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.7'}).status_code == 403
+
+
+def test_metrics_route_with_token(app):
+    app.config['METRICS_TOKEN'] = 's3cret'
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 403
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert b'# TYPE' in response.data
@@ -0,0 +1,42 @@
+import pytest
+
+import migrations
+
+
+def test_migrate_is_idempotent(db):
+    assert migrations.current_version(db) == migrations.LATEST_VERSION
+    assert migrations.migrate(db) == migrations.LATEST_VERSION
+
+
+def test_duplicate_emails_are_reported(mongo_client):
+    db = mongo_client['momentum_test_duplicates']
+    try:
+        db['users'].insert_many([{'email': e} for e in ('a@example.com', 'b@example.com', 'a@example.com')])
+
+        with pytest.raises(migrations.MigrationError) as info:
+            migrations.migrate(db)
+        assert "'a@example.com' x2" in str(info.value)
+        assert 'b@example.com' not in str(info.value)
+        assert migrations.current_version(db) == 0
+
+        db['users'].delete_one({'email': 'a@example.com'})
+        assert migrations.migrate(db) == migrations.LATEST_VERSION
+    finally:
+        mongo_client.drop_database('momentum_test_duplicates')
+
+
+
+def test_require_latest():
+    assert migrations.require_latest(migrations.LATEST_VERSION) == migrations.LATEST_VERSION
+    with pytest.raises(migrations.MigrationError) as info:
+        migrations.require_latest(4)
+    assert f'at version 4, this code needs {migrations.LATEST_VERSION}' in str(info.value)
+
+
+def test_app_refuses_an_old_schema(app, db):
+    import app as app_module
+
+    db['schema_migrations'].update_one({'_id': migrations.SCHEMA_ID}, {'$set': {'version': 4}})
+    app.config['RUN_MIGRATIONS'] = False
+    with pytest.raises(migrations.MigrationError):
+        app_module.start_background(app)
@@ -0,0 +1,50 @@
+import pytest
+from bson.timestamp import Timestamp
+
+import response_encoding
+
+
+def test_fields_arg_absent():
+    assert response_encoding.fields_arg(None) is None
+    assert response_encoding.fields_arg('') is None
+
+
+def test_fields_arg_always_keeps_id_and_version():
+    assert response_encoding.fields_arg('title,streak') == ('id', 'v', 'title', 'streak')
+
+
+def test_fields_arg_drops_blanks_and_duplicates():
+    assert response_encoding.fields_arg(' title , ,title,id ') == ('id', 'v', 'title')
+
+
+@pytest.mark.parametrize('raw', [',', 'title,$where', 'habits.title', '1st', ','.join(['f'] * 31)])
+def test_fields_arg_rejects(raw):
+    with pytest.raises(response_encoding.FieldsError) as info:
+        response_encoding.fields_arg(raw)
+    assert info.value.status == 400
+
+
+def test_select():
+    elements = [{'id': 'a', 'v': 1, 'title': 'Run', 'streak': 3}, {'id': 'b', 'title': 'Read'}]
+    assert response_encoding.select(elements, ('id', 'v', 'title')) == [
+        {'id': 'a', 'v': 1, 'title': 'Run'}, {'id': 'b', 'title': 'Read'}
+    ]
+    assert response_encoding.select(elements, None) is elements
+
+
+def test_response_obj():
+    assert response_encoding.response_obj((), {}) == {}
+    assert response_encoding.response_obj((), {'a': 1}) == {'a': 1}
+    assert response_encoding.response_obj(([1, 2],), {}) == [1, 2]
+    assert response_encoding.response_obj((1, 2), {}) == [1, 2]
+    with pytest.raises(TypeError):
+        response_encoding.response_obj((1,), {'a': 1})
+
+
+def test_jsonify_uses_the_provider(app):
+    from flask import jsonify
+
+    with app.app_context():
+        response = jsonify(version=Timestamp(1, 2), items=[])
+    assert response.mimetype == 'application/json'
+    assert response_encoding.loads(response.get_data()) == {'version': str((1 << 32) | 2), 'items': []}
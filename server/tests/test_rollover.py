@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import rollover
+
+NOW = datetime(2024, 3, 10, 15, 0, tzinfo=timezone.utc)
+LEASE = timedelta(minutes=5)
+
+
+def seed(db, count):
+    # every user has a lapsed streak and yesterday's completedToday flag
+    db['user_habits'].insert_many([{
+        'user_email': f'u{n}@example.com',
+        'timezone': 'UTC',
+        'habits': [{'id': 'h1', 'streak': 3, 'completedToday': True, 'category': 'fitness',
+                    'lastCompletedAt': '2024-03-07T18:00:00+00:00'}]
+    } for n in range(count)])
+
+
+def test_lease_is_exclusive_until_it_expires(db):
+    state = db['rollover_state']
+    assert rollover.acquire_lease(state, 'a', LEASE, now=NOW)
+    assert not rollover.acquire_lease(state, 'b', LEASE, now=NOW + timedelta(minutes=1))
+    # the holder renews its own lease
+    assert rollover.acquire_lease(state, 'a', LEASE, now=NOW + timedelta(minutes=4))
+    assert not rollover.acquire_lease(state, 'b', LEASE, now=NOW + timedelta(minutes=8))
+
+    assert rollover.acquire_lease(state, 'b', LEASE, now=NOW + timedelta(minutes=10))
+    assert not rollover.acquire_lease(state, 'a', LEASE, now=NOW + timedelta(minutes=11))
+
+
+def test_release_lease(db):
+    state = db['rollover_state']
+    rollover.acquire_lease(state, 'a', LEASE, now=NOW)
+    rollover.release_lease(state, 'b')
+    assert not rollover.acquire_lease(state, 'b', LEASE, now=NOW)
+    rollover.release_lease(state, 'a')
+    assert rollover.acquire_lease(state, 'b', LEASE, now=NOW)
+
+
+def test_run_rollover(db):
+    seed(db, 3)
+    renewals = []
+
+    state = rollover.run_rollover(db, 'UTC', now=NOW, batch_size=2, renew=lambda: renewals.append(1) or True)
+    assert state['done'] and state['processed'] == 3
+    assert len(renewals) == 2
+    for doc in db['user_habits'].find():
+        assert doc['habits'][0]['streak'] == 0
+        assert doc['habits'][0]['completedToday'] is False
+
+    # a finished day is a no-op
+    assert rollover.run_rollover(db, 'UTC', now=NOW, renew=lambda: pytest.fail('renewed'))['done']
+
+
+def test_run_rollover_stops_when_the_lease_is_lost(db):
+    seed(db, 3)
+
+    with pytest.raises(rollover.LeaseLost):
+        rollover.run_rollover(db, 'UTC', now=NOW, batch_size=2, renew=lambda: False)
+    checkpoint = db['rollover_state'].find_one({'_id': 'UTC:2024-03-10'})
+    assert checkpoint['processed'] == 2
+    assert not checkpoint.get('done')
+    assert sorted(d['habits'][0]['streak'] for d in db['user_habits'].find()) == [0, 0, 3]
+
+    # whoever takes over resumes after the checkpoint
+    state = rollover.run_rollover(db, 'UTC', now=NOW, batch_size=2)
+    assert state['done'] and state['processed'] == 3
+    assert [d['habits'][0]['streak'] for d in db['user_habits'].find()] == [0, 0, 0]
@@ -0,0 +1,200 @@
+import pytest
+
+
+@pytest.fixture
+def auth(client, login):
+    return login(client)
+
+
+def create_habit(client, auth, title='Run', **fields):
+    response = client.post('/habits', headers=auth, json=dict({'title': title, 'frequency': 'daily', 'category': 'fitness'}, **fields))
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['habit']
+
+
+def test_complete_habit(client, auth):
+    habit = create_habit(client, auth)
+
+    response = client.post(f"/habits/{habit['id']}/complete", headers=auth)
+    body = response.get_json()
+    assert response.status_code == 200, body
+    assert body['habit']['streak'] == 1
+    assert body['habit']['totalCompletions'] == 1
+    assert body['habit']['completedToday'] is True
+    assert body['currentCoins'] == 100 + body['reward']
+
+    again = client.post(f"/habits/{habit['id']}/complete", headers=auth)
+    assert again.status_code == 400
+    assert client.get('/habits', headers=auth).get_json()['habits'][0]['totalCompletions'] == 1
+
+
+def test_complete_unknown_habit(client, auth):
+    assert client.post('/habits/missing/complete', headers=auth).status_code == 404
+
+
+def test_complete_habits_batch(client, auth):
+    ids = [create_habit(client, auth, title)['id'] for title in ('Run', 'Read')]
+
+    response = client.post('/habits/complete', headers=auth, json={'habitIds': ids + ['missing']})
+    body = response.get_json()
+    assert response.status_code == 200, body
+    assert body['completed'] == 2
+    assert {r['habitId']: r['completed'] for r in body['results']} == {ids[0]: True, ids[1]: True, 'missing': False}
+    assert body['currentCoins'] == 100 + body['reward']
+
+
+def test_claim_achievement(client, auth):
+    # achievement-8 needs a single completion
+    habit = create_habit(client, auth)
+    coins = client.post(f"/habits/{habit['id']}/complete", headers=auth).get_json()['currentCoins']
+
+    achievements = {a['id']: a for a in client.get('/achievements', headers=auth).get_json()['achievements']}
+    assert achievements['achievement-8']['earned'] is True
+    assert achievements['achievement-8']['claimed'] is False
+
+    response = client.post('/achievements/achievement-8/claim', headers=auth)
+    body = response.get_json()
+    assert response.status_code == 200, body
+    assert body['achievement']['claimed'] is True
+    assert body['currentCoins'] == coins + 50
+
+    assert client.post('/achievements/achievement-8/claim', headers=auth).status_code == 400
+    assert client.get('/inventory', headers=auth).get_json()['coins'] == coins + 50
+
+
+def test_claim_unearned_achievement(client, auth):
+    response = client.post('/achievements/achievement-1/claim', headers=auth)
+    assert response.status_code == 400
+    assert client.get('/inventory', headers=auth).get_json()['coins'] == 100
+
+
+def test_purchase(client, auth):
+    response = client.post('/inventory/purchase', headers=auth, json={'id': 'theme-3'})
+    body = response.get_json()
+    assert response.status_code == 200, body
+    assert body['item']['id'] == 'theme-3'
+    assert body['currentCoins'] == 0
+
+    inventory = client.get('/inventory', headers=auth).get_json()
+    assert inventory['coins'] == 0
+    assert [item['id'] for item in inventory['items']] == ['theme-3']
+
+
+@pytest.mark.parametrize('item_id, status', [('theme-3', 400), ('theme-7', 400), ('no-such-item', 404)])
+def test_purchase_rejected(client, auth, item_id, status):
+    # theme-3 is already owned, theme-7 costs more than the coins left
+    client.post('/inventory/purchase', headers=auth, json={'id': 'theme-3'})
+
+    response = client.post('/inventory/purchase', headers=auth, json={'id': item_id})
+    assert response.status_code == status, response.get_json()
+    assert client.get('/inventory', headers=auth).get_json()['coins'] == 0
+
+
+def test_idempotent_replay(client, auth):
+    habit = create_habit(client, auth)
+    headers = dict(auth, **{'Idempotency-Key': 'complete-1'})
+
+    first = client.post(f"/habits/{habit['id']}/complete", headers=headers)
+    replay = client.post(f"/habits/{habit['id']}/complete", headers=headers)
+    assert first.status_code == replay.status_code == 200
+    assert 'Idempotent-Replayed' not in first.headers
+    assert replay.headers['Idempotent-Replayed'] == 'true'
+    assert replay.get_data() == first.get_data()
+
+    # applied once
+    assert client.get('/habits', headers=auth).get_json()['habits'][0]['totalCompletions'] == 1
+    assert client.get('/inventory', headers=auth).get_json()['coins'] == first.get_json()['currentCoins']
+
+
+def test_idempotent_replay_of_client_error(client, auth):
+    headers = dict(auth, **{'Idempotency-Key': 'buy-1'})
+    first = client.post('/inventory/purchase', headers=headers, json={'id': 'theme-7'})
+    replay = client.post('/inventory/purchase', headers=headers, json={'id': 'theme-7'})
+    assert first.status_code == replay.status_code == 400
+    assert replay.headers['Idempotent-Replayed'] == 'true'
+
+
+def test_idempotency_key_reused_for_another_request(client, auth):
+    headers = dict(auth, **{'Idempotency-Key': 'buy-1'})
+    assert client.post('/inventory/purchase', headers=headers, json={'id': 'theme-3'}).status_code == 200
+    response = client.post('/inventory/purchase', headers=headers, json={'id': 'theme-1'})
+    assert response.status_code == 422
+
+
+def test_habits_since(client, auth):
+    run = create_habit(client, auth, 'Run')
+    create_habit(client, auth, 'Read')
+    version = client.get('/habits', headers=auth).get_json()['version']
+    # tokens are strings, see versions
+    assert isinstance(version, str)
+
+    unchanged = client.get('/habits', headers=auth, query_string={'since': version}).get_json()
+    assert unchanged['habits'] == []
+    assert unchanged['version'] == version
+
+    client.post(f"/habits/{run['id']}/complete", headers=auth)
+    delta = client.get('/habits', headers=auth, query_string={'since': version}).get_json()
+    assert [h['id'] for h in delta['habits']] == [run['id']]
+    assert delta['version'] != version
+
+
+def test_inventory_since(client, auth):
+    version = client.get('/inventory', headers=auth).get_json()['version']
+    assert version == '0'
+    client.post('/inventory/purchase', headers=auth, json={'id': 'theme-3'})
+
+    delta = client.get('/inventory', headers=auth, query_string={'since': version}).get_json()
+    assert [item['id'] for item in delta['items']] == ['theme-3']
+    assert delta['coins'] == 0
+
+    unchanged = client.get('/inventory', headers=auth, query_string={'since': delta['version']}).get_json()
+    assert unchanged['items'] == []
+
+
+def test_achievements_since(client, auth):
+    version = client.get('/achievements', headers=auth).get_json()['version']
+    assert client.get('/achievements', headers=auth, query_string={'since': version}).get_json()['changed'] is False
+
+    habit = create_habit(client, auth)
+    client.post(f"/habits/{habit['id']}/complete", headers=auth)
+    delta = client.get('/achievements', headers=auth, query_string={'since': version}).get_json()
+    assert delta['changed'] is True
+    assert delta['achievements']
+
+
+def test_requires_login(client):
+    assert client.get('/habits').status_code == 401
+    assert client.post('/habits/h1/complete').status_code == 401
+
+
+def test_achievements_reached_but_unmarked(client, auth, db):
+    # a task that updated the counters but stopped before marking
+    db['user_achievements'].update_one({'user_email': 'a@example.com'}, {'$set': {'counters.totalCompletions': 1}})
+    before = db['user_achievements'].find_one({'user_email': 'a@example.com'})
+
+    achievements = {a['id']: a for a in client.get('/achievements', headers=auth).get_json()['achievements']}
+    assert achievements['achievement-8']['earned'] is True
+    assert achievements['achievement-8']['earnedDate'] is None
+    # GET wrote nothing
+    assert db['user_achievements'].find_one({'user_email': 'a@example.com'}) == before
+
+    response = client.post('/achievements/achievement-8/claim', headers=auth)
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['achievement']['earnedDate'] is not None
+    assert client.post('/achievements/achievement-8/claim', headers=auth).get_json() == {
+        'error': 'Achievement already claimed'
+    }
+    assert client.get('/inventory', headers=auth).get_json()['coins'] == 150
+
+
+def test_register_when_the_password_pool_is_busy(app, client, monkeypatch):
+    import password_pool
+
+    def overloaded(password):
+        raise password_pool.PoolOverloaded()
+
+    monkeypatch.setattr(app.extensions['passwords'], 'hash_password', overloaded)
+    response = client.post('/register', json={'email': 'b@example.com', 'password': 'secret'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert response.get_json() == {'error': 'Server busy, please retry'}
@@ -0,0 +1,74 @@
+import pytest
+from bson.timestamp import Timestamp
+
+import repository
+import shop
+
+ITEMS = [{'id': 'a', 'name': 'A', 'category': 'themes', 'price': 30},
+         {'id': 'b', 'name': 'B', 'category': 'powerups', 'price': 30, 'usageLimit': 2}]
+
+
+class RecordingRepository(repository.SyncRepository):
+    def __init__(self, db, before_write=None):
+        super().__init__(db)
+        self.methods = []
+        self.before_write = before_write
+
+    def execute(self, op):
+        self.methods.append(op.method)
+        if op.method == 'find_one_and_update' and self.before_write:
+            self.before_write()
+        return super().execute(op)
+
+
+@pytest.fixture
+def catalog():
+    return shop.ShopCatalog(ITEMS)
+
+
+@pytest.fixture
+def inventory(db):
+    db['user_inventory'].insert_one({'user_email': 'a@example.com', 'coins': 100, 'items': [{'id': 'x'}]})
+    return db['user_inventory']
+
+
+def test_purchase_is_one_write(db, inventory, catalog):
+    repo = RecordingRepository(db)
+    item, coins = repo.run(shop.purchase(repository.inventory, 'a@example.com', 'b', shop=catalog))
+    assert repo.methods == ['find_one', 'find_one_and_update']
+    assert coins == 70
+    assert item['usesLeft'] == 2
+
+    doc = inventory.find_one()
+    assert [i['id'] for i in doc['items']] == ['x', 'b']
+    assert isinstance(doc['items'][1]['v'], Timestamp)
+    assert doc['items'][1]['v'] >= doc['version']
+
+
+def test_purchase_retries_when_the_inventory_changed(db, inventory, catalog):
+    def concurrent_purchase():
+        if repo.methods.count('find_one_and_update') == 1:
+            inventory.update_one({}, {'$push': {'items': {'id': 'y'}}})
+    repo = RecordingRepository(db, before_write=concurrent_purchase)
+
+    repo.run(shop.purchase(repository.inventory, 'a@example.com', 'a', shop=catalog))
+    assert repo.methods == ['find_one', 'find_one_and_update'] * 2
+    assert [i['id'] for i in inventory.find_one()['items']] == ['x', 'y', 'a']
+
+
+@pytest.mark.parametrize('coins, owned, message, status', [
+    (100, ['a'], 'Item already owned', 400),
+    (10, [], 'Not enough coins', 400),
+])
+def test_purchase_refused(db, inventory, catalog, coins, owned, message, status):
+    inventory.update_one({}, {'$set': {'coins': coins, 'items': [{'id': i} for i in owned]}})
+    with pytest.raises(shop.PurchaseError) as info:
+        repository.SyncRepository(db).run(shop.purchase(repository.inventory, 'a@example.com', 'a', shop=catalog))
+    assert (info.value.message, info.value.status) == (message, status)
+    assert inventory.find_one()['coins'] == coins
+
+
+def test_purchase_without_inventory(db, catalog):
+    with pytest.raises(shop.PurchaseError) as info:
+        repository.SyncRepository(db).run(shop.purchase(repository.inventory, 'nobody', 'a', shop=catalog))
+    assert info.value.status == 404
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone
+
+import achievement_engine
+import repository
+import tasks
+
+NOW = datetime(2024, 3, 10, 15, 0, tzinfo=timezone.utc)
+
+
+def seed(db):
+    db['user_habits'].insert_one({'user_email': 'a@b', 'habits': [{'id': 'h1', 'streak': 1, 'category': 'fitness'}]})
+    db['user_inventory'].insert_one({'user_email': 'a@b', 'coins': 100, 'items': []})
+    db['user_achievements'].insert_one({'user_email': 'a@b', 'earned': {}, 'counters': achievement_engine.empty_counters()})
+
+
+def enqueue(repo, habits, now=NOW):
+    repo.run(tasks.enqueue(repository.outbox, 'a@b', habits, now))
+
+
+def test_completions_coalesce_into_one_task(db, repo):
+    seed(db)
+    enqueue(repo, [{'id': 'h1', 'category': 'fitness', 'streak': 1}])
+    enqueue(repo, [{'id': 'h2', 'category': 'reading', 'streak': 2}])
+    assert db['task_outbox'].count_documents({}) == 1
+
+    claimed, users = repo.run(tasks.run_batch(10, NOW))
+    assert (claimed, users) == (1, {'a@b'})
+    assert db['task_outbox'].count_documents({}) == 0
+    counters = db['user_achievements'].find_one()['counters']
+    assert counters['totalCompletions'] == 2
+    assert counters['categories'] == {'fitness': 1, 'reading': 1}
+
+
+def test_failed_tasks_can_be_requeued(db, repo, monkeypatch):
+    seed(db)
+    enqueue(repo, [{'id': 'h1', 'category': 'fitness', 'streak': 1}])
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('boom')
+        yield
+    monkeypatch.setattr(achievement_engine, 'record_completions', broken)
+    now = NOW
+    for _ in range(tasks.MAX_ATTEMPTS):
+        repo.run(tasks.run_batch(10, now))
+        now += timedelta(hours=1)
+    task = db['task_outbox'].find_one()
+    assert task['state'] == 'failed'
+    # nothing is due any more
+    assert repo.run(tasks.run_batch(10, now)) == (0, set())
+
+    monkeypatch.undo()
+    assert repo.run(tasks.requeue_failed(repository.outbox, now)) == 1
+    assert repo.run(tasks.run_batch(10, now)) == (1, {'a@b'})
+    assert db['task_outbox'].count_documents({}) == 0
+    assert db['user_achievements'].find_one()['counters']['totalCompletions'] == 1
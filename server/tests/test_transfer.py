@@ -0,0 +1,83 @@
+import io
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from bson.timestamp import Timestamp
+from pymongo import InsertOne, ReplaceOne
+
+import transfer
+
+
+def importer(**options):
+    # batches never fill, so nothing reaches the (absent) database
+    return transfer.Importer(None, batch_size=1000, out=io.StringIO(), **options)
+
+
+def test_encode_round_trip():
+    doc = {
+        '_id': ObjectId(),
+        'user_email': 'a@b',
+        'createdAt': datetime(2024, 3, 10, 12, 30, tzinfo=timezone.utc),
+        'version': Timestamp(1700000000, 3),
+    }
+    line = transfer.encode('user_habits', doc)
+    assert line.endswith('\n') and line.count('\n') == 1
+
+    imp = importer()
+    imp.add(line)
+    request = imp.pending['user_habits'][0]
+    assert isinstance(request, InsertOne)
+    assert request._doc['_id'] == doc['_id']
+    assert request._doc['version'] == doc['version']
+    assert request._doc['createdAt'].replace(tzinfo=timezone.utc) == doc['createdAt']
+
+
+def test_blank_lines_are_skipped():
+    imp = importer()
+    imp.add('\n')
+    imp.add('   ')
+    assert imp.stats['read'] == 0 and imp.pending == {}
+
+
+def test_lines_are_grouped_by_collection():
+    imp = importer()
+    for name in ('users', 'user_habits', 'users'):
+        imp.add(transfer.encode(name, {'_id': ObjectId()}))
+    assert imp.stats['read'] == 3
+    assert {name: len(batch) for name, batch in imp.pending.items()} == {'users': 2, 'user_habits': 1}
+
+
+def test_upsert_replaces_by_id():
+    imp = importer(upsert=True)
+    imp.add(transfer.encode('users', {'_id': 1, 'email': 'a@b'}))
+    request = imp.pending['users'][0]
+    assert isinstance(request, ReplaceOne)
+    assert request._filter == {'_id': 1}
+
+
+@pytest.mark.parametrize('line', [
+    '{"c": "leaderboard_scores", "d": {}}',
+    '{"c": "users", "d": [1]}',
+    '{"d": {}}',
+])
+def test_rejects_records_that_are_not_exports(line):
+    imp = importer()
+    imp.add(transfer.encode('users', {'_id': 1}))
+    with pytest.raises(transfer.TransferError) as info:
+        imp.add(line)
+    assert info.value.message == 'Line 2: not an export record'
+
+
+def test_check_collections():
+    assert transfer.check_collections(None) == transfer.COLLECTIONS
+    assert transfer.check_collections(['users']) == ('users',)
+    with pytest.raises(transfer.TransferError):
+        transfer.check_collections(['users', 'leaderboard_scores'])
+
+
+def test_import_counts_duplicates(db):
+    lines = [transfer.encode('users', {'_id': n, 'email': f'{n}@b'}) for n in (1, 2, 1, 3)]
+    stats = transfer.Importer(db, batch_size=2, out=io.StringIO()).run(lines)
+    assert (stats['read'], stats['written'], stats['duplicates']) == (4, 3, 1)
+    assert sorted(d['_id'] for d in db.users.find()) == [1, 2, 3]
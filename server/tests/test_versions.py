@@ -0,0 +1,60 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson.timestamp import Timestamp
+
+import versions
+
+
+def test_token_round_trip():
+    version = Timestamp(1700000000, 7)
+    token = versions.to_token(version)
+    assert token == str((1700000000 << 32) | 7)
+    assert versions.from_token(token) == version
+
+
+def test_token_survives_json_numbers():
+    # what a JavaScript client does with every JSON value it keeps
+    version = Timestamp(1700000000, 7)
+    assert (1700000000 << 32) | 7 > 2 ** 53
+    token = json.loads(json.dumps(versions.to_token(version)), parse_int=float, parse_float=float)
+    assert versions.from_token(token) == version
+
+
+def test_to_token_without_version():
+    assert versions.to_token(None) == '0'
+
+
+def test_since_arg():
+    assert versions.since_arg(None) is None
+    assert versions.since_arg('') is None
+    assert versions.since_arg('0') == versions.ZERO
+    for raw in ('-1', 'abc', '1.5', '7.3e18', str(1 << 64), '\u0661'):
+        with pytest.raises(versions.VersionError) as info:
+            versions.since_arg(raw)
+        assert info.value.status == 400
+
+
+def test_stamp():
+    update = versions.stamp({'$set': {'a': 1}}, 'habits.$[h].v')
+    assert update['$currentDate'] == {'version': versions.STAMP, 'habits.$[h].v': versions.STAMP}
+    assert update['$set'] == {'a': 1}
+
+
+def test_json_default():
+    def fallback(value):
+        raise TypeError(value)
+
+    default = versions.json_default(fallback)
+    assert default(Timestamp(1, 2)) == str((1 << 32) | 2)
+    with pytest.raises(TypeError):
+        default(object())
+
+
+def test_too_old():
+    now = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    recent = Timestamp(int((now - timedelta(days=1)).timestamp()), 0)
+    ancient = Timestamp(int((now - versions.RETENTION).timestamp()), 0)
+    assert not versions.too_old(recent, now)
+    assert versions.too_old(ancient, now)
@@ -0,0 +1,27 @@
+# timeutil.py - per-user day boundaries
+
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+def user_zone(tz_name):
+    try:
+        return ZoneInfo(tz_name or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        return timezone.utc
+
+
+def local_day_bounds(tz_name, now_utc):
+    # (start of yesterday, start of today) in the user's timezone, as UTC
+    # isoformat strings comparable with the stored lastCompletedAt values
+    zone = user_zone(tz_name)
+    today = now_utc.astimezone(zone).date()
+    today_start = datetime.combine(today, time.min, tzinfo=zone)
+    yesterday_start = datetime.combine(today - timedelta(days=1), time.min, tzinfo=zone)
+    return (yesterday_start.astimezone(timezone.utc).isoformat(),
+            today_start.astimezone(timezone.utc).isoformat())
+
+
+def local_today(tz_name, now_utc=None):
+    now_utc = now_utc or datetime.now(timezone.utc)
+    return now_utc.astimezone(user_zone(tz_name)).date()
@@ -0,0 +1,204 @@
+# transfer.py - NDJSON export and bulk import of user data
+#
+# One document per line, tagged with its collection:
+#   {"c": "user_habits", "d": {...the document, _id included...}}
+# in MongoDB extended JSON (relaxed), so ObjectIds, dates and the version
+# timestamps survive the round trip. Collections are exported one after
+# the other, each through a batched cursor in _id order, and lines are
+# yielded in chunks: memory stays constant however many users there are.
+#
+# The importer reads lines as they come and writes each collection in
+# `batch_size` bulk writes, unordered by default (duplicates are counted
+# and skipped) or ordered (stops at the first error); --upsert replaces
+# documents with the same _id instead. It migrates the target database
+# first, so indexes exist before the data arrives, and rebuilds the
+# leaderboards afterwards (scores are derived, so they are not exported).
+#
+#   python transfer.py export > backup.ndjson
+#   python transfer.py export --collections users user_habits | gzip > part.ndjson.gz
+#   python transfer.py import backup.ndjson --batch-size 2000
+#
+# Exports hold password hashes: keep them as private as the database.
+# GET /admin/export streams the same format to ADMIN_EMAILS.
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+from bson import json_util
+from pymongo import InsertOne, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from errors import ApiError
+
+COLLECTIONS = ('users', 'user_habits', 'user_inventory', 'user_achievements', 'habit_history')
+DEFAULT_BATCH_SIZE = 1000
+# lines per yielded chunk
+CHUNK_LINES = 500
+
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS
+
+
+class TransferError(ApiError):
+    pass
+
+
+def check_collections(names):
+    names = tuple(names or COLLECTIONS)
+    unknown = [name for name in names if name not in COLLECTIONS]
+    if unknown:
+        raise TransferError(f"Unknown collections: {', '.join(unknown)}")
+    return names
+
+
+def encode(collection_name, doc):
+    return json_util.dumps({'c': collection_name, 'd': doc}, json_options=JSON_OPTIONS) + '\n'
+
+
+def export_lines(db, collections=COLLECTIONS, batch_size=DEFAULT_BATCH_SIZE):
+    # Chunks of NDJSON text
+    for name in collections:
+        chunk = []
+        for doc in db[name].find({}, sort=[('_id', 1)], batch_size=batch_size):
+            chunk.append(encode(name, doc))
+            if len(chunk) >= CHUNK_LINES:
+                yield ''.join(chunk)
+                chunk = []
+        if chunk:
+            yield ''.join(chunk)
+
+
+async def export_lines_async(db, collections=COLLECTIONS, batch_size=DEFAULT_BATCH_SIZE):
+    # Same, for the async driver
+    for name in collections:
+        chunk = []
+        async for doc in db[name].find({}, sort=[('_id', 1)], batch_size=batch_size):
+            chunk.append(encode(name, doc))
+            if len(chunk) >= CHUNK_LINES:
+                yield ''.join(chunk)
+                chunk = []
+        if chunk:
+            yield ''.join(chunk)
+
+
+class Importer:
+    def __init__(self, db, batch_size=DEFAULT_BATCH_SIZE, ordered=False, upsert=False,
+                 progress_every=100000, out=sys.stderr):
+        self.db = db
+        self.batch_size = batch_size
+        self.ordered = ordered
+        self.upsert = upsert
+        self.progress_every = progress_every
+        self.out = out
+        self.pending = {}
+        self.stats = {'read': 0, 'written': 0, 'duplicates': 0, 'errors': 0}
+        self.started = time.monotonic()
+
+    def _request(self, doc):
+        if self.upsert and '_id' in doc:
+            return ReplaceOne({'_id': doc['_id']}, doc, upsert=True)
+        return InsertOne(doc)
+
+    def add(self, line):
+        line = line.strip()
+        if not line:
+            return
+        record = json_util.loads(line, json_options=JSON_OPTIONS)
+        name = record.get('c')
+        if name not in COLLECTIONS or not isinstance(record.get('d'), dict):
+            raise TransferError(f'Line {self.stats["read"] + 1}: not an export record')
+
+        self.stats['read'] += 1
+        batch = self.pending.setdefault(name, [])
+        batch.append(self._request(record['d']))
+        if len(batch) >= self.batch_size:
+            self.flush(name)
+        if self.stats['read'] % self.progress_every == 0:
+            self.report()
+
+    def flush(self, name=None):
+        for collection_name in ([name] if name else list(self.pending)):
+            batch = self.pending.pop(collection_name, [])
+            if not batch:
+                continue
+            try:
+                result = self.db[collection_name].bulk_write(batch, ordered=self.ordered)
+                self.stats['written'] += result.inserted_count + result.upserted_count + result.modified_count
+            except BulkWriteError as e:
+                details = e.details
+                self.stats['written'] += details.get('nInserted', 0) + details.get('nUpserted', 0) + details.get('nModified', 0)
+                for error in details.get('writeErrors', []):
+                    self.stats['duplicates' if error.get('code') == 11000 else 'errors'] += 1
+                if self.ordered:
+                    # everything after the failing document was skipped
+                    self.report()
+                    raise TransferError(f'{collection_name}: {details["writeErrors"][0].get("errmsg")}')
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.stats['read'] / elapsed if elapsed else 0
+        print(f"{self.stats['read']} read, {self.stats['written']} written, "
+              f"{self.stats['duplicates']} duplicates, {self.stats['errors']} errors "
+              f'({rate:.0f} docs/s)', file=self.out, flush=True)
+
+    def run(self, lines):
+        for line in lines:
+            self.add(line)
+        self.flush()
+        self.report()
+        return self.stats
+
+
+def main():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    import migrations
+
+    parser = argparse.ArgumentParser(description='Export or import user data as NDJSON')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help='write every collection to stdout (or --out)')
+    export.add_argument('--collections', nargs='+', choices=COLLECTIONS)
+    export.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    export.add_argument('--out', help='file to write instead of stdout')
+
+    load = commands.add_parser('import', help='bulk-write an export into the database')
+    load.add_argument('file', nargs='?', default='-', help="export file ('-' for stdin)")
+    load.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    load.add_argument('--ordered', action='store_true', help='stop at the first failed write')
+    load.add_argument('--upsert', action='store_true', help='replace documents with the same _id')
+    load.add_argument('--progress-every', type=int, default=100000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    load_dotenv()
+    db = MongoClient(os.getenv('MONGO_URI'))['momentum_db']
+
+    if args.command == 'export':
+        out = open(args.out, 'w', encoding='utf-8') if args.out else sys.stdout
+        try:
+            for chunk in export_lines(db, check_collections(args.collections), args.batch_size):
+                out.write(chunk)
+        finally:
+            if args.out:
+                out.close()
+        return
+
+    migrations.migrate(db)
+    source = sys.stdin if args.file == '-' else open(args.file, encoding='utf-8')
+    try:
+        importer = Importer(db, args.batch_size, args.ordered, args.upsert, args.progress_every)
+        importer.run(source)
+    except TransferError as e:
+        sys.exit(e.message)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    migrations.rebuild_leaderboards(db)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+# versions.py - change versions for delta sync
+#
+# user_habits, user_inventory and user_achievements documents carry a
+# `version`, and each embedded habit / item a `v`: the version at which it
+# last changed. Both are BSON timestamps set by the server with
+# $currentDate in the same update that changes the data, so they only
+# ever grow for a document no matter which worker writes. Clients see them
+# as tokens: the integer time << 32 | increment as a decimal string, since
+# current timestamps are past 2**53 and a JSON number would be rounded by
+# JavaScript clients. Compare them as opaque values, not as numbers.
+#
+# Deleted habits / items leave a tombstone {id, v} in deletedHabits /
+# deletedItems. A client passing ?since=<version> gets the elements and
+# tombstones with a newer v; elements without a v (just pushed, stamped by
+# the next write) are always included. Tombstones older than RETENTION are
+# pruned, so a client that has not synced for that long gets a full list.
+#
+# Helpers that write are repository generators (see repository).
+
+from datetime import datetime, timedelta, timezone
+
+from bson.timestamp import Timestamp
+
+from errors import ApiError
+
+STAMP = {'$type': 'timestamp'}
+ZERO = Timestamp(0, 0)
+# stands in for a missing `v`, so unstamped elements always count as changed
+UNSTAMPED = Timestamp(0xFFFFFFFF, 0xFFFFFFFF)
+RETENTION = timedelta(days=30)
+
+TOMBSTONES = {'habits': 'deletedHabits', 'items': 'deletedItems'}
+
+
+class VersionError(ApiError):
+    pass
+
+
+def stamp(update, *paths):
+    # Adds $currentDate for the document version and the given element
+    # paths (e.g. 'habits.$[h].v') to an update document
+    current = update.setdefault('$currentDate', {})
+    for path in ('version',) + paths:
+        current[path] = STAMP
+    return update
+
+
+def to_token(version):
+    if not isinstance(version, Timestamp):
+        return '0'
+    return str((version.time << 32) | version.inc)
+
+
+def from_token(raw):
+    # digits only: no sign, exponent or fraction a rounded number could carry
+    if not isinstance(raw, str) or not raw.isdigit() or not raw.isascii():
+        raise ValueError(raw)
+    token = int(raw)
+    if token >> 64:
+        raise ValueError(raw)
+    return Timestamp(token >> 32, token & 0xFFFFFFFF)
+
+
+def since_arg(raw):
+    # ?since= query argument; None when absent
+    if raw in (None, ''):
+        return None
+    try:
+        return from_token(raw)
+    except ValueError:
+        raise VersionError('since must be a version number', 400)
+
+
+def json_default(fallback):
+    # Wraps a JSON provider's default() so versions serialize as tokens
+    def default(value):
+        if isinstance(value, Timestamp):
+            return to_token(value)
+        return fallback(value)
+    return default
+
+
+def _cutoff(now=None):
+    now = now or datetime.now(timezone.utc)
+    return Timestamp(int((now - RETENTION).timestamp()), 0)
+
+
+def too_old(since, now=None):
+    # a day of slack between the app's clock and the server's timestamps
+    return since.time < _cutoff(now).time + 86400
+
+
+def _changed(field, since):
+    return {'$filter': {
+        'input': {'$ifNull': [f'${field}', []]},
+        'as': 'e',
+        'cond': {'$gt': [{'$ifNull': ['$$e.v', UNSTAMPED]}, since]}
+    }}
+
+
+def _only(elements, element_fields):
+    return {'$map': {
+        'input': elements,
+        'as': 'e',
+        'in': {field: f'$$e.{field}' for field in element_fields}
+    }}
+
+
+def load(collection, user_email, array, since=None, fields=(), element_fields=None):
+    # The user's document with the full `array`, or with only what changed
+    # after `since` (+ 'deleted' ids). None if there is no document.
+    # `element_fields` (including 'v') trims the elements on the server.
+    tombstones = TOMBSTONES[array]
+    project = {'_id': False, 'version': True}
+    for field in fields:
+        project[field] = True
+
+    full = since is None or too_old(since)
+    if full:
+        project[array] = True
+    else:
+        # filtered in the pipeline, so only changes leave the server
+        project[array] = _changed(array, since)
+        project[tombstones] = _changed(tombstones, since)
+    if element_fields:
+        elements = {'$ifNull': [f'${array}', []]} if full else project[array]
+        project[array] = _only(elements, element_fields)
+
+    docs = yield collection.aggregate([
+        {'$match': {'user_email': user_email}},
+        {'$limit': 1},
+        {'$project': project}
+    ])
+    if not docs:
+        return None
+
+    doc = docs[0]
+    elements = doc.get(array) or []
+    removed = doc.get(tombstones) or []
+
+    result = {field: doc.get(field) for field in fields}
+    result[array] = elements
+    # Each $currentDate path of one update gets its own timestamp, so an
+    # element can be a tick ahead of the document; report the newest seen
+    result['version'] = max(
+        [doc.get('version', ZERO), since or ZERO] +
+        [e['v'] for e in elements + removed if isinstance(e.get('v'), Timestamp)]
+    )
+    if since is not None:
+        result['deleted'] = [t['id'] for t in removed]
+        result['full'] = full
+    return result
+
+
+def stamp_new(collection, user_email, array, ids):
+    # Second write after a $push: the pushed elements cannot be stamped by
+    # the update that creates them
+    yield collection.update_one(
+        {'user_email': user_email},
+        stamp({}, f'{array}.$[new].v'),
+        array_filters=[{'new.id': {'$in': list(ids)}, 'new.v': {'$exists': False}}]
+    )
+
+
+def remove(collection, user_email, array, element_filter, element_id, update=None):
+    # Pulls the element and leaves a tombstone; returns the removed element,
+    # or None if nothing matched. `update` may add operators on other fields.
+    tombstones = TOMBSTONES[array]
+    update = stamp(dict(update or {}))
+    update['$pull'] = {array: element_filter}
+    update['$push'] = {tombstones: {'id': element_id}}
+
+    doc = yield collection.find_one_and_update(
+        {'user_email': user_email, array: {'$elemMatch': element_filter}},
+        update,
+        projection={'_id': False, array: {'$elemMatch': element_filter}, tombstones: {'$slice': 1}}
+    )
+    if doc is None:
+        return None
+
+    yield from stamp_new(collection, user_email, tombstones, [element_id])
+
+    # oldest tombstone first: prune once it is past retention
+    oldest = (doc.get(tombstones) or [{}])[0].get('v')
+    cutoff = _cutoff()
+    if isinstance(oldest, Timestamp) and oldest < cutoff:
+        yield collection.update_one(
+            {'user_email': user_email},
+            {'$pull': {tombstones: {'v': {'$lt': cutoff}}}}
+        )
+    return doc[array][0]